@@ -125,3 +125,89 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Compression
+# images are split into independently coded tiles that are encoded/decoded on a worker pool
+
+COMPRESSOR_TILE_SIZE = (512, 512)
+
+COMPRESSOR_PER_TILE_TABLES = False
+
+COMPRESSOR_WORKERS = os.cpu_count() or 1
+
+# tiles are coded on a pool of "thread"s or processes; jobs and views start their pools from threads of a
+# running server, so processes are started with "spawn" (or "forkserver") rather than forked
+COMPRESSOR_EXECUTOR = "spawn"
+
+# decodes for display, crops, thumbnails and previews run inside requests, a fresh process pool per request
+# would cost more than the decode itself
+COMPRESSOR_VIEW_EXECUTOR = "thread"
+
+# prediction filter applied before coding: "none", "left", "up", "paeth", "med",
+# "auto" (lowest residual entropy for the image) or "rows" (chosen per row)
+COMPRESSOR_PREDICTOR = "auto"
+
+# entropy coder: "huffman", "rans", or "auto" (whichever gives the smaller file for the image)
+COMPRESSOR_ENTROPY_CODER = "auto"
+
+# code runs of equal residuals as run tokens: True, False, or "auto" (when it makes the file smaller)
+COMPRESSOR_RUN_LENGTH = "auto"
+
+# up to this many sets of code tables per image (at most 6), every block of 128 symbols is coded with
+# the set that suits it; 1 keeps a single set
+COMPRESSOR_CODE_TABLES = 6
+
+# shared code tables trained per camera or scanner with manage.py train_dictionary; "auto" codes an image
+# with the dictionary registered for its EXIF make and model unless its own tables would be clearly smaller,
+# a dictionary id always tries that one, None never uses one
+COMPRESSOR_DICTIONARY = "auto"
+
+COMPRESSOR_DICTIONARY_DIR = "media/dictionaries/"
+
+# uploads are streamed through the compressor in row bands, peak memory stays near this many bytes
+# (None compresses the whole image in memory)
+COMPRESSOR_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# uploads are queued and compressed on a pool of threads in the web process,
+# 0 workers compresses inside the upload request
+COMPRESSOR_JOB_WORKERS = 2
+
+# queued plus running jobs before uploads are refused with a 503
+COMPRESSOR_JOB_QUEUE_DEPTH = 16
+
+# compressed files, sharded by content hash
+COMPRESSOR_BLOB_ROOT = "media/blobs/"
+
+# longest sides of the JPEG previews made while an upload is compressed and stored next to its blob,
+# pages show these instead of decoding the file
+COMPRESSOR_PREVIEW_SIZES = (256, 1024, 2048)
+
+# decoded images and rendered responses kept for decompress_and_display, least recently used go first;
+# rendered responses also spill to COMPRESSOR_CACHE_DIR when it is set
+COMPRESSOR_CACHE_BYTES = 256 * 1024 * 1024
+
+COMPRESSOR_CACHE_DIR = None  # e.g. "media/cache/"
+
+COMPRESSOR_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+
+# uploads are hashed as they arrive so repeated uploads reuse the stored original and its results
+FILE_UPLOAD_HANDLERS = [
+    "compressor.uploads.HashingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# stage timings, byte counters and entropy vs achieved bits per symbol of every compression,
+# aggregated at /metrics/ over the last COMPRESSOR_METRICS_WINDOW spans per stage
+COMPRESSOR_METRICS = True
+
+COMPRESSOR_METRICS_WINDOW = 1000
+
+# compressor progress and results go to the console, DEBUG adds every stage timing
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"compressor": {"handlers": ["console"], "level": "INFO"}},
+}
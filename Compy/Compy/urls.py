@@ -17,13 +17,23 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include 
-from compressor.views import upload_image, compressed_image_detail, decompress_and_display
+from compressor.views import upload_image, compression_job, compression_job_status, compressed_image_detail, compression_history, compression_stats, decompress_and_display, decompress_crop, decompress_thumbnail, compressed_preview, download_compressed, metrics_view, cache_stats
 
 urlpatterns = [
     path("admin/", admin.site.urls),
 
     path('', upload_image, name='upload_raw'),
+    path('jobs/<int:pk>/', compression_job, name='compression_job'),
+    path('jobs/<int:pk>/status/', compression_job_status, name='compression_job_status'),
+    path('compressed/history/', compression_history, name='compression_history'),
+    path('compressed/stats/', compression_stats, name='compression_stats'),
     path('compressed/<int:pk>/', compressed_image_detail, name='compressed_image_detail'),
     path('decompress/<int:pk>/', decompress_and_display, name='decompress_display_image'),
+    path('decompress/<int:pk>/crop/', decompress_crop, name='decompress_crop'),
+    path('decompress/<int:pk>/thumbnail/', decompress_thumbnail, name='decompress_thumbnail'),
+    path('compressed/<int:pk>/download/', download_compressed, name='download_compressed'),
+    path('compressed/<int:pk>/preview/<int:size>/', compressed_preview, name='compressed_preview'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('cache/stats/', cache_stats, name='cache_stats'),
 
 ]
@@ -1,34 +1,190 @@
+import os
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog
-from PIL import Image, ImageTk
-from models import CompressedImage  # Assuming you have a module named 'compress_image' for image compression
-
-def compress_image():
-    file_path = filedialog.askopenfilename()
-    if file_path:
-        try:
-            compressor = CompressedImage(file_path, quality=0.6)
-            compressed_image = compressor.CompressedImage()
-            img = Image.open(compressed_image)
-            img.thumbnail((300, 300))  # Adjust the size as needed
-            img_tk = ImageTk.PhotoImage(img)
-            preview_label.config(image=img_tk)
-            preview_label.image = img_tk
-        except Exception as e:
-            print(f"Error compressing image: {e}")
-
-# Create the GUI window
-window = tk.Tk()
-window.title("Image Compressor")
-
-# Add a button to select and compress the image
-compress_btn = tk.Button(window, text="Compress Image", command=compress_image)
-compress_btn.pack(padx=20, pady=10)
-
-# Add a label to display the compressed image
-preview_label = tk.Label(window)
-preview_label.pack(padx=20, pady=10)
-
-# Run the GUI application
-window.mainloop()
+from collections import defaultdict
+from tkinter import filedialog, ttk
 
+from PIL import ImageTk
+
+from compressor.src import metrics
+from compressor.src.batch import IMAGE_EXTENSIONS
+from compressor.src.codec import Encoder
+from compressor.src.tables import MAX_TABLE_SETS
+
+# the window only ever talks to the compressor through a queue: a background thread compresses the chosen
+# files one after another (their tiles on a process pool) and posts progress, stage timings and results,
+# which the window picks up every POLL_MS
+POLL_MS = 100
+PREVIEW_SIZE = 300
+# images are streamed in bands under this many bytes, small enough for the progress bars to move and a
+# cancel to land within a fraction of a second
+MEMORY_LIMIT = 32 << 20
+
+
+class Cancelled(Exception):
+    pass
+
+
+class QueueSink(metrics.MetricsSink):
+    # forwards every finished compressor stage to the window
+    def __init__(self, events):
+        self.events = events
+
+    def span(self, stage, seconds, nbytes=0):
+        self.events.put(('span', stage, seconds, nbytes))
+
+
+class CompressorApp:
+    def __init__(self, window):
+        self.window = window
+        self.events = queue.Queue()
+        self.cancel = threading.Event()
+        self.worker = None
+        metrics.add_sink(QueueSink(self.events))
+
+        buttons = tk.Frame(window)
+        buttons.pack(padx=20, pady=10)
+        # Add a button to select and compress images
+        self.compress_btn = tk.Button(buttons, text="Compress Images...", command=self.choose_files)
+        self.compress_btn.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = tk.Button(buttons, text="Cancel", command=self.cancel.set, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+
+        self.file_label = tk.Label(window, text="No images selected")
+        self.file_label.pack(padx=20)
+        self.file_bar = ttk.Progressbar(window, length=400, maximum=100)
+        self.file_bar.pack(padx=20, pady=2)
+        self.total_bar = ttk.Progressbar(window, length=400, maximum=100)
+        self.total_bar.pack(padx=20, pady=2)
+        # stage that finished last, and MB/s of every stage of the current file
+        self.stage_label = tk.Label(window, text="")
+        self.stage_label.pack(padx=20)
+        self.rate_label = tk.Label(window, text="")
+        self.rate_label.pack(padx=20)
+
+        self.results = tk.Listbox(window, width=70, height=8)
+        self.results.pack(padx=20, pady=10)
+        # Add a label to display a preview of the last compressed image
+        self.preview_label = tk.Label(window)
+        self.preview_label.pack(padx=20, pady=10)
+
+        window.protocol("WM_DELETE_WINDOW", self.close)
+        window.after(POLL_MS, self.poll)
+
+    def choose_files(self):
+        paths = filedialog.askopenfilenames(filetypes=[
+            ("Images", ' '.join('*' + extension for extension in IMAGE_EXTENSIONS)), ("All files", '*')])
+        if not paths or (self.worker is not None and self.worker.is_alive()):
+            return
+        self.cancel.clear()
+        self.compress_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.results.delete(0, tk.END)
+        self.batch_start = time.perf_counter()
+        self.raw_bytes = self.compressed_bytes = 0
+        self.index, self.total = 0, len(paths)
+        self.worker = threading.Thread(target=self.compress_files, args=(list(paths),), daemon=True)
+        self.worker.start()
+
+    def compress_files(self, paths):
+        # background thread, every .huf is written next to its source; the pool is spawned, not forked
+        # from a process running the Tk loop
+        encoder = Encoder(workers=os.cpu_count() or 1, executor='spawn', memory_limit=MEMORY_LIMIT,
+                          predictor='auto', entropy_coder='auto', run_length='auto', code_tables=MAX_TABLE_SETS,
+                          progress=self.report_progress, previews=(PREVIEW_SIZE,))
+        for index, path in enumerate(paths):
+            if self.cancel.is_set():
+                break
+            self.events.put(('file', index, len(paths), path))
+            output = path + '.huf'
+            try:
+                encoder.compress_file(path, output)
+            except Cancelled:
+                os.remove(output)
+                self.events.put(('cancelled', path))
+                break
+            except Exception as error:
+                if os.path.exists(output):
+                    os.remove(output)
+                self.events.put(('failed', path, f'{type(error).__name__}: {error}'))
+                continue
+            hc = encoder.coder
+            preview = hc.preview_images[PREVIEW_SIZE] if hc.preview_images else None
+            self.events.put(('done', path, hc.raw_size, hc.compressed_size, preview))
+        self.events.put(('finished',))
+
+    def report_progress(self, fraction):
+        # called by the compressor between tile rows, so a cancel stops it within one band
+        if self.cancel.is_set():
+            raise Cancelled()
+        self.events.put(('progress', fraction))
+
+    def poll(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            getattr(self, 'on_' + event[0])(*event[1:])
+        self.window.after(POLL_MS, self.poll)
+
+    def on_file(self, index, total, path):
+        self.index, self.total = index, total
+        self.stage_seconds, self.stage_bytes = defaultdict(float), defaultdict(int)
+        self.file_label.config(text=f"Compressing {index + 1}/{total}: {os.path.basename(path)}")
+        self.file_bar['value'] = 0
+        self.total_bar['value'] = index / total * 100
+
+    def on_progress(self, fraction):
+        self.file_bar['value'] = fraction * 100
+        self.total_bar['value'] = (self.index + fraction) / self.total * 100
+
+    def on_span(self, stage, seconds, nbytes):
+        self.stage_seconds[stage] += seconds
+        self.stage_bytes[stage] += nbytes
+        self.stage_label.config(text=f"Stage: {stage}")
+        rates = [f"{name} {self.stage_bytes[name] / 1e6 / seconds:.1f} MB/s"
+                 for name, seconds in self.stage_seconds.items() if self.stage_bytes[name] and seconds]
+        self.rate_label.config(text=', '.join(rates))
+
+    def on_done(self, path, raw_size, compressed_size, preview):
+        self.raw_bytes += raw_size
+        self.compressed_bytes += compressed_size
+        seconds = time.perf_counter() - self.batch_start
+        self.results.insert(tk.END, f"{os.path.basename(path)}: {(1 - compressed_size / raw_size) * 100:.2f}% "
+                                    f"smaller ({raw_size / 1e6:.1f} MB -> {compressed_size / 1e6:.1f} MB)")
+        self.stage_label.config(text=f"{self.raw_bytes / 1e6:.1f} MB in {seconds:.1f}s, "
+                                     f"{self.raw_bytes / 1e6 / seconds:.1f} MB/s overall")
+        if preview is not None:
+            img_tk = ImageTk.PhotoImage(preview)
+            self.preview_label.config(image=img_tk)
+            self.preview_label.image = img_tk
+
+    def on_failed(self, path, error):
+        self.results.insert(tk.END, f"{os.path.basename(path)} failed: {error}")
+
+    def on_cancelled(self, path):
+        self.results.insert(tk.END, f"{os.path.basename(path)} cancelled")
+
+    def on_finished(self):
+        self.file_label.config(text=f"{self.results.size()} of {self.total} images handled")
+        if not self.cancel.is_set():
+            self.total_bar['value'] = 100
+        self.compress_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+
+    def close(self):
+        # a running file stops at its next tile row, the thread is a daemon and ends with the window
+        self.cancel.set()
+        self.window.destroy()
+
+
+if __name__ == '__main__':
+    # Create the GUI window
+    window = tk.Tk()
+    window.title("Image Compressor")
+    CompressorApp(window)
+    # Run the GUI application
+    window.mainloop()
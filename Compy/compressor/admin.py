@@ -1,8 +1,22 @@
 from django.contrib import admin
-from .models import RawImage, CompressedImage
+from .models import RawImage, CompressedImage, CompressionJob
 
 
 # Register your models here.
-admin.site.register(RawImage)
+@admin.register(RawImage)
+class RawImageAdmin(admin.ModelAdmin):
+    # uploads of the same content share a row, deleting drops one of their references and the row (with its
+    # file and compressed results) only goes with the last
+    readonly_fields = ('content_hash', 'ref_count')
+
+    def delete_model(self, request, obj):
+        obj.release()
+
+    def delete_queryset(self, request, queryset):
+        for image in queryset:
+            image.release()
+
+
 admin.site.register(CompressedImage)
+admin.site.register(CompressionJob)
 
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CompressorConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "compressor"
+    # collects the compressor's stage timings for the metrics view, None when COMPRESSOR_METRICS is off
+    metrics_sink = None
+
+    def ready(self):
+        from compressor.src import metrics
+        if settings.COMPRESSOR_METRICS and self.metrics_sink is None:
+            self.metrics_sink = metrics.add_sink(metrics.MemorySink(settings.COMPRESSOR_METRICS_WINDOW))
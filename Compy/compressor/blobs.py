@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+from compressor.src.hashing import file_sha256
+
+
+class BlobStore:
+    # content addressed files sharded by hash, <root>/<aa>/<bb>/<sha256><suffix>;
+    # identical payloads end up as one file
+    def __init__(self, root):
+        self.root = root
+
+    def temp_path(self, suffix='.huf'):
+        # somewhere to write a new payload, on the same filesystem so put_file can rename it into place
+        folder = os.path.join(self.root, 'tmp')
+        os.makedirs(folder, exist_ok=True)
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=folder)
+        os.close(handle)
+        return path
+
+    def path_for(self, checksum, suffix='.huf'):
+        return os.path.join(self.root, checksum[:2], checksum[2:4], checksum + suffix)
+
+    def put_file(self, temp_path, suffix='.huf'):
+        # moves a finished file into the store, returns its (path, size, checksum)
+        checksum = file_sha256(temp_path)
+        path = self.path_for(checksum, suffix)
+        size = os.path.getsize(temp_path)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path, size, checksum
+
+
+class RangeReader:
+    # file-like view of length bytes from the file's current position, for streaming a byte range
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def byte_range(range_header, size):
+    # (start, stop) of a single "bytes=" range, None to send the whole file, False if it lies past the end
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    first, _, last = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+        else:
+            # suffix range, the last n bytes
+            start = max(0, size - int(last))
+            stop = size if int(last) else 0
+    except ValueError:
+        return None
+    if start >= stop:
+        return False
+    return start, stop
+
+
+def blob_store():
+    return BlobStore(settings.COMPRESSOR_BLOB_ROOT)
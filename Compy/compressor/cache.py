@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# decoded pixels and rendered responses of compressed images, so viewing an image again skips the decoder
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def entry_size(value):
+    # bytes held by a cached value: bytes, numpy arrays, or tuples of them
+    if isinstance(value, tuple):
+        return sum(entry_size(item) for item in value)
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 0
+
+
+class LRUCache:
+    # memory tier bounded by max_bytes, plus an optional directory bounded by disk_bytes that only
+    # holds bytes values (rendered outputs), entries least recently used are evicted first
+    def __init__(self, max_bytes, disk_dir=None, disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+        self.disk_entries = OrderedDict()
+        self.disk_size = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            # pick up what an earlier process left, oldest first
+            paths = [entry.path for entry in os.scandir(disk_dir) if entry.is_file() and entry.name.endswith('.bin')]
+            for path in sorted(paths, key=os.path.getmtime):
+                self.disk_entries[path] = os.path.getsize(path)
+                self.disk_size += self.disk_entries[path]
+            self.evict_disk()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key]
+        value = self.read_disk(key)
+        with self.lock:
+            self.stats['disk_hits' if value is not None else 'misses'] += 1
+        if value is not None:
+            self.put(key, value, disk=False)
+        return value
+
+    def put(self, key, value, disk=True):
+        size = entry_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= entry_size(self.entries.pop(key))
+            if size <= self.max_bytes:
+                self.entries[key] = value
+                self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.size -= entry_size(old_value)
+                self.stats['evictions'] += 1
+        if disk and isinstance(value, bytes):
+            self.write_disk(key, value)
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.bin')
+
+    def read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self.disk_path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = file.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if path in self.disk_entries:
+                self.disk_entries.move_to_end(path)
+        os.utime(path)
+        return value
+
+    def write_disk(self, key, value):
+        if not self.disk_dir or len(value) > self.disk_bytes:
+            return
+        path = self.disk_path(key)
+        # written under a temporary name first, readers never see half a file
+        temp = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as file:
+            file.write(value)
+        os.replace(temp, path)
+        with self.lock:
+            self.disk_size += len(value) - self.disk_entries.pop(path, 0)
+            self.disk_entries[path] = len(value)
+        self.evict_disk()
+
+    def evict_disk(self):
+        while True:
+            with self.lock:
+                if self.disk_size <= self.disk_bytes or not self.disk_entries:
+                    return
+                path, size = self.disk_entries.popitem(last=False)
+                self.disk_size -= size
+                self.stats['disk_evictions'] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def counters(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size,
+                        disk_entries=len(self.disk_entries), disk_bytes=self.disk_size)
+
+
+def render_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LRUCache(settings.COMPRESSOR_CACHE_BYTES, settings.COMPRESSOR_CACHE_DIR,
+                              settings.COMPRESSOR_CACHE_DISK_BYTES)
+        return _cache
@@ -1,8 +1,25 @@
-from django import forms 
+import os
+
+from django import forms
 from .models import RawImage, CompressedImage
+from .src.bands import RAW_EXTENSIONS
+
+class RawImageUploadForm(forms.Form):
+    # form for user to submit a raw iamge
+    # camera RAW files are checked with rawpy, most of them fail Pillow's checks even though
+    # BandSource can read them; anything else has to be an image Pillow opens
+    image = forms.FileField()
 
-class RawImageUploadForm(forms.ModelForm):
-    # form for user to submit a raw iamge 
-    class Meta:
-        model = RawImage
-        fields = ['image']
\ No newline at end of file
+    def clean_image(self):
+        upload = self.cleaned_data['image']
+        if os.path.splitext(upload.name)[1].lower() not in RAW_EXTENSIONS:
+            return forms.ImageField().clean(upload)
+        import rawpy
+        try:
+            with rawpy.imread(upload):
+                pass
+        except (rawpy.LibRawError, OSError, ValueError):
+            raise forms.ValidationError("Upload a valid camera RAW file.", code='invalid_raw')
+        finally:
+            upload.seek(0)
+        return upload
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .blobs import blob_store
+from .models import CompressedImage, CompressionJob
+from compressor.src.codec import Encoder
+
+# uploads are compressed on a pool of threads inside the web process, job state lives in the database
+# so any process can answer status requests; each job still fans its tiles out on COMPRESSOR_WORKERS
+logger = logging.getLogger('compressor')
+_lock = threading.Lock()
+_pool = None
+_slots = None
+# ids of the jobs on this process's pool; jobs left queued or running by an earlier process never finish
+_owned = set()
+
+
+class QueueFull(Exception):
+    pass
+
+
+def job_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.COMPRESSOR_JOB_WORKERS, thread_name_prefix='compression')
+            # queued plus running jobs this process accepts before turning uploads away
+            _slots = threading.BoundedSemaphore(settings.COMPRESSOR_JOB_QUEUE_DEPTH)
+        return _pool
+
+
+def submit(job):
+    # hands the job to the pool, raises QueueFull when COMPRESSOR_JOB_QUEUE_DEPTH jobs are waiting
+    if settings.COMPRESSOR_JOB_WORKERS == 0:
+        # no pool, compress inside the request
+        run_job(job.pk)
+        return
+    pool = job_pool()
+    if not _slots.acquire(blocking=False):
+        raise QueueFull
+    with _lock:
+        _owned.add(job.pk)
+    try:
+        future = pool.submit(run_job, job.pk)
+    except BaseException:
+        release(job.pk)
+        raise
+    future.add_done_callback(lambda future: release(job.pk))
+
+
+def release(job_id):
+    with _lock:
+        _owned.discard(job_id)
+    _slots.release()
+
+
+def pending_job(original):
+    # a queued or running job of this process's pool compressing original, if any
+    with _lock:
+        owned = list(_owned)
+    return (original.compression_jobs.filter(pk__in=owned, status__in=[CompressionJob.QUEUED, CompressionJob.RUNNING])
+            .first())
+
+
+def compression_options(**overrides):
+    # HuffmanCompressor arguments that shape the compressed file, from settings unless overridden
+    options = {
+        'tile_size': settings.COMPRESSOR_TILE_SIZE,
+        'per_tile_tables': settings.COMPRESSOR_PER_TILE_TABLES,
+        'memory_limit': settings.COMPRESSOR_MEMORY_LIMIT,
+        'predictor': settings.COMPRESSOR_PREDICTOR,
+        'entropy_coder': settings.COMPRESSOR_ENTROPY_CODER,
+        'run_length': settings.COMPRESSOR_RUN_LENGTH,
+        'code_tables': settings.COMPRESSOR_CODE_TABLES,
+        'dictionary': settings.COMPRESSOR_DICTIONARY,
+        'dictionary_dir': settings.COMPRESSOR_DICTIONARY_DIR,
+    }
+    options.update(overrides)
+    return options
+
+
+def compression_params(**overrides):
+    # every setting that changes the compressed file, workers and executor only change how fast it is made
+    from compressor.src.compressor import VERSION
+    return json.dumps(dict(compression_options(**overrides), version=VERSION), sort_keys=True)
+
+
+def find_compressed(original, params=None):
+    # an earlier result for the same content and settings, if any
+    digest = CompressedImage.digest(params or compression_params())
+    return CompressedImage.objects.filter(original=original, params_digest=digest).order_by('-pk').first()
+
+
+def run_job(job_id):
+    close_old_connections()
+    try:
+        job = CompressionJob.objects.select_related('original').get(pk=job_id)
+        job.status = CompressionJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+        try:
+            # an identical upload may have been compressed while this job waited
+            job.compressed = find_compressed(job.original) or compress(job)
+            job.status = CompressionJob.DONE
+            job.progress = 1
+        except Exception as error:
+            logger.exception("compression job %s failed", job_id)
+            job.status = CompressionJob.FAILED
+            job.error = str(error) or type(error).__name__
+        job.finished_at = timezone.now()
+        job.save(update_fields=['compressed', 'status', 'progress', 'error', 'finished_at'])
+    finally:
+        close_old_connections()
+
+
+def compress(job):
+    def progress(fraction):
+        CompressionJob.objects.filter(pk=job.pk).update(progress=fraction)
+
+    from compressor.src.compressor import CODER_NAMES
+    from compressor.src.previews import save_previews
+
+    original = job.original
+    params = compression_params()
+    store = blob_store()
+    temp_path = store.temp_path()
+    try:
+        encoder = Encoder(workers=settings.COMPRESSOR_WORKERS, executor=settings.COMPRESSOR_EXECUTOR,
+                          progress=progress, previews=settings.COMPRESSOR_PREVIEW_SIZES, **compression_options())
+        encoder.compress_file(original.image.path, temp_path)
+        hc = encoder.coder
+        path, size, checksum = store.put_file(temp_path)
+        if hc.preview_images:
+            save_previews(hc.preview_images, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # saving img data
+    return CompressedImage.objects.create(
+        original=original,
+        file_size=hc.raw_size,
+        compressed_size=size,
+        size_reduction=CompressedImage.reduction(hc.raw_size, size),
+        file_loc=path,
+        checksum=checksum,
+        params=params,
+        params_digest=CompressedImage.digest(params),
+        entropy_coder=CODER_NAMES[hc.entropy_coder],
+    )
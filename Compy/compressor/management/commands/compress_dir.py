@@ -0,0 +1,129 @@
+import logging
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from compressor.jobs import compression_options, compression_params
+from compressor.models import CompressedImage, RawImage, content_path
+from compressor.src.batch import MANIFEST_NAME, compress_dir, is_done, read_manifest
+
+
+class Command(BaseCommand):
+    help = ("Compress every image under a directory on a pool of processes. Reruns skip files the "
+            "manifest already lists as done; --db also records the results as RawImage/CompressedImage rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help="directory to compress, searched recursively")
+        parser.add_argument('--out', required=True, help="directory for the .huf files, mirrors the layout of root")
+        parser.add_argument('--workers', type=int, default=None, help="processes, defaults to the cpu count")
+        parser.add_argument('--manifest', default=None, help="defaults to <out>/manifest.jsonl")
+        parser.add_argument('--predictor', default=None)
+        parser.add_argument('--tile-size', type=int, default=None)
+        parser.add_argument('--memory-limit', type=int, default=None)
+        parser.add_argument('--entropy-coder', default=None, choices=['auto', 'huffman', 'rans'])
+        parser.add_argument('--run-length', default=None, choices=['auto', 'on', 'off'])
+        parser.add_argument('--code-tables', type=int, default=None, help="sets of code tables per image, 1 to 6")
+        parser.add_argument('--dictionary', default=None,
+                            help="code dictionary id, 'auto' for the one registered for each image's camera, or 'none'")
+        parser.add_argument('--source', default=None, help="camera or scanner of every image, instead of their EXIF")
+        parser.add_argument('--db', action='store_true', help="bulk insert database rows for the results")
+        parser.add_argument('--batch-size', type=int, default=500, help="rows per bulk insert with --db")
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f"{root} is not a directory")
+        if options['verbosity'] < 2:
+            # a line per file comes from on_record, the compressor's own info lines only at -v 2
+            logging.getLogger('compressor').setLevel(logging.WARNING)
+        overrides = {}
+        if options['predictor']:
+            overrides['predictor'] = options['predictor']
+        if options['tile_size']:
+            overrides['tile_size'] = (options['tile_size'], options['tile_size'])
+        if options['memory_limit']:
+            overrides['memory_limit'] = options['memory_limit']
+        if options['entropy_coder']:
+            overrides['entropy_coder'] = options['entropy_coder']
+        if options['code_tables']:
+            overrides['code_tables'] = options['code_tables']
+        if options['run_length']:
+            overrides['run_length'] = {'auto': 'auto', 'on': True, 'off': False}[options['run_length']]
+        if options['dictionary']:
+            overrides['dictionary'] = None if options['dictionary'] == 'none' else options['dictionary']
+        if options['source']:
+            overrides['source'] = options['source']
+        self.params = compression_params(**overrides)
+        self.params_digest = CompressedImage.digest(self.params)
+        self.batch_size = options['batch_size']
+        self.pending = []
+        if options['db']:
+            # files an interrupted run finished are skipped by the manifest, the rows of the batch it had not
+            # inserted yet are backfilled first; rows that already exist are left alone
+            manifest_path = options['manifest'] or os.path.join(options['out'], MANIFEST_NAME)
+            for record in read_manifest(manifest_path).values():
+                if os.path.exists(record['source']) and is_done(record, record['source']):
+                    self.pending.append(record)
+                    if len(self.pending) >= self.batch_size:
+                        self.save_rows()
+            self.save_rows()
+
+        def on_record(record, summary):
+            if record['error']:
+                self.stderr.write(f"[{summary['done']}/{summary['total'] - summary['skipped']}] "
+                                  f"{record['source']} failed: {record['error']}")
+                return
+            self.stdout.write(f"[{summary['done']}/{summary['total'] - summary['skipped']}] {record['source']} "
+                              f"{record['reduction']:.1f}% smaller, {summary['mb_per_s']:.1f} MB/s")
+            if options['db']:
+                self.pending.append(record)
+                if len(self.pending) >= self.batch_size:
+                    self.save_rows()
+
+        summary = compress_dir(root, options['out'], workers=options['workers'], manifest_path=options['manifest'],
+                               options=compression_options(**overrides), on_record=on_record)
+        if options['db']:
+            self.save_rows()
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['done'] - summary['failed']} compressed, {summary['skipped']} already done, "
+            f"{summary['failed']} failed in {summary['seconds']:.1f}s: {summary['raw_bytes'] / 1e6:.1f} MB -> "
+            f"{summary['compressed_bytes'] / 1e6:.1f} MB, {summary['mb_per_s']:.1f} MB/s, "
+            f"{summary['files_per_s']:.2f} files/s"))
+
+    def save_rows(self):
+        # one bulk insert per table for the whole batch instead of a save() per file
+        records, self.pending = self.pending, []
+        if not records:
+            return
+        hashes = {record['source_sha256']: record for record in records}
+        with transaction.atomic():
+            existing = set(RawImage.objects.filter(content_hash__in=hashes).values_list('content_hash', flat=True))
+            new = []
+            for content_hash, record in hashes.items():
+                if content_hash in existing:
+                    continue
+                image = RawImage(content_hash=content_hash, file_size=record['source_size'])
+                name = content_path(image, record['source'])
+                if not default_storage.exists(name):
+                    with open(record['source'], 'rb') as file:
+                        name = default_storage.save(name, File(file))
+                image.image.name = name
+                new.append(image)
+            RawImage.objects.bulk_create(new)
+            originals = dict(RawImage.objects.filter(content_hash__in=hashes).values_list('content_hash', 'pk'))
+            done = set(CompressedImage.objects.filter(original_id__in=originals.values(), params_digest=self.params_digest)
+                       .values_list('original_id', flat=True))
+            CompressedImage.objects.bulk_create([
+                CompressedImage(original_id=originals[record['source_sha256']],
+                                file_size=record['raw_size'],
+                                compressed_size=record['compressed_size'],
+                                size_reduction=record['reduction'],
+                                file_loc=os.path.abspath(record['output']),
+                                checksum=record['sha256'],
+                                params=self.params,
+                                params_digest=self.params_digest,
+                                entropy_coder=record['entropy_coder'])
+                for record in hashes.values() if originals[record['source_sha256']] not in done])
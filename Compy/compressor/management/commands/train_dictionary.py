@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from compressor.src.batch import find_images
+from compressor.src.dictionaries import DictionaryStore, format_id, train_dictionary
+
+
+class Command(BaseCommand):
+    help = ("Train shared code tables on a sample corpus from one camera or scanner and register them in "
+            "COMPRESSOR_DICTIONARY_DIR. Images whose EXIF names that source are then coded with the dictionary's "
+            "id instead of their own tables.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="images, or directories searched recursively")
+        parser.add_argument('--source', default=None,
+                            help="camera or scanner the dictionary is for, defaults to the first image's EXIF make "
+                                 "and model")
+        parser.add_argument('--predictor', default=None)
+        parser.add_argument('--tile-size', type=int, default=None)
+        parser.add_argument('--entropy-coder', default=None, choices=['auto', 'huffman', 'rans'])
+        parser.add_argument('--run-length', action='store_true', help="train on run tokens")
+        parser.add_argument('--code-tables', type=int, default=None, help="sets of code tables, 1 to 6")
+
+    def handle(self, *args, **options):
+        images = []
+        for path in options['paths']:
+            if os.path.isdir(path):
+                images.extend(find_images(path))
+            elif os.path.isfile(path):
+                images.append(path)
+            else:
+                raise CommandError(f"{path} does not exist")
+        source = options['source']
+        if source is None and images:
+            from compressor.src.bands import BandSource
+            source = BandSource(images[0]).source
+        tile_size = options['tile_size'] or settings.COMPRESSOR_TILE_SIZE
+        try:
+            dictionary = train_dictionary(
+                images, source=source,
+                entropy_coder=options['entropy_coder'] or settings.COMPRESSOR_ENTROPY_CODER,
+                predictor=options['predictor'] or settings.COMPRESSOR_PREDICTOR,
+                run_length=options['run_length'],
+                code_tables=options['code_tables'] or settings.COMPRESSOR_CODE_TABLES,
+                tile_size=(tile_size, tile_size) if isinstance(tile_size, int) else tile_size)
+        except ValueError as error:
+            raise CommandError(str(error))
+        dictionary_id = DictionaryStore(settings.COMPRESSOR_DICTIONARY_DIR).register(dictionary)
+        self.stdout.write(self.style.SUCCESS(
+            f"code dictionary {format_id(dictionary_id)} trained on {len(images)} images"
+            + (f", registered for {source}" if source else ", no source to register it for")))
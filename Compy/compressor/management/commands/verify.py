@@ -0,0 +1,42 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from compressor.models import CompressedImage
+from compressor.src.verify import verify_files
+
+
+class Command(BaseCommand):
+    help = ("Check compressed files against the CRCs they carry, on a pool of processes, and name every "
+            "corrupt block. Without paths every file in the blob store the database knows of is checked.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help=".huf files, or directories searched recursively")
+        parser.add_argument('--workers', type=int, default=None, help="processes, defaults to the cpu count")
+        parser.add_argument('--decode', action='store_true',
+                            help="also decode every tile and check its pixels, slower than checking the bytes")
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            logging.getLogger('compressor').setLevel(logging.WARNING)
+        paths = options['paths'] or sorted(set(CompressedImage.objects.exclude(file_loc=None)
+                                               .values_list('file_loc', flat=True)))
+
+        def on_record(record, summary):
+            prefix = f"[{summary['done']}/{summary['total']}] {record['path']}"
+            if record['error']:
+                self.stderr.write(f"{prefix} could not be checked: {record['error']}")
+            for block in record['blocks']:
+                where = f"block {block['tile']} (tile {block['box']})" if block['tile'] is not None else "file"
+                self.stderr.write(f"{prefix} {where} at byte {block['offset']}: {block['error']}")
+            if not record['error'] and not record['blocks'] and options['verbosity'] >= 2:
+                self.stdout.write(f"{prefix} ok, {summary['mb_per_s']:.1f} MB/s")
+
+        summary = verify_files(paths, workers=options['workers'], decode=options['decode'],
+                               dictionary_dir=settings.COMPRESSOR_DICTIONARY_DIR, on_record=on_record)
+        message = (f"{summary['done'] - summary['corrupt']} intact, {summary['corrupt']} corrupt in "
+                   f"{summary['seconds']:.1f}s: {summary['bytes'] / 1e6:.1f} MB, {summary['mb_per_s']:.1f} MB/s")
+        if summary['corrupt']:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(message))
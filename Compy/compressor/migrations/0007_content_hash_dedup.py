@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:59
+
+import compressor.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0006_compressionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressedimage',
+            name='params',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='rawimage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='rawimage',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='compressionjob',
+            name='compressed',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='compressor.compressedimage'),
+        ),
+        migrations.AlterField(
+            model_name='rawimage',
+            name='image',
+            field=models.ImageField(upload_to=compressor.models.content_path),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0007_content_hash_dedup'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='compressedimage',
+            name='binary_image',
+        ),
+        migrations.RemoveField(
+            model_name='compressedimage',
+            name='huffman_codes',
+        ),
+        migrations.AddField(
+            model_name='compressedimage',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='compressedimage',
+            name='compressed_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0008_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressedimage',
+            name='entropy_coder',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+def strip_percent(apps, schema_editor):
+    # "41.82%" -> "41.82" so the column converts to a number, anything unparsable becomes null
+    CompressedImage = apps.get_model('compressor', 'CompressedImage')
+    for pk, text in CompressedImage.objects.exclude(size_reduction=None).values_list('pk', 'size_reduction').iterator():
+        try:
+            value = str(float(text.strip().rstrip('%')))
+        except ValueError:
+            value = None
+        CompressedImage.objects.filter(pk=pk).update(size_reduction=value)
+
+
+def add_percent(apps, schema_editor):
+    CompressedImage = apps.get_model('compressor', 'CompressedImage')
+    for pk, value in CompressedImage.objects.exclude(size_reduction=None).values_list('pk', 'size_reduction').iterator():
+        CompressedImage.objects.filter(pk=pk).update(size_reduction=f"{float(value):.2f}%")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0009_compressedimage_entropy_coder'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_percent, add_percent),
+        migrations.AlterField(
+            model_name='compressedimage',
+            name='size_reduction',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='compressedimage',
+            index=models.Index(fields=['-compressed_at', '-id'], name='compressed_history_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_digests(apps, schema_editor):
+    # rows share a handful of distinct params, one update per distinct JSON
+    CompressedImage = apps.get_model('compressor', 'CompressedImage')
+    for params in CompressedImage.objects.values_list('params', flat=True).distinct():
+        CompressedImage.objects.filter(params=params).update(params_digest=hashlib.sha256(params.encode()).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0010_numeric_size_reduction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressedimage',
+            name='params_digest',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='compressedimage',
+            name='params',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+    ]
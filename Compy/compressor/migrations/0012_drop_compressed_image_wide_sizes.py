@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compressor', '0011_params_digest'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='compressedimage',
+            name='compressed_image',
+        ),
+        migrations.AlterField(
+            model_name='compressedimage',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='rawimage',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
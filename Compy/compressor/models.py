@@ -1,12 +1,31 @@
-from django.db import models
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .uploads import file_hash
 
 # Create your models here.
 
+def content_path(instance, filename):
+    # originals are stored under their content hash, so identical uploads share one file
+    extension = os.path.splitext(filename)[1].lower()
+    return f'assets/originals/{instance.content_hash[:2]}/{instance.content_hash}{extension}'
+
+
 class RawImage(models.Model):
     # Store the original image
-    image = models.ImageField(upload_to='assets/originals/')
+    image = models.ImageField(upload_to=content_path)
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    file_size = models.PositiveIntegerField(default=0)
+    file_size = models.PositiveBigIntegerField(default=0)
+    # sha256 of the file, one row per distinct content (null for images stored before hashing)
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # uploads sharing this row, the file and its compressed results go once it drops to zero
+    ref_count = models.PositiveIntegerField(default=1)
 
     # autopopulate file size attr when saving the image 
     def save(self, *args, **kwargs): 
@@ -14,16 +33,95 @@ class RawImage(models.Model):
             self.file_size = self.image.file.size # 
         super(RawImage, self).save(*args, **kwargs)
 
+    @classmethod
+    def store(cls, upload, content_hash=None):
+        # the row holding this content, with one more reference if it already existed
+        content_hash = content_hash or file_hash(upload)
+        for attempt in range(2):
+            updated = cls.objects.filter(content_hash=content_hash).update(ref_count=F('ref_count') + 1)
+            if updated:
+                return cls.objects.get(content_hash=content_hash)
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(image=upload, content_hash=content_hash)
+            except IntegrityError:
+                # stored by a concurrent upload in the meantime
+                if attempt:
+                    raise
+
+    def release(self):
+        # drops one reference, deleting the row (and through it the files) with the last one
+        with transaction.atomic():
+            RawImage.objects.filter(pk=self.pk, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+            RawImage.objects.filter(pk=self.pk, ref_count=0).delete()
+
 class CompressedImage(models.Model):
     # foreing Key to the original image
     original = models.ForeignKey(RawImage, on_delete=models.CASCADE, related_name='compressed_images')
-    # store the compressed image
-    compressed_image = models.ImageField(upload_to='images/compressed/')
+    # the compressed file lives in the blob store, the row only knows where, how big and its sha256
     file_loc = models.TextField(null=True,max_length=200)
+    checksum = models.CharField(max_length=64, blank=True, default='', db_index=True)
     # compression metrics 
-    size_reduction = models.TextField(null=True,max_length=200) # % reduction of file size after compression 
-    binary_image = models.TextField(default=0) # binary of huffman encoded image
-    huffman_codes = models.TextField(default=0) # stores the conversion b/w raw val and huffman encoding
-    file_size = models.PositiveIntegerField(default=0)  # stores file size in bytes
-    compressed_size = models.PositiveIntegerField(default=0)
+    size_reduction = models.FloatField(null=True) # % reduction of file size after compression, summed and averaged in SQL
+    file_size = models.PositiveBigIntegerField(default=0)  # stores file size in bytes
+    compressed_size = models.PositiveBigIntegerField(default=0)
     compressed_at = models.DateTimeField(auto_now_add=True) # time of compression 
+    # settings the file was compressed with as JSON, results are reused for the same original and
+    # params_digest, the sha256 of params, so the lookup does not depend on how long the JSON grows
+    params = models.TextField(blank=True, default='')
+    params_digest = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # entropy coder the file was written with ('huffman' or 'rans'), also recorded in its header
+    entropy_coder = models.CharField(max_length=16, blank=True, default='')
+
+    class Meta:
+        # the history is paged newest first on (compressed_at, id), without sorting the table
+        indexes = [models.Index(fields=['-compressed_at', '-id'], name='compressed_history_idx')]
+
+    @staticmethod
+    def digest(params):
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    @staticmethod
+    def reduction(raw_size, compressed_size):
+        # % of raw_size saved, negative when the compressed file came out larger
+        return round((1 - compressed_size / raw_size) * 100, 2) if raw_size else None
+
+class CompressionJob(models.Model):
+    # an upload waiting for (or going through) compression on the job pool
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    original = models.ForeignKey(RawImage, on_delete=models.CASCADE, related_name='compression_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.FloatField(default=0) # fraction of the image coded so far
+    error = models.TextField(blank=True, default='')
+    # filled in once the job finishes
+    compressed = models.ForeignKey(CompressedImage, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+
+@receiver(post_delete, sender=RawImage)
+def delete_original_file(sender, instance, **kwargs):
+    # the row is the file's only owner, every upload of the same content shares it
+    if instance.image:
+        instance.image.delete(save=False)
+
+
+@receiver(post_delete, sender=CompressedImage)
+def delete_compressed_file(sender, instance, **kwargs):
+    # blobs are content addressed, identical results share a file
+    if instance.checksum:
+        shared = CompressedImage.objects.filter(checksum=instance.checksum).exists()
+    else:
+        shared = CompressedImage.objects.filter(file_loc=instance.file_loc).exists()
+    if instance.file_loc and not shared and os.path.exists(instance.file_loc):
+        os.remove(instance.file_loc)
+        from compressor.src.previews import preview_path
+        for size in settings.COMPRESSOR_PREVIEW_SIZES:
+            if os.path.exists(preview_path(instance.file_loc, size)):
+                os.remove(preview_path(instance.file_loc, size))
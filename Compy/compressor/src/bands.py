@@ -0,0 +1,190 @@
+import contextlib
+import os
+
+import numpy as np
+from PIL import Image
+
+# PIL modes whose raw layout is one uint8 per channel, keyed by channel count
+MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+# PIL modes holding 16 bit samples
+WIDE_MODES = ('I;16', 'I;16L', 'I;16B', 'I')
+# PIL modes stored as the colours they show: palette indices mean nothing without their palette and
+# 1 bit images would be read back as packed bits
+CONVERTED_MODES = {'1': 'L', 'P': 'RGB', 'PA': 'RGBA'}
+# camera RAW formats, read through rawpy so the sensor data keeps its native bit depth
+RAW_EXTENSIONS = ('.nef', '.nrw', '.cr2', '.cr3', '.arw', '.dng', '.raf', '.orf', '.rw2', '.pef', '.srw')
+# a Bayer mosaic is stored as its four colour filter planes, (rows / 2, cols / 2, 4) in this order
+CFA_MODE = 'BAYER'
+
+
+def sample_bits(pixels):
+    # smallest sample width that holds every value, at least a byte
+    return max(8, int(pixels.max(initial=0)).bit_length())
+
+
+def split_cfa(mosaic):
+    # (rows, cols) mosaic -> (rows / 2, cols / 2, 4) planes of the 2x2 pattern, row-major within the pattern
+    rows, cols = mosaic.shape
+    return mosaic.reshape(rows // 2, 2, cols // 2, 2).transpose(0, 2, 1, 3).reshape(rows // 2, cols // 2, 4)
+
+
+def merge_cfa(planes):
+    rows, cols = planes.shape[:2]
+    return planes.reshape(rows, cols, 2, 2).transpose(0, 2, 1, 3).reshape(rows * 2, cols * 2)
+
+
+def camera_name(exif):
+    # 'make model' from EXIF tags 271 and 272, None when neither is set
+    name = ' '.join(str(exif.get(tag, '')).strip('\x00 ') for tag in (271, 272)).strip()
+    return name or None
+
+
+class BandSource:
+    # reads an image a band of rows at a time
+    # .npy files and uncompressed PIL images (PPM/PGM, uncompressed TIFF strips) are read straight from
+    # the file a band at a time, anything else has to be decoded in full by PIL before bands are sliced
+    # samples are uint8, or uint16 when bits is over 8
+    # with memory_limit an image that has to be decoded in full is refused when it would not fit in it
+    def __init__(self, img_file, memory_limit=None):
+        self.img_file = img_file
+        self.memory_limit = memory_limit
+        self.strips = None
+        self.pixels = None
+        self.bits = 8
+        self.dtype = np.uint8
+        # camera or scanner make and model from the file's EXIF, None without one
+        self.source = None
+        if str(img_file).lower().endswith('.npy'):
+            self.open_npy(img_file)
+            return
+        if str(img_file).lower().endswith(RAW_EXTENSIONS):
+            self.open_raw(img_file)
+            return
+
+        image = Image.open(img_file)
+        frames = getattr(image, 'n_frames', 1)
+        if frames > 1:
+            # only the first frame would be stored
+            raise ValueError(f"{img_file} has {frames} frames, only single frame images can be compressed")
+        self.source = camera_name(image.getexif())
+        converted = image.mode in CONVERTED_MODES
+        if converted:
+            transparent = image.mode == 'P' and ('transparency' in image.info or image.palette.mode == 'RGBA')
+            image = image.convert('RGBA' if transparent else CONVERTED_MODES[image.mode])
+        self.mode = image.mode
+        channels = len(image.getbands())
+        self.shape = (image.height, image.width) if channels == 1 else (image.height, image.width, channels)
+        if image.mode in WIDE_MODES:
+            self.check_decoded(image.height * image.width * (4 if image.mode == 'I' else 2))
+            self.set_pixels(np.asarray(image))
+            return
+        # a file object is read in place, PIL has already copied an unseekable one into memory
+        # and a converted image only exists in memory
+        if not converted and (self.is_path() or img_file.seekable()):
+            self.strips = self.raw_strips(image)
+        if self.strips is None:
+            self.check_decoded(int(np.prod(self.shape)))
+            self.pixels = np.asarray(image, dtype=np.uint8)
+
+    def check_decoded(self, nbytes):
+        if self.memory_limit and nbytes > self.memory_limit:
+            raise ValueError(f"{self.img_file} has to be decoded in full into {nbytes} bytes, over the memory "
+                             f"limit of {self.memory_limit}; store it as uncompressed TIFF, PPM or .npy to stream it")
+
+    def set_pixels(self, pixels):
+        # decoded in full, sized to the widest sample
+        if pixels.min(initial=0) < 0 or pixels.max(initial=0) > 0xFFFF:
+            raise ValueError(f"{self.img_file} has samples outside 0..65535")
+        self.bits = sample_bits(pixels)
+        self.dtype = np.uint8 if self.bits <= 8 else np.uint16
+        self.pixels = pixels.astype(self.dtype)
+        self.shape = self.pixels.shape
+
+    def open_raw(self, img_file):
+        # the visible sensor area as stored, before demosaicing, white balance or gamma
+        import rawpy
+        with rawpy.imread(str(img_file)) as raw:
+            self.check_decoded(raw.sizes.height * raw.sizes.width * 2)
+            mosaic = raw.raw_image_visible.copy()
+            pattern = raw.raw_pattern
+        try:
+            # most RAW formats are TIFF based, PIL reads their EXIF even when it cannot decode the pixels
+            with Image.open(img_file) as image:
+                self.source = camera_name(image.getexif())
+        except (OSError, ValueError):
+            pass
+        if pattern is not None and pattern.shape == (2, 2) and mosaic.shape[0] % 2 == 0 and mosaic.shape[1] % 2 == 0:
+            # each colour plane is smooth on its own, the interleaved mosaic is not
+            self.mode = CFA_MODE
+            self.set_pixels(split_cfa(mosaic))
+        else:
+            self.mode = 'I;16'
+            self.set_pixels(mosaic)
+
+    def open_npy(self, img_file):
+        with open(img_file, 'rb') as file:
+            version = np.lib.format.read_magic(file)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(file)
+            offset = file.tell()
+        if dtype not in (np.uint8, np.uint16) or fortran_order or len(shape) not in (2, 3):
+            raise ValueError(f"{img_file} does not hold a C-ordered uint8 or uint16 image")
+        self.shape = shape
+        if dtype == np.uint16:
+            # a single sample plane or the four planes of a mosaic, coded at the full 16 bits since the
+            # bit depth has to be known before the first band is read
+            if len(shape) == 3 and shape[2] != 4:
+                raise ValueError(f"{img_file} is neither a sample plane nor a (rows, cols, 4) colour filter array")
+            self.mode = 'I;16' if len(shape) == 2 else CFA_MODE
+            self.bits = 16
+            self.dtype = np.uint16
+        else:
+            self.mode = MODES[shape[2] if len(shape) == 3 else 1]
+        row_bytes = int(np.prod(shape[1:])) * np.dtype(dtype).itemsize
+        self.strips = [(0, shape[0], offset, row_bytes)]
+
+    def raw_strips(self, image):
+        # (top, bottom, file offset, stride) of every full width, top-down, uncompressed strip,
+        # or None if the file is not laid out that way
+        if image.mode not in MODES.values():
+            return None
+        row_bytes = image.width * len(image.getbands())
+        strips = []
+        for tile in image.tile:
+            codec, (left, top, right, bottom), offset, args = tile
+            args = tuple(args) if isinstance(args, (tuple, list)) else (args,)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 else 0
+            orientation = args[2] if len(args) > 2 else 1
+            if codec != 'raw' or rawmode != image.mode or orientation != 1 or left != 0 or right != image.width:
+                return None
+            strips.append((top, bottom, offset, stride or row_bytes))
+        if sum(bottom - top for top, bottom, offset, stride in strips) != image.height:
+            return None
+        return strips
+
+    def is_path(self):
+        return isinstance(self.img_file, (str, bytes, os.PathLike))
+
+    def open_file(self):
+        # a path is opened again for every band, a file object is seeked and read where it is
+        return open(self.img_file, 'rb') if self.is_path() else contextlib.nullcontext(self.img_file)
+
+    def rows(self, top, bottom):
+        if self.pixels is not None:
+            return np.ascontiguousarray(self.pixels[top:bottom])
+        band = np.empty((bottom - top,) + tuple(self.shape[1:]), dtype=self.dtype)
+        flat = band.view(np.uint8).reshape(bottom - top, -1)
+        row_bytes = flat.shape[1]
+        with self.open_file() as file:
+            for strip_top, strip_bottom, offset, stride in self.strips:
+                first, last = max(top, strip_top), min(bottom, strip_bottom)
+                if first >= last:
+                    continue
+                file.seek(offset + (first - strip_top) * stride)
+                if stride == row_bytes:
+                    file.readinto(memoryview(flat[first - top:last - top]).cast('B'))
+                else:
+                    rows = np.frombuffer(file.read((last - first) * stride), dtype=np.uint8)
+                    flat[first - top:last - top] = rows.reshape(-1, stride)[:, :row_bytes]
+        return band
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from compressor.src.bands import RAW_EXTENSIONS
+from compressor.src.codec import Encoder
+from compressor.src.compressor import CODER_NAMES
+from compressor.src.hashing import file_sha256
+
+# compresses every image under a directory on a pool of processes, one file per process at a time
+# results are appended to a JSON lines manifest as they finish, so a rerun skips what is already done
+IMAGE_EXTENSIONS = RAW_EXTENSIONS + ('.png', '.tif', '.tiff', '.ppm', '.pgm', '.pnm', '.bmp', '.npy')
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def find_images(root, extensions=IMAGE_EXTENSIONS):
+    # every matching file under root, in a stable order
+    found = []
+    for folder, folders, files in os.walk(root):
+        folders.sort()
+        found.extend(os.path.join(folder, name) for name in sorted(files) if name.lower().endswith(extensions))
+    return found
+
+
+def output_path(source, root, out_dir):
+    # out_dir mirrors the layout under root
+    return os.path.join(out_dir, os.path.relpath(source, root) + '.huf')
+
+
+def read_manifest(manifest_path):
+    # {source: last record}, a record cut short by an interrupted run is ignored
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['source']] = record
+    return records
+
+
+def is_done(record, source):
+    # finished before, and neither the source nor the output changed since
+    if record is None or record.get('error') or not os.path.exists(record['output']):
+        return False
+    stat = os.stat(source)
+    return record['source_size'] == stat.st_size and record['source_mtime_ns'] == stat.st_mtime_ns
+
+
+def compress_file(source, output, options):
+    # pool worker, returns the manifest record of one file
+    stat = os.stat(source)
+    record = {'source': source, 'output': output, 'source_size': stat.st_size,
+              'source_mtime_ns': stat.st_mtime_ns, 'error': None}
+    start = time.perf_counter()
+    temp = output + '.part'
+    try:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        encoder = Encoder(workers=1, **options)
+        encoder.compress_file(source, temp)
+        hc = encoder.coder
+        os.replace(temp, output)
+        record.update(raw_size=hc.raw_size, compressed_size=hc.compressed_size,
+                      reduction=round((1 - hc.compressed_size / hc.raw_size) * 100, 2),
+                      entropy_coder=CODER_NAMES[hc.entropy_coder],
+                      source_sha256=file_sha256(source), sha256=file_sha256(output))
+    except Exception as error:
+        record['error'] = f'{type(error).__name__}: {error}'
+        if os.path.exists(temp):
+            os.remove(temp)
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+class Throughput:
+    # running totals of a batch, raw MB per wall clock second since it started
+    def __init__(self, total):
+        self.total = total
+        self.done = self.failed = self.skipped = 0
+        self.raw_bytes = self.compressed_bytes = 0
+        self.start = time.perf_counter()
+
+    def add(self, record):
+        self.done += 1
+        if record['error']:
+            self.failed += 1
+        else:
+            self.raw_bytes += record['raw_size']
+            self.compressed_bytes += record['compressed_size']
+
+    def summary(self):
+        seconds = time.perf_counter() - self.start
+        return {'done': self.done, 'skipped': self.skipped, 'failed': self.failed, 'total': self.total,
+                'raw_bytes': self.raw_bytes, 'compressed_bytes': self.compressed_bytes, 'seconds': seconds,
+                'mb_per_s': self.raw_bytes / 1e6 / seconds if seconds else 0.0,
+                'files_per_s': self.done / seconds if seconds else 0.0}
+
+
+def compress_dir(root, out_dir, workers=None, manifest_path=None, options=None, on_record=None,
+                 extensions=IMAGE_EXTENSIONS):
+    # compresses every image under root into out_dir, skipping files the manifest says are done
+    # on_record(record, summary) is called as each file finishes; returns the final summary
+    options = options or {}
+    manifest_path = manifest_path or os.path.join(out_dir, MANIFEST_NAME)
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    previous = read_manifest(manifest_path)
+    sources = find_images(root, extensions)
+    todo = [source for source in sources if not is_done(previous.get(source), source)]
+    stats = Throughput(len(sources))
+    stats.skipped = len(sources) - len(todo)
+
+    with open(manifest_path, 'a') as manifest, ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(compress_file, source, output_path(source, root, out_dir), options)
+                   for source in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            # one line per file, flushed so a crash loses at most the files still in flight
+            manifest.write(json.dumps(record) + '\n')
+            manifest.flush()
+            stats.add(record)
+            if on_record is not None:
+                on_record(record, stats.summary())
+    return stats.summary()
@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from compressor.src.compressor import CODER_NAMES, HuffmanCompressor, VERSION
+
+# times every stage of HuffmanCompressor on deterministic synthetic images, e.g. from Compy/
+#   python -m compressor.src.benchmark --sizes 256 1024 --out bench.json
+#   python -m compressor.src.benchmark --baseline bench.json --threshold 0.2
+# stage times are the best of --repeats runs, peak bytes come from one extra run under tracemalloc
+KINDS = ['noise', 'gradient', 'flat', 'photo']
+STAGES = ['predict', 'count_frequency', 'make_huffman_tree', 'make_huffman_codes', 'huffman_encode',
+          'save', 'load', 'decode_image']
+SEED = 1234
+
+
+def synthetic_image(kind, size, channels=3, seed=SEED):
+    # (size, size, channels) uint8, the same for the same arguments on every machine
+    rng = np.random.default_rng([seed, KINDS.index(kind), size, channels])
+    y, x = np.mgrid[0:size, 0:size].astype(np.float64) / size
+    offsets = np.arange(channels) * 16
+    if kind == 'noise':
+        return rng.integers(0, 256, (size, size, channels), dtype=np.uint8)
+    if kind == 'gradient':
+        base = (x + y) * 127
+    elif kind == 'flat':
+        # large constant regions with a few blocky edges
+        base = (np.floor(x * 4) * 40 + np.floor(y * 3) * 25) % 256
+    else:
+        # smooth shading, some texture and sensor noise
+        base = 128 + 60 * np.sin(x * 9) * np.cos(y * 7) + 30 * np.sin((x + y) * 40)
+        base = base[..., None] + rng.normal(0, 3, (size, size, channels))
+        return (base + offsets).clip(0, 255).astype(np.uint8)
+    return (base[..., None] + offsets).clip(0, 255).astype(np.uint8)
+
+
+def run_stages(pixels, path, tile_size, predictor, workers, traced=False):
+    # every stage once, returns {stage: seconds}, {stage: traced peak bytes} (when traced) and the compressed size
+    times, peaks = {}, {}
+
+    def timed(stage, func, *args):
+        if traced:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = func(*args)
+        times[stage] = time.perf_counter() - start
+        if traced:
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    coder = HuffmanCompressor(tile_size=tile_size, workers=workers, predictor=predictor)
+    coder.shape = pixels.shape
+    coder.mode = 'RGB' if pixels.shape[2:] == (3,) else 'L'
+    coder.channels = int(np.prod(pixels.shape[2:]))
+    coder.per_channel_tables = False
+    coder.entropy_coder = CODER_NAMES.index('huffman')
+    coder.pixels = pixels
+
+    def predict():
+        coder.predictor = coder.resolve_predictor(pixels[:256])
+        return coder.predict_tiles(pixels, coder.tile_boxes())
+
+    coder.tiles, coder.row_predictors = timed('predict', predict)
+    coder.flat_img = np.concatenate(coder.tiles)
+    coder.freq = timed('count_frequency', coder.count_frequency)
+    tree = timed('make_huffman_tree', coder.make_huffman_tree)
+    coder.set_tables(timed('make_huffman_codes', coder.make_huffman_codes, tree)[None])
+    coder.compressed_img = timed('huffman_encode', coder.encode_tiles)
+    timed('save', coder.save_compressed_img, path)
+
+    decoder = HuffmanCompressor(workers=workers)
+    blocks = timed('load', decoder.load_compressed_img, path)
+    decoded = timed('decode_image', decoder.decode_image, blocks)
+    if not np.array_equal(decoded, pixels.reshape(-1)):
+        raise AssertionError("decoded image differs from the original")
+    return times, peaks, os.path.getsize(path)
+
+
+def benchmark(kinds, sizes, repeats=3, tile_size=None, predictor='auto', workers=1):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.huf')
+        for kind in kinds:
+            for size in sizes:
+                pixels = synthetic_image(kind, size)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    runs = [run_stages(pixels, path, tile_size, predictor, workers) for _ in range(repeats)]
+                    # tracing slows allocation heavy stages down, so memory gets a run of its own
+                    tracemalloc.start()
+                    try:
+                        _, peaks, compressed = run_stages(pixels, path, tile_size, predictor, workers, traced=True)
+                    finally:
+                        tracemalloc.stop()
+                megabytes = pixels.nbytes / 1e6
+                stages = {}
+                for stage in STAGES:
+                    seconds = min(times[stage] for times, _, _ in runs)
+                    stages[stage] = {'seconds': seconds, 'mb_per_s': megabytes / seconds if seconds else None,
+                                     'peak_bytes': peaks[stage]}
+                results[f'{kind}-{"x".join(map(str, pixels.shape))}'] = {
+                    'raw_bytes': pixels.nbytes, 'compressed_bytes': compressed,
+                    'ratio': pixels.nbytes / compressed, 'stages': stages}
+                print(f"{kind:>8} {size:>5}: ratio {pixels.nbytes / compressed:6.3f}  " +
+                      '  '.join(f"{stage} {stages[stage]['mb_per_s'] or 0:.1f}MB/s" for stage in STAGES))
+    return results
+
+
+def regressions(results, baseline, threshold, min_seconds):
+    # stages slower, and images compressing worse, than the baseline by more than threshold
+    found = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        if result['compressed_bytes'] > base['compressed_bytes'] * (1 + threshold):
+            found.append(f"{name}: {result['compressed_bytes']} bytes, baseline {base['compressed_bytes']}")
+        for stage, timing in result['stages'].items():
+            base_seconds = base['stages'].get(stage, {}).get('seconds')
+            if base_seconds is None or max(timing['seconds'], base_seconds) < min_seconds:
+                continue
+            if timing['seconds'] > base_seconds * (1 + threshold):
+                found.append(f"{name} {stage}: {timing['seconds']:.4f}s, baseline {base_seconds:.4f}s")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every HuffmanCompressor stage")
+    parser.add_argument('--kinds', nargs='+', default=KINDS, choices=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[256, 1024])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--tile-size', type=int, default=None)
+    parser.add_argument('--predictor', default='auto')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--out', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fail when a stage is this fraction slower than the baseline")
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help="stages faster than this in both runs are too noisy to compare")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.kinds, args.sizes, args.repeats, args.tile_size, args.predictor, args.workers)
+    report = {
+        'meta': {'version': VERSION, 'python': platform.python_version(), 'numpy': np.__version__,
+                 'machine': platform.machine(), 'cpus': os.cpu_count(), 'repeats': args.repeats,
+                 'tile_size': args.tile_size, 'predictor': args.predictor, 'workers': args.workers,
+                 # ru_maxrss is in KiB on Linux
+                 'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024},
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.threshold, args.min_seconds)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
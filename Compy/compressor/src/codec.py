@@ -0,0 +1,166 @@
+# encoder and decoder objects over the compressed file format, for callers that want bytes or pixels
+# instead of a HuffmanCompressor doing everything in its constructor
+#   for data in Encoder(predictor='auto').compress('photo.png'): sink.write(data)
+#   pixels = Decoder().decompress(open('photo.huf', 'rb'))
+# constructing either only records options, numpy, PIL and the coder are imported on first use
+
+
+class Encoder:
+    # the same options as HuffmanCompressor, reused for every image it compresses
+    def __init__(self, tile_size=None, per_tile_tables=False, workers=1, executor='process', memory_limit=None,
+                 predictor=None, per_channel_tables=None, progress=None, entropy_coder=None, run_length=False,
+                 code_tables=1, dictionary=None, dictionary_dir=None, source=None, previews=None):
+        self.options = {'tile_size': tile_size, 'per_tile_tables': per_tile_tables, 'workers': workers,
+                        'executor': executor, 'memory_limit': memory_limit, 'predictor': predictor,
+                        'per_channel_tables': per_channel_tables, 'progress': progress,
+                        'entropy_coder': entropy_coder, 'run_length': run_length, 'code_tables': code_tables,
+                        'dictionary': dictionary, 'dictionary_dir': dictionary_dir, 'source': source,
+                        'previews': previews}
+        # the coder of the last image, its raw_size, compressed_size, mode and shape
+        self.coder = None
+
+    def new_coder(self):
+        from compressor.src.compressor import HuffmanCompressor
+        self.coder = HuffmanCompressor(**self.options)
+        return self.coder
+
+    def compress(self, source):
+        # iterator of byte strings making up the compressed file of source (a path or binary file
+        # PIL can open), each block comes out as soon as it is coded
+        # with memory_limit the header comes first with its block index left zero, which the decoder
+        # does not need; compress_to fills it in when the output is seekable
+        return self.new_coder().iter_compress(source)
+
+    def compress_to(self, source, fileobj):
+        # writes the compressed file to an open binary file, returns its size
+        return self.new_coder().write_compressed(source, fileobj)
+
+    def compress_file(self, source, path):
+        with open(path, 'wb') as file:
+            return self.compress_to(source, file)
+
+
+class Decoder:
+    def __init__(self, workers=1, executor='process', dictionary_dir=None):
+        self.workers = workers
+        self.executor = executor
+        # where the code dictionaries of files coded with one are looked up
+        self.dictionary_dir = dictionary_dir
+        # the coder of the last file, its mode, shape and bits
+        self.coder = None
+
+    def open(self, source):
+        # reads the header and blocks of source, a path or binary file
+        from compressor.src.compressor import HuffmanCompressor
+        self.coder = HuffmanCompressor(workers=self.workers, executor=self.executor,
+                                       dictionary_dir=self.dictionary_dir)
+        return self.coder.load_compressed_img(source)
+
+    def decompress(self, source):
+        # the whole image as an array of its stored shape
+        blocks = self.open(source)
+        return self.coder.decode_image(blocks).reshape(self.coder.shape)
+
+    def iter_rows(self, source):
+        # the image as bands of rows, one row of tiles each
+        blocks = self.open(source)
+        return self.coder.decode_rows(blocks)
+
+    def decompress_region(self, source, top, bottom, left, right):
+        # rows top..bottom and columns left..right of the stored image, only the tiles they overlap are
+        # read and decoded, each down to the region's last row
+        from compressor.src.compressor import HuffmanCompressor
+        self.coder = HuffmanCompressor(workers=self.workers, executor=self.executor,
+                                       dictionary_dir=self.dictionary_dir)
+        container = self.coder.map_container(source)
+        region = self.clip(top, bottom, left, right, self.coder.shape[:2])
+        return self.coder.decode_region(region, *self.coder.region_blocks(*container, region))
+
+    def crop(self, source, left, top, right, bottom):
+        # PIL image of the box (left, top, right, bottom) of the displayed image, clipped to it
+        from compressor.src.compressor import HuffmanCompressor
+        self.coder = HuffmanCompressor(workers=self.workers, executor=self.executor,
+                                       dictionary_dir=self.dictionary_dir)
+        return self.crop_container(*self.coder.map_container(source), left, top, right, bottom)
+
+    def crop_container(self, data, offset, left, top, right, bottom):
+        # crop of a file self.coder has already mapped
+        # a mosaic is displayed at twice its stored planes' size, so its box is widened to whole planes
+        scale = self.coder.display_scale()
+        rows, cols = (size * scale for size in self.coder.shape[:2])
+        top, bottom, left, right = self.clip(top, bottom, left, right, (rows, cols))
+        region = (top // scale, -(-bottom // scale), left // scale, -(-right // scale))
+        pixels = self.coder.decode_region(region, *self.coder.region_blocks(data, offset, region))
+        image = self.to_image(pixels)
+        if scale == 1:
+            return image
+        return image.crop((left - region[2] * scale, top - region[0] * scale,
+                           right - region[2] * scale, bottom - region[0] * scale))
+
+    def thumbnail(self, source, size, box=None, previews=()):
+        # PIL image of box (the whole image by default) scaled down to fit in size x size
+        # previews are the sizes of the previews stored next to a source path (see previews.save_previews),
+        # the smallest one that still has size pixels across the box is scaled down instead of decoding
+        import os
+
+        from PIL import Image
+
+        from compressor.src.compressor import HuffmanCompressor
+        from compressor.src.previews import PreviewBuilder, preview_path
+        self.coder = HuffmanCompressor(workers=self.workers, executor=self.executor,
+                                       dictionary_dir=self.dictionary_dir)
+        data, offset = self.coder.map_container(source)
+        scale = self.coder.display_scale()
+        rows, cols = (length * scale for length in self.coder.shape[:2])
+        left, top, right, bottom = box or (0, 0, cols, rows)
+        top, bottom, left, right = self.clip(top, bottom, left, right, (rows, cols))
+        longest = max(bottom - top, right - left)
+        for level in sorted(previews) if isinstance(source, (str, os.PathLike)) else ():
+            path = preview_path(source, level)
+            if not os.path.exists(path):
+                continue
+            with Image.open(path) as preview:
+                ratio = max(preview.size) / max(rows, cols)
+                if longest * ratio >= min(size, longest):
+                    image = preview.crop((round(left * ratio), round(top * ratio),
+                                          max(round(left * ratio) + 1, round(right * ratio)),
+                                          max(round(top * ratio) + 1, round(bottom * ratio))))
+                    image.thumbnail((size, size))
+                    return image
+        if longest < 2 * size:
+            # close to the size asked for, the box is decoded and scaled down as it is
+            image = self.crop_container(data, offset, left, top, right, bottom)
+            image.thumbnail((size, size))
+            return image
+        # every pixel of a tile has to be entropy decoded to reach the next one, so the box is decoded a
+        # row of tiles at a time and box filtered as it goes; only one row of tiles is held at full size
+        region = (top // scale, -(-bottom // scale), left // scale, -(-right // scale))
+        boxes, blocks = self.coder.region_blocks(data, offset, region)
+        builder = PreviewBuilder((region[1] - region[0], region[3] - region[2]) + tuple(self.coder.shape[2:]),
+                                 self.coder.mode, (size,))
+        for tile_top in sorted({tile[0] for tile in boxes}):
+            row = [i for i, tile in enumerate(boxes) if tile[0] == tile_top]
+            band = (max(region[0], tile_top), min(region[1], boxes[row[0]][1]), region[2], region[3])
+            pixels = self.coder.decode_region(band, [boxes[i] for i in row], [blocks[i] for i in row])
+            builder.add(pixels, band[0] - region[0])
+        # a mosaic's box was widened to whole planes, by less than a pixel of the thumbnail
+        return builder.images()[size]
+
+    def verify(self, source, decode=False):
+        # BlockError of every corrupt block of source, a path or binary file, see HuffmanCompressor.verify
+        from compressor.src.compressor import HuffmanCompressor
+        self.coder = HuffmanCompressor(workers=self.workers, executor=self.executor,
+                                       dictionary_dir=self.dictionary_dir)
+        return self.coder.verify(source, decode)
+
+    @staticmethod
+    def clip(top, bottom, left, right, shape):
+        rows, cols = shape
+        region = (max(0, top), min(rows, bottom), max(0, left), min(cols, right))
+        if region[0] >= region[1] or region[2] >= region[3]:
+            raise ValueError("the region lies outside the image")
+        return region
+
+    def to_image(self, pixels):
+        # PIL image of decompressed pixels, see HuffmanCompressor.to_image
+        return self.coder.to_image(pixels)
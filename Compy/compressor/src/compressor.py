@@ -1,121 +1,1260 @@
 import re
+import mmap
+import multiprocessing
 import numpy as np
 from PIL import Image
 import heapq
 from collections import namedtuple
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import struct
+import zlib
+from compressor.src import metrics
+from compressor.src.bands import BandSource, CFA_MODE, WIDE_MODES, merge_cfa
+from compressor.src.dictionaries import DictionaryStore, format_id, parse_id
+from compressor.src.entropy import EntropyCoder, GROUP_SIZE, SEGMENT_SIZE, symbol_dtype, symbol_tables
+from compressor.src.rans import RansCoder
+from compressor.src.runs import RUN_TOKENS, from_runs, to_runs
+from compressor.src.tables import (MAX_TABLE_SETS, TrainingSample, cluster_tables, group_costs, pack_selectors,
+                                   sample_stride, sample_tiles, select_tables, set_count, unpack_selectors)
+from compressor.src.previews import PreviewBuilder
+from compressor.src.predict import PREDICTORS, NONE, PER_ROW, SAMPLE_ROWS, choose_predictor, predict_tile, unpredict_tiles
+
+logger = logging.getLogger('compressor')
+
+# pixels histogrammed per bincount call, bounds the temporary index array
+CHUNK_SIZE = 1 << 20
+# pixels encoded per batch, bounds the temporary per-bit arrays
+ENCODE_CHUNK = 1 << 20
+# codes are length limited so the decoder can always use a single lookup table,
+# 16 bits still fits a complete code over every symbol of a 16 bit alphabet
+MAX_CODE_LEN = 16
+# default ceiling for streaming compression, covers the pixel band and every worker's encoder batches
+MEMORY_LIMIT = 256 << 20
+# copies of a band streaming holds at once: the band, its residuals, their run tokens (up to twice as wide)
+# and its coded blocks, as arrays and as bytes
+BAND_COPIES = 6
+
+# compressed file layout (little endian):
+#   magic, version, mode length, mode, ndim, shape (u32 each)
+#   tile rows, tile cols, segment size (u32), flags, predictor (PER_ROW when every row picks its own),
+#   sample bits (symbols come from an alphabet of 2 ** bits, plus RUN_TOKENS run tokens with RUN_LENGTH),
+#   entropy coder (index into ENTROPY_CODERS), table sets (more than one when blocks carry selectors)
+#   shared tables, unless PER_TILE_TABLES: every table set is one table per channel with PER_CHANNEL_TABLES,
+#   else one, one value per symbol (Huffman code lengths as bytes, canonical codes are rebuilt from them, or
+#   rANS frequencies as u16), deflated behind a u32 size unless they are bytes over at most 8 bits;
+#   with SHARED_DICTIONARY only the u64 id of the code dictionary holding them
+#   tile count, offset of every block plus the end offset (u64, counted from the first block,
+#   left zero when the file was streamed to an unseekable sink), CRC32 of the header up to here (u32)
+#   blocks in row-major tile order, each:
+#     own code lengths (only with PER_TILE_TABLES, behind a u8 table count when there are table sets),
+#     predictor of every tile row (only with PER_ROW), coded symbol count (u32, only with RUN_LENGTH),
+#     set of every GROUP_SIZE symbols (u8 each, deflated behind a u32 size, only with table sets),
+#     segment count, payload bits, bit length of every segment (u16), payload,
+#     CRC32 of the block up to here and CRC32 of the tile's pixels (u32 each, see pixel_crc)
+MAGIC = b'HUFC'
+VERSION = 8
+PER_TILE_TABLES = 1
+PER_CHANNEL_TABLES = 2
+RUN_LENGTH = 4
+SHARED_DICTIONARY = 8
+# a code dictionary is used while its estimated output stays within this fraction of the image's own tables,
+# it saves building and storing them
+DICTIONARY_SLACK = 0.02
+
+Node = namedtuple('node', ['freq', 'order', 'pixel', 'left', 'right'])
+# tables is None for tiles coded with the shared tables, row_predictors unless predicting per row,
+# symbols is the run token count of a tile coded with run tokens, selectors the table set of its every group,
+# pixel_crc the pixel_crc of the tile it was coded from
+Block = namedtuple('Block', ['tables', 'segment_bits', 'bits', 'payload', 'row_predictors', 'symbols', 'selectors',
+                             'pixel_crc'], defaults=[None, None, None, None])
+# a block verify found corrupt: its tile number and box, and where it starts in the file
+BlockError = namedtuple('BlockError', ['tile', 'box', 'offset', 'error'])
 
 class HuffmanCompressor:
-    def __init__(self, img_file=None):
+    def __init__(self, img_file=None, save_path='Compy/assets', tile_size=None, per_tile_tables=False,
+                 workers=1, executor='process', memory_limit=None, predictor=None, per_channel_tables=None,
+                 progress=None, entropy_coder=None, run_length=False, code_tables=1, dictionary=None,
+                 dictionary_dir=None, source=None, previews=None):
         # defining a node object
+        self.Node = Node
+        self.save_path = save_path
+        # tile_size is (rows, cols) or a single number for square tiles, None codes the image as one tile
+        self.tile_size = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+        self.per_tile_tables = per_tile_tables
+        self.workers = workers
+        self.executor = executor
+        self.pool = None
+        # one of PREDICTORS, 'auto' for the one with the lowest residual entropy, or 'rows' to choose per row
+        self.predictor = predictor or 'none'
+        # a code per channel (symbol i of a tile uses table i % channels), None for Bayer mosaics only
+        self.per_channel_tables = per_channel_tables
+        # called with the fraction of the work done so far
+        self.progress = progress
+        # set, streams row bands from the source under this many bytes instead of decoding it whole
+        self.memory_limit = memory_limit
+        # name of one of ENTROPY_CODERS, or 'auto' for the one whose estimated output is smallest
+        self.entropy_coder = entropy_coder or 'huffman'
+        # code runs of equal residuals as run tokens, True, False or 'auto' when they shrink the estimated payload
+        self.run_length = run_length
+        # at most this many sets of tables, every GROUP_SIZE symbols are coded with the set that suits them
+        # best; sets are only kept when they make the output smaller
+        self.code_tables = min(code_tables, MAX_TABLE_SETS)
+        self.table_sets = 1
+        # shared tables from the code dictionaries in dictionary_dir: a dictionary id, or 'auto' for the one
+        # registered for the image's source; used unless the image's own tables would be clearly smaller
+        self.dictionary = dictionary
+        self.dictionary_dir = dictionary_dir
+        self.dictionary_id = None
+        # camera or scanner the image came from, None reads its EXIF make and model
+        self.source = source
+        # longest sides of the previews made from the pixels while they are read, {size: PIL image} in
+        # preview_images once compressed
+        self.previews = previews
+        self.preview_images = None
+        self.set_bits(8)
         if img_file:
-            self.Node = namedtuple('node', ['freq', 'pixels', 'left', 'right'])
-
-            self.image = Image.open(img_file)
-            print("loaded image...")
-            self.flat_img = np.array(self.image, dtype=np.uint8).flatten()
-            print("flattened image...")
-            self.freq = self.count_frequency()
-            print("counted frequencies...")
-            self.huffman_tree = self.make_huffman_tree()
-            print("created huffman tree...")
-            self.huffman_codes = {}
-            self.make_huffman_codes(self.huffman_tree)
-            print("generated huffman codes...")
-            #self.print_huffman_tree(self.huffman_tree)
-            self.compressed_img = self.huffman_encode()
-            print("\nImage Compression Successful!")
+            with open(self.save_path, 'wb') as file:
+                if self.memory_limit:
+                    logger.info("streaming compressed file to %s", self.save_path)
+                else:
+                    logger.debug("saving compressed image to %s", self.save_path)
+                self.write_compressed(img_file, file)
+
+            if (not self.per_tile_tables and self.memory_limit is None and logger.isEnabledFor(logging.DEBUG)
+                    and ENTROPY_CODERS[self.entropy_coder].name == 'huffman'):
+                logger.debug("huffman codes: %s", self.huffman_codes)
+
+    def iter_compress(self, img_file):
+        # the compressed file as a sequence of byte strings, the header first and then every block
+        # as soon as it is coded; sets raw_size, compressed_size and reduction once exhausted
+        if self.memory_limit:
+            yield from self.iter_stream(img_file, self.memory_limit)
+        else:
+            self.analyze(img_file)
+            if self.previews:
+                with metrics.span('previews', self.flat_img.nbytes):
+                    builder = PreviewBuilder(self.shape, self.mode, self.previews)
+                    builder.add(self.pixels, 0)
+                    self.preview_images = builder.images()
+            with metrics.span('tables'):
+                if self.per_tile_tables:
+                    self.entropy_coder = self.resolve_entropy_coder(self.channel_freq)
+                    self.table_sets = self.code_tables
+                else:
+                    sample = (sample_tiles(self.tiles, self.alphabet, self.table_count())
+                              if self.code_tables > 1 or self.dictionary is not None else None)
+                    if not self.use_dictionary(self.channel_freq, sample):
+                        self.entropy_coder = self.resolve_entropy_coder(self.channel_freq)
+                        self.make_tables(self.channel_freq)
+                        if self.code_tables > 1:
+                            self.train_tables(sample)
+            with metrics.span('encode', self.flat_img.nbytes):
+                self.compressed_img = self.encode_tiles()
+            self.report(3, 4)
 
             self.raw_size = self.raw_img_size()
             self.compressed_size = self.compressed_img_size()
-            self.reduction = ((1 - (self.compressed_size/self.raw_size)) * 100)
-            self.reduction = f"{self.reduction :.2f}%"
+            yield self.container_header()
+            for block in self.compressed_img:
+                yield block_bytes(block)
+            self.report(4, 4)
+        self.reduction = ((1 - (self.compressed_size/self.raw_size)) * 100)
+        self.reduction = f"{self.reduction :.2f}%"
+        self.log_result()
 
-            print(f"[Original: {self.raw_size} bytes]")
-            print(f"[Compressed (with codes): {self.compressed_size :.2f} bytes]")
-            print(f"[Reduction: {self.reduction}]")
+    def analyze(self, img_file):
+        # reads the whole image, predicts its tiles and histograms their residuals (or their run tokens)
+        with metrics.span('read'):
+            source = self.open_source(img_file)
+            self.pixels = source.rows(0, self.shape[0])
+            self.flat_img = self.pixels.reshape(-1)
+        logger.debug("loaded %s image %s", self.mode, self.shape)
+        self.report(1, 4)
+        with metrics.span('predict', self.flat_img.nbytes):
+            self.predictor = self.resolve_predictor(self.pixels[:SAMPLE_ROWS])
+            self.tiles, self.row_predictors = self.predict_tiles(self.pixels, self.tile_boxes())
+        logger.debug("applied %s prediction", self.predictor_name())
+        with metrics.span('histogram', self.flat_img.nbytes):
+            self.channel_freq = sum(self.count_channel_frequency(tile) for tile in self.tiles)
+            self.freq = self.channel_freq.sum(axis=0)
+        if self.run_length:
+            with metrics.span('runs', self.flat_img.nbytes):
+                tokens = [to_runs(tile, self.alphabet) for tile in self.tiles]
+                run_freq = sum(self.count_runs(tile) for tile in tokens)
+                if self.resolve_run_length(self.channel_freq, run_freq):
+                    self.tiles, self.channel_freq = tokens, run_freq
+        self.report(2, 4)
 
-            print(f"[Saving Compressed File...]")
-            self.save_compressed_img(file_path='Compy/assets')
+    def write_compressed(self, img_file, fileobj):
+        # iter_compress into a file, a streamed header gets its block index once every block size is known
+        with metrics.span('save'):
+            start = fileobj.tell() if fileobj.seekable() else None
+            for data in self.iter_compress(img_file):
+                fileobj.write(data)
+            if self.memory_limit and start is not None:
+                end = fileobj.tell()
+                fileobj.seek(start)
+                fileobj.write(self.container_header(self.block_sizes))
+                fileobj.seek(end)
+        return self.compressed_size
 
-            print(f"Huffman Codes: {self.huffman_codes}")
+    def log_result(self):
+        # a summary line, plus byte counters and the entropy of the coded histogram next to the bits
+        # per symbol the codes achieved
+        logger.info("compressed %d bytes to %d (%s reduction, %s)", self.raw_size, self.compressed_size, self.reduction,
+                    ENTROPY_CODERS[self.entropy_coder].name)
+        if not metrics.enabled():
+            return
+        metrics.count('raw_bytes', self.raw_size)
+        metrics.count('compressed_bytes', self.compressed_size)
+        metrics.observe('bits_per_symbol', 8 * self.compressed_size / (self.raw_size / np.dtype(self.dtype).itemsize))
+        if getattr(self, 'channel_freq', None) is not None:
+            freq = self.channel_freq if self.per_channel_tables else self.channel_freq.sum(axis=0)
+            metrics.observe('entropy_bits_per_symbol', metrics.entropy(freq))
 
+    def set_bits(self, bits):
+        # symbols are samples (or their residuals) of this many bits
+        self.bits = bits
+        self.alphabet = 1 << bits
+        self.dtype = np.uint8 if bits <= 8 else np.uint16
 
+    def open_source(self, img_file):
+        source = BandSource(img_file, self.memory_limit)
+        self.shape = source.shape
+        self.mode = source.mode
+        self.channels = int(np.prod(self.shape[2:]))
+        self.set_bits(source.bits)
+        self.source = self.source or source.source
+        if self.per_channel_tables is None:
+            # the colour filter planes of a mosaic have very different statistics
+            self.per_channel_tables = self.mode == CFA_MODE
+        return source
 
-    def count_frequency(self):
-        freq = np.zeros(256, dtype=np.int32)
-        for value in self.flat_img:
-            freq[value] += 1
+    def count_frequency(self, source=None, chunk_size=CHUNK_SIZE):
+        # global histogram of a flat uint8 or uint16 array (or np.memmap), one chunk at a time
+        data = self.flat_img if source is None else source
+        freq = np.zeros(self.alphabet, dtype=np.int64)
+        for start in range(0, len(data), chunk_size):
+            freq += np.bincount(data[start:start + chunk_size], minlength=self.alphabet)
         return freq
 
-    def combine_nodes(self, nodes):
-        heapq.heapify(nodes)
-        
-        while len(nodes) > 1:
-            left = heapq.heappop(nodes)
-            right = heapq.heappop(nodes)
-            merged_freq = left.freq + right.freq
-            merged_pixels = left.pixels + right.pixels
-            new_node = self.Node(merged_freq, merged_pixels, left, right)
-            heapq.heappush(nodes, new_node)
-        return nodes[0]
+    def count_channel_frequency(self, source=None, channels=None, chunk_size=CHUNK_SIZE, alphabet=None):
+        # per channel histograms of interleaved pixels, shape (channels, alphabet)
+        data = self.flat_img if source is None else source
+        return channel_frequency(data, channels or self.channels, alphabet or self.alphabet, chunk_size)
+
+    def count_runs(self, tokens):
+        # count_channel_frequency of run tokens, symbol i of a tile's tokens is coded with table i % channels
+        return self.count_channel_frequency(tokens, alphabet=(1 << self.bits) + RUN_TOKENS)
 
     def make_huffman_tree(self):
-        nodes = [self.Node(freq, str(i), None, None) for i, freq in enumerate(self.freq) if freq > 0]
-        return self.combine_nodes(nodes)
+        return huffman_tree(self.freq)
 
     def print_huffman_tree(self, node, prefix=""):
         if node.left is not None and node.right is not None:
             self.print_huffman_tree(node.left, prefix + "0")
             self.print_huffman_tree(node.right, prefix + "1")
         else:
-            print(f"Pixel: {node.pixels}, Code: {prefix}")
+            print(f"Pixel: {node.pixel}, Code: {prefix}")
 
-    def make_huffman_codes(self, node, code=""):
-        if node.left is None and node.right is None:
-            self.huffman_codes[node.pixels] = code
+    def make_huffman_codes(self, node):
+        # code lengths of the tree's leaves
+        return huffman_lengths(self.freq, node)
+
+    def resolve_run_length(self, channel_freq, run_freq):
+        # whether to code run tokens given the histograms without and with them, 'auto' compares the
+        # estimated output of the coders that could be picked; sets run_length and widens the alphabet
+        # by the run tokens when they are used
+        run_length = bool(self.run_length)
+        if int((run_freq.sum(axis=0) > 0).sum()) > 1 << MAX_CODE_LEN:
+            # no complete length limited code over every symbol
+            run_length = False
+        elif self.run_length == 'auto':
+            literal_bits = min(self.coder_sizes(channel_freq).values(), default=np.inf)
+            run_bits = min(self.coder_sizes(run_freq).values(), default=np.inf)
+            logger.debug("estimated bits %d without run tokens, %d with", literal_bits, run_bits)
+            run_length = run_bits < literal_bits
+        self.run_length = run_length
+        if run_length:
+            self.alphabet = (1 << self.bits) + RUN_TOKENS
+        return run_length
+
+    def coder_sizes(self, channel_freq):
+        # {index into ENTROPY_CODERS: estimated payload plus table bits} of the coders that may be picked,
+        # every usable one with 'auto'
+        freqs = channel_freq if self.per_channel_tables else channel_freq.sum(axis=0, keepdims=True)
+        coders = range(len(ENTROPY_CODERS)) if self.entropy_coder == 'auto' else [CODER_NAMES.index(self.entropy_coder)]
+        sizes = {}
+        for index in coders:
+            coder = ENTROPY_CODERS[index]
+            if coder.usable(freqs):
+                tables = coder.make_tables(freqs, self.bits)
+                sizes[index] = coder.cost(freqs, tables) + 8 * len(pack_tables(tables))
+        return sizes
+
+    def resolve_entropy_coder(self, channel_freq):
+        # index into ENTROPY_CODERS, 'auto' builds every usable coder's tables for the image's histograms
+        # and keeps the one with the fewest estimated payload plus table bits
+        # a forced coder that cannot code the histograms (rANS past 32768 distinct symbols) falls back to huffman
+        if self.entropy_coder != 'auto':
+            index = CODER_NAMES.index(self.entropy_coder)
+            freqs = channel_freq if self.per_channel_tables else channel_freq.sum(axis=0, keepdims=True)
+            if ENTROPY_CODERS[index].usable(freqs):
+                return index
+            logger.warning("the %s coder cannot code these histograms, using huffman", self.entropy_coder)
+            return CODER_NAMES.index('huffman')
+        sizes = self.coder_sizes(channel_freq)
+        best = min(sizes, key=sizes.get)
+        logger.debug("estimated bits per coder %s, using %s",
+                     {ENTROPY_CODERS[index].name: size for index, size in sizes.items()}, ENTROPY_CODERS[best].name)
+        return best
+
+    def use_dictionary(self, channel_freq, sample=None):
+        # codes with the tables of the dictionary option when they fit the image and their estimated payload
+        # is within DICTIONARY_SLACK of the image's own payload and tables; sets the coder, tables and
+        # dictionary_id, False falls back to the image's own tables
+        # a dictionary of several table sets is scored per group on the TrainingSample of the image
+        self.dictionary_id = None
+        if self.dictionary is None:
+            return False
+        store = DictionaryStore(self.dictionary_dir)
+        dictionary_id = store.for_source(self.source) if self.dictionary == 'auto' else parse_id(self.dictionary)
+        if dictionary_id is None:
+            logger.debug("no code dictionary for source %r", self.source)
+            return False
+        dictionary = store.get(dictionary_id)
+        if ((dictionary.bits, dictionary.run_length, dictionary.table_count)
+                != (self.bits, bool(self.run_length), self.table_count())
+                or self.entropy_coder not in ('auto', CODER_NAMES[dictionary.entropy_coder])):
+            logger.debug("code dictionary %s does not fit the image", format_id(dictionary_id))
+            return False
+        coder = ENTROPY_CODERS[dictionary.entropy_coder]
+        freqs = channel_freq if self.per_channel_tables else channel_freq.sum(axis=0, keepdims=True)
+        used = freqs > 0
+        set_bits = coder.symbol_bits(dictionary.tables).reshape(-1, *freqs.shape)
+        if not np.isfinite(set_bits[:, used]).all():
+            logger.debug("code dictionary %s has no code for some symbols", format_id(dictionary_id))
+            return False
+        if len(set_bits) > 1 and sample is not None and sample.group_count:
+            # every group is coded with its cheapest set, as select_tables will, and pays for its selector
+            keys, groups, fraction = sample.arrays()
+            starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+            costs = group_costs(keys, starts, set_bits.reshape(len(set_bits), -1))
+            shared = float(costs.min(axis=0).sum() + 8 * len(pack_selectors(np.argmin(costs, axis=0)))) / fraction
         else:
-            self.make_huffman_codes(node.left, code + '0')
-            self.make_huffman_codes(node.right, code + '1')
-
-    def huffman_encode(self):
-        compressed = [self.huffman_codes[str(pixel)] for pixel in self.flat_img]
-        return ''.join(compressed)
-    
-    def save_compressed_img(self, file_path): 
-        if self.compressed_img:
-            with open(file_path, 'w+') as file:
-                print(f"Saving Compressed Image to {file_path}")
-                json.dump({'compressed' : self.compressed_img, 'codes' : self.huffman_codes}, file)
+            shared = float((set_bits[:, used] * freqs[used]).sum(axis=1).min())
+        own = min(self.coder_sizes(channel_freq).values(), default=np.inf)
+        logger.debug("estimated bits %d with code dictionary %s, %d with own tables", shared,
+                     format_id(dictionary_id), own)
+        if shared > own * (1 + DICTIONARY_SLACK):
+            return False
+        self.entropy_coder = dictionary.entropy_coder
+        self.set_tables(dictionary.tables)
+        self.table_sets = len(dictionary.tables) // dictionary.table_count
+        self.dictionary_id = dictionary_id
+        return True
+
+    def make_tables(self, channel_freq):
+        # a table per channel with per_channel_tables, otherwise one shared by every channel
+        freqs = channel_freq if self.per_channel_tables else channel_freq.sum(axis=0, keepdims=True)
+        self.set_tables(ENTROPY_CODERS[self.entropy_coder].make_tables(freqs, self.bits))
+
+    def set_tables(self, tables):
+        # (table count, alphabet) code lengths, or rANS frequencies
+        self.tables = tables
+
+    def train_tables(self, sample):
+        # the shared tables become up to code_tables sets trained on a TrainingSample, when that pays off
+        tables = train_table_sets(sample, ENTROPY_CODERS[self.entropy_coder], self.bits, self.code_tables, self.tables)
+        self.table_sets = len(tables) // self.table_count()
+        logger.debug("%d table sets", self.table_sets)
+        self.set_tables(tables)
+
+    @property
+    def codes(self):
+        return np.stack([canonical_codes(lengths) for lengths in self.tables])
+
+    @property
+    def huffman_codes(self):
+        # {pixel: code}, or {channel: {pixel: code}} with a table per channel
+        codes = [{int(pixel): format(int(table_codes[pixel]), f'0{lengths[pixel]}b') for pixel in np.flatnonzero(lengths)}
+                 for lengths, table_codes in zip(self.tables, self.codes)]
+        return codes[0] if len(codes) == 1 else dict(enumerate(codes))
+
+    def tile_boxes(self):
+        # (top, bottom, left, right) of every tile in row-major order
+        rows, cols = self.shape[:2]
+        tile_rows, tile_cols = self.tile_size or (rows, cols)
+        return [(top, min(top + tile_rows, rows), left, min(left + tile_cols, cols))
+                for top in range(0, rows, tile_rows) for left in range(0, cols, tile_cols)]
+
+    def make_pool(self):
+        # executor is 'thread', 'process' for the platform's default start method, or a start method:
+        # 'spawn' and 'forkserver' start clean workers, a process forked from one running other threads
+        # can inherit a lock one of them held
+        if self.executor == 'thread':
+            return ThreadPoolExecutor(max_workers=self.workers)
+        context = None if self.executor == 'process' else multiprocessing.get_context(self.executor)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def map_tiles(self, func, *iterables):
+        # results always come back in submission order, so the output never depends on the worker count
+        # iterables are lists, a single group (one tile, or a small crop) is not worth starting a pool for
+        if self.workers <= 1 or len(iterables[0]) <= 1:
+            return list(map(func, *iterables))
+        if self.pool is not None:
+            return list(self.pool.map(func, *iterables))
+        with self.make_pool() as pool:
+            return list(pool.map(func, *iterables))
+
+    def resolve_predictor(self, sample):
+        if self.predictor == 'auto':
+            return choose_predictor(sample, self.bits)
+        if self.predictor == 'rows':
+            return PER_ROW
+        return PREDICTORS.index(self.predictor)
+
+    def predictor_name(self):
+        return 'per row' if self.predictor == PER_ROW else PREDICTORS[self.predictor]
+
+    def predict_tiles(self, band, boxes, band_top=0):
+        # residuals of every tile (flattened, ready for the coder) and the predictor used on each tile row
+        tiles, row_predictors = [], []
+        for top, bottom, left, right in boxes:
+            tile, rows = predict_tile(band[top - band_top:bottom - band_top, left:right], self.predictor, self.bits)
+            tiles.append(tile.reshape(-1))
+            row_predictors.append(rows if self.predictor == PER_ROW else None)
+        return tiles, row_predictors
+
+    def report(self, done, total):
+        if self.progress is not None:
+            self.progress(done / total)
+
+    def table_count(self):
+        return self.channels if self.per_channel_tables else 1
+
+    def encode_tiles(self):
+        blocks = self.encode_groups(self.tiles, ENCODE_CHUNK)
+        crcs = [pixel_crc(self.pixels[top:bottom, left:right]) for top, bottom, left, right in self.tile_boxes()]
+        return [block._replace(row_predictors=rows, pixel_crc=crc)
+                for block, rows, crc in zip(blocks, self.row_predictors, crcs)]
 
+    def encode_groups(self, tiles, chunk_size):
+        # tiles are split into one contiguous group per worker, like decode_blocks, so a coder can
+        # batch a group's tiles together
+        shared = None if self.per_tile_tables else self.tables
+        groups = np.array_split(np.arange(len(tiles)), max(1, min(self.workers, len(tiles))))
+        count = len(groups)
+        encoded = self.map_tiles(encode_tile_group, [[tiles[i] for i in group] for group in groups],
+                                 [shared] * count, [chunk_size] * count, [self.bits] * count,
+                                 [self.table_count()] * count, [self.entropy_coder] * count, [self.alphabet] * count,
+                                 [self.table_sets] * count)
+        blocks = [block for group in encoded for block in group]
+        if self.run_length:
+            blocks = [block._replace(symbols=len(tile)) for block, tile in zip(blocks, tiles)]
+        return blocks
+
+    def iter_stream(self, img_file, memory_limit=MEMORY_LIMIT):
+        # a histogram pass and an encode pass over row bands, blocks are handed out as soon as they are
+        # coded, so memory depends on memory_limit and the image width, never on its height
+        # the header goes out before any block size is known, its block index is left zero
+        source = self.open_source(img_file)
+        rows = self.shape[0]
+        row_bytes = int(np.prod(self.shape[1:])) * np.dtype(self.dtype).itemsize
+        # a quarter of the budget holds a band and its copies, half the encoder batches and the last quarter
+        # the samples table sets are trained on; taller tiles than fit in a band are cut down to it
+        band_rows = max(1, memory_limit // 4 // (BAND_COPIES * row_bytes))
+        if self.tile_size is None:
+            self.tile_size = (min(band_rows, rows), self.shape[1])
+        elif self.tile_size[0] > band_rows:
+            logger.info("tiles cut to %d rows to stay within the memory limit", band_rows)
+            self.tile_size = (band_rows, self.tile_size[1])
+        sample = source.rows(0, min(SAMPLE_ROWS, rows))
+        self.predictor = self.resolve_predictor(sample)
+        if self.per_tile_tables:
+            # there is no histogram pass, run tokens and the coder are picked on the residuals of the first rows
+            residuals, _ = self.predict_tiles(sample, [(0, len(sample), 0, self.shape[1])])
+            sample_freq = self.count_channel_frequency(residuals[0])
+            if self.run_length:
+                tokens = to_runs(residuals[0], self.alphabet)
+                if self.resolve_run_length(sample_freq, self.count_runs(tokens)):
+                    sample_freq = self.count_runs(tokens)
+            self.entropy_coder = self.resolve_entropy_coder(sample_freq)
+            self.table_sets = self.code_tables
+        boxes = self.tile_boxes()
+        tile_rows = self.tile_size[0]
+        # rows are read once per pass
+        passes = 1 if self.per_tile_tables else 2
+        # previews are made from the bands of the first pass
+        builder = PreviewBuilder(self.shape, self.mode, self.previews) if self.previews else None
+
+        if not self.per_tile_tables:
+            # residuals depend on the tile grid, so this pass walks the same tile rows as the encode pass
+            self.channel_freq = np.zeros((self.channels, self.alphabet), dtype=np.int64)
+            # histograms of both the residuals and their run tokens, whichever is coded is picked after the pass
+            run_freq = np.zeros((self.channels, self.alphabet + RUN_TOKENS), dtype=np.int64)
+            # table sets are trained on a sample of the groups of residuals and of run tokens, a quarter of
+            # the budget holds their keys and group numbers
+            symbols = rows * int(np.prod(self.shape[1:]))
+            stride = max(sample_stride(-(-symbols // GROUP_SIZE)),
+                         -(-symbols * 16 * (2 if self.run_length else 1) // max(1, memory_limit // 4)))
+            samples = [TrainingSample(self.alphabet, self.table_count(), stride),
+                       TrainingSample(self.alphabet + RUN_TOKENS, self.table_count(), stride)]
+            for top in range(0, rows, tile_rows):
+                band = source.rows(top, min(top + tile_rows, rows))
+                if builder is not None:
+                    with metrics.span('previews', band.nbytes):
+                        builder.add(band, top)
+                with metrics.span('histogram', band.nbytes):
+                    tiles, row_predictors = self.predict_tiles(band, [box for box in boxes if box[0] == top], top)
+                    for tile in tiles:
+                        self.channel_freq += self.count_channel_frequency(tile)
+                        if self.run_length:
+                            tokens = to_runs(tile, self.alphabet)
+                            run_freq += self.count_runs(tokens)
+                        if self.code_tables > 1 or self.dictionary is not None:
+                            samples[0].add(tile)
+                            if self.run_length:
+                                samples[1].add(tokens)
+                self.report(min(top + tile_rows, rows), rows * passes)
+            # the last band is not held through the encode pass
+            band = tiles = tokens = None
+            sample = samples[0]
+            if self.run_length and self.resolve_run_length(self.channel_freq, run_freq):
+                self.channel_freq = run_freq
+                sample = samples[1]
+            with metrics.span('tables'):
+                if not self.use_dictionary(self.channel_freq, sample):
+                    self.entropy_coder = self.resolve_entropy_coder(self.channel_freq)
+                    self.make_tables(self.channel_freq)
+                    if self.code_tables > 1:
+                        self.train_tables(sample)
+            del samples, sample
+        encode_chunk = max(SEGMENT_SIZE, memory_limit // 2 // max(1, self.workers)
+                           // ENTROPY_CODERS[self.entropy_coder].encode_bytes)
+
+        header = self.container_header([0] * len(boxes))
+        yield header
+        self.block_sizes = []
+        self.pool = self.make_pool() if self.workers > 1 else None
+        try:
+            for top in range(0, rows, tile_rows):
+                with metrics.span('read'):
+                    band = source.rows(top, min(top + tile_rows, rows))
+                if builder is not None and self.per_tile_tables:
+                    with metrics.span('previews', band.nbytes):
+                        builder.add(band, top)
+                with metrics.span('encode', band.nbytes):
+                    row_boxes = [box for box in boxes if box[0] == top]
+                    tiles, row_predictors = self.predict_tiles(band, row_boxes, top)
+                    if self.run_length:
+                        tiles = [to_runs(tile, 1 << self.bits) for tile in tiles]
+                    blocks = self.encode_groups(tiles, encode_chunk)
+                    crcs = [pixel_crc(band[:, left:right]) for _, _, left, right in row_boxes]
+                for block, row_ids, crc in zip(blocks, row_predictors, crcs):
+                    data = block_bytes(block._replace(row_predictors=row_ids, pixel_crc=crc))
+                    self.block_sizes.append(len(data))
+                    yield data
+                self.report(rows * (passes - 1) + min(top + tile_rows, rows), rows * passes)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = None
+
+        if builder is not None:
+            self.preview_images = builder.images()
+        self.compressed_img = None
+        self.raw_size = rows * row_bytes
+        self.compressed_size = len(header) + sum(self.block_sizes)
+
+    def container_header(self, sizes=None):
+        mode = self.mode.encode('ascii')
+        tile_rows, tile_cols = self.tile_size or self.shape[:2]
+        header = struct.pack(f'<4sBB{len(mode)}sB{len(self.shape)}I', MAGIC, VERSION, len(mode), mode,
+                             len(self.shape), *self.shape)
+        flags = ((PER_TILE_TABLES if self.per_tile_tables else 0) | (PER_CHANNEL_TABLES if self.per_channel_tables else 0)
+                 | (RUN_LENGTH if self.run_length else 0)
+                 | (SHARED_DICTIONARY if self.dictionary_id is not None else 0))
+        header += struct.pack('<IIIBBBBB', tile_rows, tile_cols, SEGMENT_SIZE, flags, self.predictor, self.bits,
+                              self.entropy_coder, self.table_sets)
+        if self.dictionary_id is not None:
+            header += struct.pack('<Q', self.dictionary_id)
+        elif not self.per_tile_tables:
+            header += pack_tables(self.tables)
+        if sizes is None:
+            sizes = [block_size(block) for block in self.compressed_img]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype('<u8')
+        header += struct.pack('<I', len(sizes)) + offsets.tobytes()
+        return header + struct.pack('<I', zlib.crc32(header))
+
+    def save_compressed_img(self, file_path):
+        if self.compressed_img is not None:
+            with open(file_path, 'wb') as file:
+                logger.debug("saving compressed image to %s", file_path)
+                file.write(self.container_header())
+                for block in self.compressed_img:
+                    self.write_block(file, block)
+
+    def write_block(self, file, block):
+        file.write(block_bytes(block))
+        return block_size(block)
+
+    @metrics.timed('load')
     def load_compressed_img(self, file_path):
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        self.huffman_codes = data['codes']
-        return data['compressed']
-    
-    def decode_image(self, encoded_img):
-        cur = ""
-        decoded_pixels = []
-        pixel_map = {v: k for k, v in self.huffman_codes.items()}
-        for bit in encoded_img:
-            cur += bit
-            if cur in pixel_map:
-                decoded_pixels.append(int(pixel_map[cur]))
-                cur = ""  # reset to build next code
-        return np.array(decoded_pixels, dtype=np.uint8)
-    
+        # file_path may also be an open binary file
+        if hasattr(file_path, 'read'):
+            data = file_path.read()
+        else:
+            with open(file_path, 'rb') as file:
+                data = file.read()
+        offset = self.read_header(data, getattr(file_path, 'name', file_path))
+        tiles, = struct.unpack_from('<I', data, offset)
+        offset += 4 + 8 * (tiles + 1) + 4
+
+        # blocks are walked in order, the offset index is only needed for random access
+        blocks = []
+        for box in self.tile_boxes():
+            block, offset = self.read_block(data, offset, box)
+            blocks.append(block)
+        return blocks
+
+    @metrics.timed('load')
+    def map_container(self, file_path):
+        # reads a file's header, returns the file's data and the offset of its tile count for region_blocks;
+        # a path is memory mapped, so the blocks of tiles no region asks for are never read
+        if hasattr(file_path, 'read'):
+            data = file_path.read()
+        else:
+            with open(file_path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return data, self.read_header(data, getattr(file_path, 'name', file_path))
+
+    def region_blocks(self, data, offset, region):
+        # (boxes, blocks) of the tiles overlapping region, (top, bottom, left, right) of the stored pixels;
+        # the offset index jumps straight to each block unless the file was streamed to an unseekable sink
+        tiles, = struct.unpack_from('<I', data, offset)
+        offsets = np.frombuffer(data, dtype='<u8', count=tiles + 1, offset=offset + 4)
+        first = offset + 4 + 8 * (tiles + 1) + 4
+        top, bottom, left, right = region
+        boxes, blocks = [], []
+        for i, box in enumerate(self.tile_boxes()):
+            overlaps = box[0] < bottom and box[1] > top and box[2] < right and box[3] > left
+            if offsets[-1] == 0:
+                # no index, every block up to the last one needed is walked
+                if box[0] >= bottom:
+                    break
+                block, first = self.read_block(data, first, box)
+            elif overlaps:
+                block, _ = self.read_block(data, first + int(offsets[i]), box)
+            if overlaps:
+                boxes.append(box)
+                blocks.append(block)
+        return boxes, blocks
+
+    def verify(self, file_path, decode=False):
+        # BlockError of every corrupt block of a file, checked against the CRCs of their bytes, and with
+        # decode also of the pixels they decode to (a tile row at a time); ValueError when the header is
+        # corrupt. Without an offset index a block that cannot be parsed hides the ones after it
+        data, offset = self.map_container(file_path)
+        tiles, = struct.unpack_from('<I', data, offset)
+        offsets = np.frombuffer(data, dtype='<u8', count=tiles + 1, offset=offset + 4)
+        first = offset + 4 + 8 * (tiles + 1) + 4
+        indexed = offsets[-1] != 0
+        boxes = self.tile_boxes()
+        errors = []
+        if tiles != len(boxes):
+            return [BlockError(None, None, offset, f"{tiles} blocks for {len(boxes)} tiles")]
+        position = first
+        row = []
+        for i, box in enumerate(boxes):
+            start = first + int(offsets[i]) if indexed else position
+            try:
+                block, position = self.read_block(data, start, box)
+                if indexed and position != first + int(offsets[i + 1]):
+                    raise ValueError("the block does not end where the offset index says")
+            except (ValueError, struct.error) as error:
+                errors.append(BlockError(i, box, start, str(error)))
+                if not indexed:
+                    return errors
+                continue
+            if decode:
+                row.append((i, box, start, block))
+                if i + 1 == len(boxes) or boxes[i + 1][0] != box[0]:
+                    errors += self.verify_pixels(row)
+                    row = []
+        end = first + int(offsets[-1]) if indexed else position
+        if end != len(data):
+            errors.append(BlockError(None, None, end, f"{len(data) - end} bytes past the last block"
+                                     if end < len(data) else "the file is cut short"))
+        return errors
+
+    def verify_pixels(self, blocks):
+        # BlockError of every (tile, box, offset, block) whose decoded pixels do not match their CRC
+        try:
+            tiles = self.decode_blocks([box for _, box, _, _ in blocks], [block for _, _, _, block in blocks])
+        except Exception:
+            # a tile that fails to decode takes its worker's whole group with it, they are retried one by one
+            if len(blocks) > 1:
+                return [error for block in blocks for error in self.verify_pixels([block])]
+            tile, box, start, _ = blocks[0]
+            return [BlockError(tile, box, start, "the block does not decode")]
+        return [BlockError(tile, box, start, "the decoded pixels do not match their CRC")
+                for (tile, box, start, block), pixels in zip(blocks, tiles) if pixel_crc(pixels) != block.pixel_crc]
+
+    def read_header(self, data, name=None):
+        # sets the image's attributes and shared tables from a file's header, returns the offset of its
+        # tile count
+        magic, version, mode_len = struct.unpack_from('<4sBB', data)
+        if magic != MAGIC:
+            raise ValueError(f"{name} is not a compressed image")
+        if version != VERSION:
+            raise ValueError(f"unsupported compressed image version {version}")
+        offset = 6
+        self.mode = bytes(data[offset:offset + mode_len]).decode('ascii')
+        offset += mode_len
+        ndim = data[offset]
+        self.shape = struct.unpack_from(f'<{ndim}I', data, offset + 1)
+        offset += 1 + 4 * ndim
+        (tile_rows, tile_cols, segment_size, flags, self.predictor, bits,
+         self.entropy_coder, self.table_sets) = struct.unpack_from('<IIIBBBBB', data, offset)
+        if segment_size != SEGMENT_SIZE:
+            raise ValueError(f"unsupported segment size {segment_size}")
+        self.tile_size = (tile_rows, tile_cols)
+        self.per_tile_tables = bool(flags & PER_TILE_TABLES)
+        self.per_channel_tables = bool(flags & PER_CHANNEL_TABLES)
+        self.run_length = bool(flags & RUN_LENGTH)
+        self.channels = int(np.prod(self.shape[2:]))
+        self.set_bits(bits)
+        if self.run_length:
+            self.alphabet += RUN_TOKENS
+        offset += 17
+        if flags & SHARED_DICTIONARY:
+            self.dictionary_id, = struct.unpack_from('<Q', data, offset)
+            offset += 8
+            self.set_tables(self.dictionary_tables(self.dictionary_id))
+        elif not self.per_tile_tables:
+            tables, offset = unpack_tables(data, offset, self.table_sets * self.table_count(), self.alphabet,
+                                           ENTROPY_CODERS[self.entropy_coder].table_dtype)
+            self.set_tables(tables)
+        tiles, = struct.unpack_from('<I', data, offset)
+        end = offset + 4 + 8 * (tiles + 1)
+        crc, = struct.unpack_from('<I', data, end)
+        if zlib.crc32(memoryview(data)[:end]) != crc:
+            raise ValueError(f"the header of {name} is corrupt")
+        return offset
+
+    def read_block(self, data, offset, box):
+        # the Block of the tile at box stored at offset, and the offset right after it; ValueError when the
+        # block's bytes do not match their CRC
+        top, bottom, left, right = box
+        start = offset
+        tables = row_predictors = symbols = selectors = None
+        if self.per_tile_tables:
+            count = self.table_count()
+            if self.table_sets > 1:
+                count = data[offset]
+                offset += 1
+            tables, offset = unpack_tables(data, offset, count, self.alphabet,
+                                           ENTROPY_CODERS[self.entropy_coder].table_dtype)
+        if self.predictor == PER_ROW:
+            row_predictors = np.frombuffer(data, dtype=np.uint8, count=bottom - top, offset=offset)
+            offset += bottom - top
+        if self.run_length:
+            symbols, = struct.unpack_from('<I', data, offset)
+            offset += 4
+        if self.table_sets > 1:
+            selectors, offset = unpack_selectors(data, offset)
+        segments, bits = struct.unpack_from('<IQ', data, offset)
+        offset += 12
+        segment_bits = np.frombuffer(data, dtype='<u2', count=segments, offset=offset)
+        offset += 2 * segments
+        payload = np.frombuffer(data, dtype=np.uint8, count=(bits + 7) // 8, offset=offset)
+        offset += payload.nbytes
+        crc, tile_crc = struct.unpack_from('<II', data, offset)
+        if zlib.crc32(memoryview(data)[start:offset]) != crc:
+            raise ValueError(f"the block of the tile at {box} does not match its CRC")
+        return Block(tables, segment_bits, bits, payload, row_predictors, symbols, selectors, tile_crc), offset + 8
+
+    def dictionary_tables(self, dictionary_id):
+        # the shared tables of a file coded with a code dictionary, from dictionary_dir
+        if self.dictionary_dir is None:
+            raise ValueError(f"the image is coded with code dictionary {format_id(dictionary_id)}, "
+                             "no dictionary directory is set")
+        dictionary = DictionaryStore(self.dictionary_dir).get(dictionary_id)
+        if (dictionary.entropy_coder != self.entropy_coder
+                or dictionary.tables.shape != (self.table_sets * self.table_count(), self.alphabet)):
+            raise ValueError(f"code dictionary {format_id(dictionary_id)} does not match the image")
+        return dictionary.tables
+
+    @metrics.timed('decode', nbytes=lambda image: image.nbytes)
+    def decode_image(self, blocks):
+        boxes = self.tile_boxes()
+        image = np.empty(self.shape, dtype=self.dtype)
+        for (top, bottom, left, right), tile in zip(boxes, self.decode_blocks(boxes, blocks)):
+            image[top:bottom, left:right] = tile
+        return image.reshape(-1)
+
+    def decode_rows(self, blocks):
+        # the image a row of tiles at a time, only one band of decoded tiles is held at once
+        boxes = self.tile_boxes()
+        start = 0
+        while start < len(boxes):
+            top, bottom = boxes[start][:2]
+            stop = start
+            while stop < len(boxes) and boxes[stop][0] == top:
+                stop += 1
+            band = np.empty((bottom - top,) + tuple(self.shape[1:]), dtype=self.dtype)
+            with metrics.span('decode', band.nbytes):
+                tiles = self.decode_blocks(boxes[start:stop], blocks[start:stop])
+                for (_, _, left, right), tile in zip(boxes[start:stop], tiles):
+                    band[:, left:right] = tile
+            yield band
+            start = stop
+
+    def decode_blocks(self, boxes, blocks, last_row=None):
+        # decoded tiles of blocks in order, split into one contiguous group per worker that each
+        # decodes as a single batch
+        # with last_row, tiles are only decoded down to that row: segments are restart points, so the
+        # segments past it are skipped; tiles coded with run tokens are still decoded whole
+        streams, shapes, row_predictors = [], [], []
+        for (top, bottom, left, right), block in zip(boxes, blocks):
+            tables = self.tables if block.tables is None else block.tables
+            segment_bits = block.segment_bits
+            if last_row is not None and block.symbols is None:
+                bottom = max(top + 1, min(bottom, last_row))
+            shape = (bottom - top, right - left) + tuple(self.shape[2:])
+            symbols = int(np.prod(shape)) if block.symbols is None else block.symbols
+            if block.symbols is None:
+                segment_bits = segment_bits[:-(-symbols // SEGMENT_SIZE)]
+            streams.append((block.payload, segment_bits, symbols, tables, block.selectors, self.table_count()))
+            shapes.append(shape)
+            rows = block.row_predictors
+            row_predictors.append(np.full(bottom - top, self.predictor, dtype=np.uint8) if rows is None
+                                  else rows[:bottom - top])
+        groups = np.array_split(np.arange(len(streams)), max(1, min(self.workers, len(streams))))
+        decoded = self.map_tiles(decode_tiles,
+                                 [[streams[i] for i in group] for group in groups],
+                                 [[shapes[i] for i in group] for group in groups],
+                                 [[row_predictors[i] for i in group] for group in groups],
+                                 [self.bits] * len(groups), [self.entropy_coder] * len(groups),
+                                 [self.run_length] * len(groups))
+        return [tile for group in decoded for tile in group]
+
+    @metrics.timed('decode', nbytes=lambda region: region.nbytes)
+    def decode_region(self, region, boxes, blocks):
+        # pixels of region, (top, bottom, left, right), from the blocks load_region picked for it
+        top, bottom, left, right = region
+        pixels = np.empty((bottom - top, right - left) + tuple(self.shape[2:]), dtype=self.dtype)
+        for box, tile in zip(boxes, self.decode_blocks(boxes, blocks, bottom)):
+            tile_top, _, tile_left, tile_right = box
+            rows = slice(max(top, tile_top), min(bottom, tile_top + len(tile)))
+            cols = slice(max(left, tile_left), min(right, tile_right))
+            pixels[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left] = \
+                tile[rows.start - tile_top:rows.stop - tile_top, cols.start - tile_left:cols.stop - tile_left]
+        return pixels
+
+    def display_scale(self):
+        # displayed pixels per stored pixel along each axis, a mosaic's planes are half its size
+        return 2 if self.mode == CFA_MODE else 1
+
+    def to_image(self, pixels):
+        # PIL image of decoded pixels (the whole image, or a region of it) for display: a mosaic is put
+        # back together and samples wider than a byte are scaled down to 8 bit greyscale
+        pixels = pixels.reshape(self.shape) if pixels.ndim == 1 else pixels
+        if self.mode == CFA_MODE:
+            pixels = merge_cfa(pixels)
+        if self.mode == CFA_MODE or self.mode in WIDE_MODES:
+            shift = max(0, int(pixels.max(initial=0)).bit_length() - 8)
+            return Image.fromarray((pixels >> shift).astype(np.uint8), 'L')
+        return Image.fromarray(pixels, self.mode)
+
     def raw_img_size(self):
-        if self.image: 
-            return len(self.flat_img)
-        
+        if self.flat_img is not None:
+            return self.flat_img.nbytes
+
     def compressed_img_size(self):
-        if self.compressed_img:
-            size = len(self.compressed_img) / 8
+        # size of the file save_compressed_img writes
+        if self.compressed_img is not None:
+            return len(self.container_header()) + sum(block_size(block) for block in self.compressed_img)
 
-            return size
 
-# test with default image 
+def pack_tables(tables):
+    # a byte per symbol is stored as is up to 8 bits, wider values and alphabets are mostly
+    # unused symbols and deflate to little
+    data = tables.astype(tables.dtype.newbyteorder('<')).tobytes()
+    if tables.shape[1] <= 256 and tables.dtype.itemsize == 1:
+        return data
+    data = zlib.compress(data)
+    return struct.pack('<I', len(data)) + data
+
+
+def block_bytes(block):
+    # a block as it is laid out in the file
+    parts = []
+    if block.tables is not None:
+        if block.selectors is not None:
+            parts.append(struct.pack('<B', len(block.tables)))
+        parts.append(pack_tables(block.tables))
+    if block.row_predictors is not None:
+        parts.append(block.row_predictors.tobytes())
+    if block.symbols is not None:
+        parts.append(struct.pack('<I', block.symbols))
+    if block.selectors is not None:
+        parts.append(pack_selectors(block.selectors))
+    parts.append(struct.pack('<IQ', len(block.segment_bits), block.bits))
+    parts.append(block.segment_bits.astype('<u2').tobytes())
+    parts.append(block.payload.tobytes())
+    crc = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+    parts.append(struct.pack('<II', crc, block.pixel_crc))
+    return b''.join(parts)
+
+
+def pixel_crc(pixels):
+    # CRC32 of a tile's samples, row-major and little endian, as the decoder gives them back
+    return zlib.crc32(np.ascontiguousarray(pixels, dtype=pixels.dtype.newbyteorder('<')))
+
+
+def unpack_tables(data, offset, count, alphabet, dtype=np.uint8):
+    # (count, alphabet) tables stored at offset, and the offset right after them
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if alphabet <= 256 and dtype.itemsize == 1:
+        tables = np.frombuffer(data, dtype=dtype, count=count * alphabet, offset=offset)
+        return tables.reshape(count, alphabet), offset + count * alphabet
+    size, = struct.unpack_from('<I', data, offset)
+    tables = np.frombuffer(zlib.decompress(data[offset + 4:offset + 4 + size]), dtype=dtype)
+    return tables.reshape(count, alphabet), offset + 4 + size
+
+
+def block_size(block):
+    size = 12 + 2 * len(block.segment_bits) + block.payload.nbytes + 8
+    if block.row_predictors is not None:
+        size += len(block.row_predictors)
+    if block.symbols is not None:
+        size += 4
+    if block.selectors is not None:
+        size += len(pack_selectors(block.selectors)) + (block.tables is not None)
+    return size if block.tables is None else size + len(pack_tables(block.tables))
+
+
+def encode_tile_group(tiles, tables=None, chunk_size=ENCODE_CHUNK, bits=8, table_count=1, entropy_coder=0,
+                      alphabet=None, table_sets=1):
+    # pool worker, tiles without shared tables build their own (table_count of them each, or up to
+    # table_sets sets of them) over alphabet, 2 ** bits unless the tiles hold run tokens
+    coder = ENTROPY_CODERS[entropy_coder]
+    alphabet = alphabet or 1 << bits
+    if tables is None:
+        own_tables = [coder.make_tables(channel_frequency(tile, table_count, alphabet), bits) for tile in tiles]
+        if table_sets > 1:
+            own_tables = [train_table_sets(sample_tiles([tile], alphabet, table_count), coder, bits, table_sets, single)
+                          for tile, single in zip(tiles, own_tables)]
+        tile_tables = own_tables
+    else:
+        own_tables = [None] * len(tiles)
+        tile_tables = [tables] * len(tiles)
+    selectors = [None] * len(tiles)
+    if table_sets > 1:
+        selectors = [select_tables(tile, tile_tables, coder, alphabet, table_count)
+                     for tile, tile_tables in zip(tiles, tile_tables)]
+    encoded = coder.encode_many(tiles, tile_tables, bits, chunk_size, selectors, table_count)
+    return [Block(own, *parts, selectors=tile_selectors)
+            for own, parts, tile_selectors in zip(own_tables, encoded, selectors)]
+
+
+def train_table_sets(sample, coder, bits, max_sets, single):
+    # up to max_sets sets of tables clustered on a TrainingSample, or single, the one set coding every
+    # symbol, when more sets would not pay for their tables and selectors
+    sets = set_count(sample.group_count, max_sets)
+    keys, groups, fraction = sample.arrays()
+    if sets < 2 or not len(keys):
+        return single
+    tables, payload, choice = cluster_tables(keys, groups, coder, bits, sample.alphabet, sample.period, sets,
+                                             np.isfinite(coder.symbol_bits(single)))
+    single_payload = coder.symbol_bits(single).reshape(-1)[keys].sum()
+    # the sampled selectors deflate worse than every group's would, so this errs towards a single set,
+    # every block also pays for its own deflate stream
+    extra = 8 * (len(pack_tables(tables)) - len(pack_tables(single)) + len(pack_selectors(choice)) / fraction
+                 + len(pack_selectors(choice[:1])) * sample.tile_count)
+    if len(tables) == len(single) or payload / fraction + extra >= single_payload / fraction:
+        return single
+    return tables
+
+
+def decode_table(code_lengths, peek_bits):
+    # every peek_bits wide bit pattern maps to the pixel whose code prefixes it and that code's length
+    # canonical codes sorted by value fill the table in consecutive runs
+    order = np.lexsort((np.arange(len(code_lengths)), code_lengths))
+    order = order[code_lengths[order] > 0]
+    runs = 1 << (peek_bits - code_lengths[order].astype(np.int64))
+    symbols = np.zeros(1 << peek_bits, dtype=symbol_dtype(len(code_lengths)))
+    lengths = np.zeros(1 << peek_bits, dtype=np.uint8)
+    symbols[:runs.sum()] = np.repeat(order, runs)
+    lengths[:runs.sum()] = np.repeat(code_lengths[order], runs)
+    return symbols, lengths
+
+
+def decode_streams(streams):
+    # pool worker, streams are (payload, segment bits, pixel count, tables, selectors, period) tuples
+    # every segment of every stream is a lane and all lanes step through their segment together,
+    # one table lookup per pixel per lane resolves a whole code at once
+    table_sets = {}
+    for stream in streams:
+        table_sets.setdefault(id(stream[3]), stream[3])
+    # every table of every set is stacked, a set starts at its first table's id
+    set_ids = dict(zip(table_sets, np.cumsum([0] + [len(tables) for tables in table_sets.values()])))
+    all_tables = np.concatenate(list(table_sets.values()))
+    peek_bits = int(all_tables.max())
+    symbol_parts, length_parts = zip(*(decode_table(lengths, peek_bits) for lengths in all_tables))
+    sym_table = np.concatenate(symbol_parts)
+    len_table = np.concatenate(length_parts)
+
+    starts, counts, table_base, phases, periods, lanes_per_stream = [], [], [], [], [], []
+    # selectors of every stream laid end to end, every lane starts at its first group's selector
+    group_parts, first_groups = [], []
+    groups = 0
+    offset = 0
+    for payload, segment_bits, pixels, tables, selectors, period in streams:
+        lanes = len(segment_bits)
+        if selectors is None:
+            selectors, period = np.zeros(-(-pixels // GROUP_SIZE), dtype=np.uint8), len(tables)
+        group_parts.append(selectors)
+        first_groups.append(groups + np.arange(lanes) * (SEGMENT_SIZE // GROUP_SIZE))
+        groups += len(selectors)
+        lane_starts = np.zeros(lanes, dtype=np.int64)
+        lane_starts[1:] = np.cumsum(segment_bits[:-1], dtype=np.int64)
+        starts.append(lane_starts + 8 * offset)
+        lane_counts = np.full(lanes, SEGMENT_SIZE)
+        lane_counts[-1] = pixels - (lanes - 1) * SEGMENT_SIZE
+        counts.append(lane_counts)
+        table_base.append(np.full(lanes, set_ids[id(tables)]))
+        # with a table per channel, a lane's table cycles starting from its first symbol's channel
+        phases.append(np.arange(lanes) * SEGMENT_SIZE % period)
+        periods.append(np.full(lanes, period))
+        lanes_per_stream.append(lanes)
+        offset += len(payload)
+
+    # longest lanes first, so lanes that finish early simply drop off the end
+    counts = np.concatenate(counts)
+    order = np.argsort(-counts, kind='stable')
+    pos = np.concatenate(starts)[order]
+    set_base = np.concatenate(table_base)[order]
+    phases = np.concatenate(phases)[order]
+    periods = np.concatenate(periods)[order]
+    cycling = bool((periods > 1).any())
+    selectors = np.concatenate(group_parts)
+    selecting = bool(selectors.any())
+    first_groups = np.concatenate(first_groups)[order]
+    table_base = set_base << peek_bits
+    active = np.searchsorted(-counts[order], -np.arange(SEGMENT_SIZE), side='left')
+
+    # 24 bit big-endian window starting at every byte, enough for peek_bits + 7 bits of offset
+    buf = np.concatenate([stream[0] for stream in streams] + [np.zeros(3, dtype=np.uint8)]).astype(np.uint32)
+    window = (buf[:-2] << 16) | (buf[1:-1] << 8) | buf[2:]
+    shift = 24 - peek_bits
+    mask = (1 << peek_bits) - 1
+
+    decoded = np.empty((len(pos), SEGMENT_SIZE), dtype=sym_table.dtype)
+    for i in range(SEGMENT_SIZE):
+        if active[i] < len(pos):
+            pos = pos[:active[i]]
+            set_base = set_base[:active[i]]
+            table_base = table_base[:active[i]]
+            first_groups = first_groups[:active[i]]
+            phases = phases[:active[i]]
+            periods = periods[:active[i]]
+        if selecting and i % GROUP_SIZE == 0:
+            # every lane moves on to its next group's set
+            table_base = (set_base + selectors[first_groups + i // GROUP_SIZE].astype(np.int64) * periods) << peek_bits
+        bits = (window[pos >> 3] >> (shift - (pos & 7))) & mask
+        if cycling:
+            bits += table_base + ((phases + i) % periods << peek_bits)
+        elif len(all_tables) > 1:
+            bits += table_base
+        decoded[:len(pos), i] = sym_table[bits]
+        pos += len_table[bits]
+
+    lanes = np.empty_like(decoded)
+    lanes[order] = decoded
+    bounds = np.cumsum([0] + lanes_per_stream)
+    return [lanes[bounds[i]:bounds[i + 1]].ravel()[:stream[2]] for i, stream in enumerate(streams)]
+
+def decode_tiles(streams, shapes, row_predictors, bits=8, entropy_coder=0, run_length=False):
+    # pool worker, entropy decodes a group of tiles then undoes their prediction,
+    # tiles of the same shape are unpredicted together as one batch
+    decoded = ENTROPY_CODERS[entropy_coder].decode(streams)
+    if run_length:
+        decoded = [from_runs(tokens, 1 << bits, symbol_dtype(1 << bits)) for tokens in decoded]
+    tiles = [residuals.reshape(shape) for residuals, shape in zip(decoded, shapes)]
+    for shape in set(shapes):
+        index = [i for i, tile_shape in enumerate(shapes) if tile_shape == shape]
+        batch = unpredict_tiles(np.stack([tiles[i] for i in index]), np.stack([row_predictors[i] for i in index]),
+                                bits)
+        for i, tile in zip(index, batch):
+            tiles[i] = tile
+    return tiles
+
+def channel_frequency(data, channels, alphabet, chunk_size=CHUNK_SIZE):
+    # per channel histograms of interleaved symbols, shape (channels, alphabet)
+    # each value is offset by alphabet * channel so a single bincount covers every channel
+    chunk_size -= chunk_size % channels
+    offsets = np.arange(channels, dtype=np.intp) * alphabet
+    freq = np.zeros(channels * alphabet, dtype=np.int64)
+    whole = len(data) - len(data) % channels
+    for start in range(0, whole, chunk_size):
+        chunk = data[start:min(start + chunk_size, whole)].reshape(-1, channels)
+        freq += np.bincount((chunk + offsets).ravel(), minlength=channels * alphabet)
+    # run tokens need not fill the last pixel
+    if whole < len(data):
+        freq += np.bincount(data[whole:] + offsets[:len(data) - whole], minlength=channels * alphabet)
+    return freq.reshape(channels, alphabet)
+
+
+def huffman_tree(freq):
+    # only symbols that occur become leaves, a wide alphabet is mostly empty
+    nodes = [Node(int(freq[i]), int(i), int(i), None, None) for i in np.flatnonzero(freq)]
+    heapq.heapify(nodes)
+    # merged nodes get increasing order numbers so ties never compare the children
+    order = max(node.order for node in nodes) + 1
+    while len(nodes) > 1:
+        left = heapq.heappop(nodes)
+        right = heapq.heappop(nodes)
+        heapq.heappush(nodes, Node(left.freq + right.freq, order, None, left, right))
+        order += 1
+    return nodes[0]
+
+
+def tree_depths(node, size):
+    depths = np.zeros(size, dtype=np.int64)
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if node.left is None and node.right is None:
+            depths[node.pixel] = depth
+        else:
+            stack.append((node.left, depth + 1))
+            stack.append((node.right, depth + 1))
+    return depths
+
+
+def limit_code_lengths(depths, freq, max_len=MAX_CODE_LEN):
+    # JPEG (Annex K.3) style adjustment: move leaves up from the deepest levels while keeping the
+    # code complete, then hand the shortest lengths to the most frequent pixels
+    counts = np.bincount(depths[depths > 0], minlength=max(int(depths.max()), max_len) + 1)
+    for i in range(len(counts) - 1, max_len, -1):
+        while counts[i] > 0:
+            j = i - 2
+            while counts[j] == 0:
+                j -= 1
+            counts[i] -= 2
+            counts[i - 1] += 1
+            counts[j + 1] += 2
+            counts[j] -= 1
+    used = np.flatnonzero(depths > 0)
+    by_freq = used[np.lexsort((used, -freq[used]))]
+    lengths = np.zeros(len(depths), dtype=np.uint8)
+    lengths[by_freq] = np.repeat(np.arange(max_len + 1), counts[:max_len + 1])
+    return lengths
+
+
+def huffman_lengths(freq, tree=None):
+    # length limited code lengths of a histogram, from its Huffman tree
+    if tree is None:
+        tree = huffman_tree(freq)
+    depths = tree_depths(tree, len(freq))
+    if tree.left is None and tree.right is None:
+        # a single-valued image still needs one bit per pixel
+        depths[tree.pixel] = 1
+    return limit_code_lengths(depths, freq)
+
+
+def huffman_tables(freqs):
+    # code lengths of a Huffman code for every histogram, a table no symbol is coded with is left empty
+    return np.stack([huffman_lengths(freq) if freq.any() else np.zeros(len(freq), dtype=np.uint8) for freq in freqs])
+
+
+def canonical_codes(lengths):
+    # codes are handed out in (length, pixel) order, so the lengths alone describe the whole code:
+    # every code is the Kraft sum of the codes before it, cut down to its own length
+    order = np.lexsort((np.arange(len(lengths)), lengths))
+    order = order[lengths[order] > 0]
+    lens = lengths[order].astype(np.int64)
+    longest = int(lens.max(initial=0))
+    weights = np.int64(1) << (longest - lens)
+    codes = np.zeros(len(lengths), dtype=np.uint32)
+    codes[order] = (np.cumsum(weights) - weights) >> (longest - lens)
+    return codes
+
+
+def code_tables(tables):
+    # per symbol lookup tables over every table laid end to end: code lengths,
+    # and every code's bits (msb first) laid end to end
+    lengths = tables.reshape(-1).astype(np.int64)
+    code_starts = np.cumsum(lengths) - lengths
+    ends = np.repeat(code_starts + lengths, lengths)
+    codes = np.repeat(np.stack([canonical_codes(table) for table in tables]).reshape(-1).astype(np.int64), lengths)
+    code_bits = ((codes >> (ends - 1 - np.arange(len(ends)))) & 1).astype(np.uint8)
+    return lengths, code_bits, code_starts
+
+
+def huffman_encode(symbols, tables, chunk_size=ENCODE_CHUNK, selectors=None, period=None):
+    # (bit length of every segment, total bits, payload): codes packed straight into a uint8 bitstream
+    # (msb first), one batch of symbols at a time, selectors pick a set of period tables for every group
+    # run tokens widen the alphabet, tables.shape[1], past 2 ** bits
+    alphabet = tables.shape[1]
+    lengths, code_bits, code_starts = code_tables(tables)
+    packed = []
+    segments = []
+    carry = np.zeros(0, dtype=np.uint8)
+    total_bits = 0
+    chunk_size -= chunk_size % SEGMENT_SIZE
+    for start in range(0, len(symbols), chunk_size):
+        chunk = symbols[start:start + chunk_size]
+        if len(tables) > 1:
+            # every symbol is looked up in its channel's (or its group's) table
+            chunk = chunk + symbol_tables(start, start + len(chunk), len(tables), selectors, period) * alphabet
+        lens = lengths[chunk]
+        segments.append(np.add.reduceat(lens, np.arange(0, len(lens), SEGMENT_SIZE)))
+        out_starts = np.cumsum(lens) - lens
+        total = int(out_starts[-1] + lens[-1])
+        # index of every output bit inside code_bits
+        idx = np.repeat(code_starts[chunk] - out_starts, lens) + np.arange(total)
+        bits = np.concatenate([carry, code_bits[idx]])
+        whole = len(bits) - len(bits) % 8
+        packed.append(np.packbits(bits[:whole]))
+        carry = bits[whole:]
+        total_bits += total
+    packed.append(np.packbits(carry))
+    # bit length of every segment, lets the decoder start at each restart point
+    segment_bits = np.concatenate(segments).astype(np.uint32) if segments else np.zeros(0, dtype=np.uint32)
+    return segment_bits, total_bits, np.concatenate(packed)
+
+
+class HuffmanCoder(EntropyCoder):
+    # length limited canonical codes, decoded a whole code per table lookup
+    name = 'huffman'
+
+    def make_tables(self, freqs, bits):
+        return huffman_tables(freqs)
+
+    def cost(self, freqs, tables):
+        return int((freqs * tables).sum())
+
+    def symbol_bits(self, tables):
+        return np.where(tables > 0, tables, np.inf)
+
+    def encode(self, symbols, tables, bits, chunk_size, selectors=None, period=None):
+        return huffman_encode(symbols, tables, chunk_size, selectors, period)
+
+    def decode(self, streams):
+        return decode_streams(streams)
+
+
+# the index of an image's coder is stored in its header, new coders go at the end
+ENTROPY_CODERS = [HuffmanCoder(), RansCoder()]
+CODER_NAMES = [coder.name for coder in ENTROPY_CODERS]
+
+# test with default image
 if __name__ == '__main__':
     compressor = HuffmanCompressor('assets/example.NEF')
-
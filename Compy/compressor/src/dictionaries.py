@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# shared code tables trained once on a corpus from one camera or scanner, files coded with them carry the
+# dictionary's id instead of their own tables
+# dictionary file layout (little endian):
+#   magic, version, entropy coder (index into ENTROPY_CODERS), sample bits, run tokens (0 or 1),
+#   tables per set, table sets (u8 each), alphabet (u32), table value size (u8), deflated tables behind a u32 size,
+#   source length (u16), source (utf-8)
+# the id is the first 8 bytes of the sha256 of everything before the source, retraining on the same corpus
+# gives the same id
+MAGIC = b'HUFD'
+VERSION = 1
+SUFFIX = '.dict'
+# {source: id} of the dictionary last registered for every camera or scanner
+INDEX = 'sources.json'
+# decoded dictionaries kept in memory per process, the files never change once written
+CACHE_SIZE = 32
+# unseen residuals further from zero than this get no code, every one costs the codes of the rest a little
+COVER_DISTANCE = 1 << 8
+# images trained on are sampled down to about this many symbol groups in total for table sets
+TRAIN_GROUPS = 1 << 16
+
+# tables is (table sets * table count, alphabet), source the camera or scanner it was trained for
+Dictionary = namedtuple('Dictionary', ['entropy_coder', 'bits', 'run_length', 'table_count', 'tables', 'source'])
+
+
+def parse_id(value):
+    # an id as int, from an int or its 16 digit hex form
+    return value if isinstance(value, int) else int(str(value), 16)
+
+
+def format_id(dictionary_id):
+    return f'{dictionary_id:016x}'
+
+
+def coding_bytes(dictionary):
+    tables = np.ascontiguousarray(dictionary.tables)
+    data = zlib.compress(tables.astype(tables.dtype.newbyteorder('<')).tobytes())
+    return (struct.pack('<4sBBBBBBIB', MAGIC, VERSION, dictionary.entropy_coder, dictionary.bits,
+                        int(dictionary.run_length), dictionary.table_count, len(tables) // dictionary.table_count,
+                        tables.shape[1], tables.dtype.itemsize)
+            + struct.pack('<I', len(data)) + data)
+
+
+def dictionary_id(dictionary):
+    return int.from_bytes(hashlib.sha256(coding_bytes(dictionary)).digest()[:8], 'little')
+
+
+def pack_dictionary(dictionary):
+    source = (dictionary.source or '').encode('utf-8')
+    return coding_bytes(dictionary) + struct.pack('<H', len(source)) + source
+
+
+def unpack_dictionary(data):
+    (magic, version, entropy_coder, bits, run_length, table_count, table_sets, alphabet,
+     itemsize) = struct.unpack_from('<4sBBBBBBIB', data)
+    if magic != MAGIC:
+        raise ValueError("not a code dictionary")
+    if version != VERSION:
+        raise ValueError(f"unsupported code dictionary version {version}")
+    offset = struct.calcsize('<4sBBBBBBIB')
+    size, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    tables = np.frombuffer(zlib.decompress(data[offset:offset + size]), dtype=f'<u{itemsize}')
+    offset += size
+    source_len, = struct.unpack_from('<H', data, offset)
+    source = data[offset + 2:offset + 2 + source_len].decode('utf-8') or None
+    return Dictionary(entropy_coder, bits, bool(run_length), table_count,
+                      tables.reshape(table_sets * table_count, alphabet), source)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def load_dictionary(path):
+    with open(path, 'rb') as file:
+        return unpack_dictionary(file.read())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def load_index(path, mtime):
+    # mtime is part of the key, a newly registered dictionary invalidates the cached index
+    with open(path) as file:
+        return json.load(file)
+
+
+class DictionaryStore:
+    # dictionaries as <root>/<id><SUFFIX> files, plus the INDEX of which one every source uses
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, dictionary_id):
+        return os.path.join(self.root, format_id(dictionary_id) + SUFFIX)
+
+    def index(self):
+        path = os.path.join(self.root, INDEX)
+        try:
+            return load_index(path, os.path.getmtime(path))
+        except FileNotFoundError:
+            return {}
+
+    def register(self, dictionary):
+        # writes the dictionary and makes it the one its source uses, returns its id
+        os.makedirs(self.root, exist_ok=True)
+        new_id = dictionary_id(dictionary)
+        self.write(self.path_for(new_id), pack_dictionary(dictionary))
+        if dictionary.source:
+            index = dict(self.index(), **{dictionary.source: format_id(new_id)})
+            self.write(os.path.join(self.root, INDEX), json.dumps(index, indent=2, sort_keys=True).encode('utf-8'))
+        return new_id
+
+    def write(self, path, data):
+        # readers in other processes only ever see whole files
+        handle, temp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, dictionary_id):
+        path = self.path_for(dictionary_id)
+        try:
+            return load_dictionary(path)
+        except FileNotFoundError:
+            raise ValueError(f"code dictionary {format_id(dictionary_id)} is not in {self.root}") from None
+
+    def for_source(self, source):
+        # id of the dictionary registered for a source, None when there is none
+        dictionary_id = self.index().get(source) if source else None
+        return None if dictionary_id is None else parse_id(dictionary_id)
+
+
+def coverage(channel_freq, bits, run_length, limit):
+    # symbols every table of a dictionary keeps a code for, so images a little unlike the corpus still fit:
+    # the ones the corpus had, residuals up to twice as far from zero (modulo 2 ** bits) as any of them but
+    # at most COVER_DISTANCE, every sample value of the corpus' bit depth (the first pixel of a tile is
+    # coded as is) and every run token; only the ones seen when that is over limit symbols
+    residuals = np.arange(channel_freq.shape[1])
+    distance = np.minimum(residuals, (1 << bits) - residuals)
+    distance[1 << bits:] = 0 if run_length else 1 << bits
+    seen = channel_freq.sum(axis=0) > 0
+    furthest = int(distance[seen].max(initial=0))
+    depth = int(residuals[seen & (residuals < 1 << (bits - 1))].max(initial=0)).bit_length()
+    covered = seen | (distance <= min(2 * furthest, COVER_DISTANCE)) | (residuals < 1 << depth)
+    return covered if covered.sum() <= limit else seen
+
+
+def train_dictionary(images, source=None, entropy_coder='huffman', predictor='auto', per_channel_tables=None,
+                     run_length=False, code_tables=1, tile_size=None):
+    # Dictionary over the residuals of every image with the given options, the images share their bit depth
+    # and channels, and run tokens are either always or never used; images are analysed one at a time and
+    # only their histograms and a sample of their symbol groups are kept
+    from compressor.src.compressor import ENTROPY_CODERS, MAX_CODE_LEN, HuffmanCompressor
+    from compressor.src.entropy import GROUP_SIZE
+    from compressor.src.tables import TrainingSample, sample_stride
+
+    images = list(images)
+    if not images:
+        raise ValueError("no images to train a code dictionary on")
+    trainer = sample = None
+    for image in images:
+        coder = HuffmanCompressor(tile_size=tile_size, predictor=predictor, per_channel_tables=per_channel_tables,
+                                  entropy_coder=entropy_coder, run_length=bool(run_length), code_tables=code_tables)
+        coder.analyze(image)
+        if trainer is None:
+            trainer = coder
+            channel_freq = np.zeros_like(coder.channel_freq)
+            sample = TrainingSample(coder.alphabet, coder.table_count())
+        elif ((coder.bits, coder.alphabet, coder.channels, coder.per_channel_tables)
+              != (trainer.bits, trainer.alphabet, trainer.channels, trainer.per_channel_tables)):
+            raise ValueError(f"{image} does not have the bit depth and channels of {images[0]}")
+        channel_freq += coder.channel_freq
+        if code_tables > 1:
+            # every image gets an even share of the sample
+            sample.stride = sample_stride(sum(-(-len(tile) // GROUP_SIZE) for tile in coder.tiles),
+                                          max(1, TRAIN_GROUPS // len(images)))
+            for tile in coder.tiles:
+                sample.add(tile)
+        coder.tiles = coder.pixels = coder.flat_img = None
+
+    # every table codes every covered symbol, a count of one is next to nothing next to the corpus
+    channel_freq += coverage(channel_freq, trainer.bits, trainer.run_length, 1 << MAX_CODE_LEN)
+    trainer.entropy_coder = trainer.resolve_entropy_coder(channel_freq)
+    coder = ENTROPY_CODERS[trainer.entropy_coder]
+    if not coder.usable(channel_freq if trainer.per_channel_tables else channel_freq.sum(axis=0, keepdims=True)):
+        raise ValueError(f"the corpus uses too many symbols for {coder.name} tables")
+    trainer.make_tables(channel_freq)
+    if code_tables > 1:
+        trainer.train_tables(sample)
+    return Dictionary(trainer.entropy_coder, trainer.bits, bool(trainer.run_length), trainer.table_count(),
+                      trainer.tables, source)
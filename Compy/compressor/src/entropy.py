@@ -0,0 +1,63 @@
+import numpy as np
+
+# symbols between restart points in the bitstream, every segment is coded as its own lane
+SEGMENT_SIZE = 2048
+# with several table sets every GROUP_SIZE symbols of a block pick the set they are coded with,
+# a segment always starts a group
+GROUP_SIZE = 128
+
+
+def symbol_dtype(alphabet):
+    # smallest unsigned type holding every symbol of an alphabet, for decoder lookup tables
+    return np.uint8 if alphabet <= 1 << 8 else np.uint16 if alphabet <= 1 << 16 else np.uint32
+
+
+def symbol_tables(start, stop, table_count, selectors=None, period=None):
+    # table of every symbol from start to stop of a block: tables[i % table_count], or with selectors
+    # tables[selectors[i // GROUP_SIZE] * period + i % period], a set of period tables per selector
+    positions = np.arange(start, stop)
+    if selectors is None:
+        return positions % table_count
+    return selectors[positions // GROUP_SIZE].astype(np.int64) * period + positions % period
+
+
+class EntropyCoder:
+    # turns residual symbols into the payload of a block; an image is coded by one of
+    # compressor.ENTROPY_CODERS and its index there is stored in the file header
+    # tables are (table count, alphabet) arrays of table_dtype, symbol i of a tile uses table i % table count,
+    # or the one symbol_tables picks when the tile selects among sets of tables
+    name = None
+    table_dtype = np.uint8
+    # transient bytes the encoder holds per symbol of a batch, sizes batches under a memory limit
+    encode_bytes = 256
+
+    def usable(self, freqs):
+        # whether tables can be built for these (table count, alphabet) histograms
+        return True
+
+    def make_tables(self, freqs, bits):
+        raise NotImplementedError
+
+    def cost(self, freqs, tables):
+        # payload bits of symbols with these histograms, used to pick a coder per image
+        raise NotImplementedError
+
+    def symbol_bits(self, tables):
+        # (table count, alphabet) bits every symbol costs in every table, inf where a table cannot code it
+        raise NotImplementedError
+
+    def encode(self, symbols, tables, bits, chunk_size, selectors=None, period=None):
+        # (bit length of every SEGMENT_SIZE symbol segment, total bits, uint8 payload), with every
+        # segment starting where the one before it ended
+        raise NotImplementedError
+
+    def encode_many(self, tiles, tables, bits, chunk_size, selectors=None, period=None):
+        # encode of every tile with its tables (and selectors), coders that batch tiles together override it
+        selectors = selectors or [None] * len(tiles)
+        return [self.encode(symbols, tile_tables, bits, chunk_size, tile_selectors, period)
+                for symbols, tile_tables, tile_selectors in zip(tiles, tables, selectors)]
+
+    def decode(self, streams):
+        # streams are (payload, segment bits, symbol count, tables, selectors, period) tuples, selectors is
+        # None for tiles coded without them; returns their flat symbols
+        raise NotImplementedError
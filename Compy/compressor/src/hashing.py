@@ -0,0 +1,17 @@
+import hashlib
+
+# files are hashed this many bytes at a time, never read whole
+HASH_CHUNK = 1 << 20
+
+
+def sha256_chunks(chunks):
+    # hex sha256 of an iterable of byte strings
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path):
+    with open(path, 'rb') as file:
+        return sha256_chunks(iter(lambda: file.read(HASH_CHUNK), b''))
@@ -0,0 +1,142 @@
+import contextlib
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+# stage timing spans, byte counters and observed values (entropy, bits per pixel) of the compressor,
+# sent to the 'compressor' logger at debug level and to every registered sink
+# with no sink and debug logging off, span() hands back one shared no-op context and nothing is measured
+# numpy is only imported by the functions that need it, the app registers a sink at startup
+logger = logging.getLogger('compressor')
+_sinks = []
+NULL_SPAN = contextlib.nullcontext()
+
+
+class MetricsSink:
+    # receives every measurement, subclasses override what they need
+    def span(self, stage, seconds, nbytes=0):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+
+class MemorySink(MetricsSink):
+    # keeps the last `window` spans of every stage for percentiles, plus running counter totals
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.spans = defaultdict(lambda: deque(maxlen=self.window))
+        self.counters = defaultdict(int)
+        self.observations = defaultdict(lambda: deque(maxlen=self.window))
+
+    def span(self, stage, seconds, nbytes=0):
+        with self.lock:
+            self.spans[stage].append((seconds, nbytes))
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.observations[name].append(value)
+
+    def snapshot(self):
+        # p50/p95 seconds and MB/s of every stage, counter totals and mean observed values
+        import numpy as np
+        with self.lock:
+            stages = {}
+            for stage, spans in self.spans.items():
+                seconds = np.array([span[0] for span in spans])
+                nbytes = sum(span[1] for span in spans)
+                stages[stage] = {'count': len(seconds),
+                                 'p50': float(np.percentile(seconds, 50)),
+                                 'p95': float(np.percentile(seconds, 95)),
+                                 'mb_per_s': nbytes / 1e6 / seconds.sum() if nbytes and seconds.sum() else None}
+            return {'stages': stages, 'counters': dict(self.counters),
+                    'observations': {name: {'count': len(values), 'mean': float(np.mean(values))}
+                                     for name, values in self.observations.items() if values}}
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def enabled():
+    return bool(_sinks) or logger.isEnabledFor(logging.DEBUG)
+
+
+def span(stage, nbytes=0):
+    # `with span('encode', raw_bytes):` times the block
+    if not enabled():
+        return NULL_SPAN
+    return _timed(stage, nbytes)
+
+
+@contextlib.contextmanager
+def _timed(stage, nbytes):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    logger.debug("%s took %.4fs (%d bytes)", stage, seconds, nbytes)
+    for sink in _sinks:
+        sink.span(stage, seconds, nbytes)
+
+
+def timed(stage, nbytes=None):
+    # decorator form of span, nbytes optionally maps the result to the bytes it covers
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            size = nbytes(result) if nbytes else 0
+            logger.debug("%s took %.4fs (%d bytes)", stage, seconds, size)
+            for sink in _sinks:
+                sink.span(stage, seconds, size)
+            return result
+        return wrapper
+    return decorate
+
+
+def count(name, value):
+    if not enabled():
+        return
+    logger.debug("%s += %d", name, value)
+    for sink in _sinks:
+        sink.count(name, value)
+
+
+def observe(name, value):
+    if not enabled():
+        return
+    logger.debug("%s = %.4f", name, value)
+    for sink in _sinks:
+        sink.observe(name, value)
+
+
+def entropy(freq):
+    # order-0 entropy in bits per symbol of a histogram, summed over channels for a (channels, alphabet)
+    # one and divided by the channel count, so it compares directly with achieved bits per symbol
+    import numpy as np
+    freq = np.atleast_2d(freq)
+    total = freq.sum()
+    bits = 0.0
+    for channel in freq:
+        p = channel[channel > 0] / channel.sum()
+        bits += -(p * np.log2(p)).sum() * channel.sum()
+    return bits / total if total else 0.0
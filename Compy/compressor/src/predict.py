@@ -0,0 +1,120 @@
+import numpy as np
+
+# reversible prediction filters, applied to each tile on its own so tiles stay independently decodable
+# neighbours outside the tile count as 0, so paeth and med fall back to left/up on the tile edges
+PREDICTORS = ['none', 'left', 'up', 'paeth', 'med']
+NONE, LEFT, UP, PAETH, MED = range(len(PREDICTORS))
+# stored in the header when every row picks its own predictor
+PER_ROW = 255
+# rows the per image choice looks at
+SAMPLE_ROWS = 256
+# paeth and med need signed arithmetic, they are worked out in int32 on blocks of about this many samples
+# so the intermediates stay small next to the tile
+PREDICT_BLOCK = 1 << 16
+
+
+def neighbours(tile, above=None):
+    # left, up and up-left neighbour of every pixel of a (rows, cols, channels) tile, above is the row
+    # over its first one (zeros by default)
+    padded = np.zeros((tile.shape[0] + 1, tile.shape[1] + 1) + tile.shape[2:], dtype=np.int32)
+    if above is not None:
+        padded[0, 1:] = above
+    padded[1:, 1:] = tile
+    return padded[1:, :-1], padded[:-1, 1:], padded[:-1, :-1]
+
+
+def prediction(predictor, a, b, c):
+    if predictor == NONE:
+        return np.zeros_like(a)
+    if predictor == LEFT:
+        return a
+    if predictor == UP:
+        return b
+    if predictor == PAETH:
+        pa = np.abs(b - c)
+        pb = np.abs(a - c)
+        pc = np.abs(a + b - 2 * c)
+        return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    # LOCO-I median edge detector
+    return np.where(c >= np.maximum(a, b), np.minimum(a, b),
+                    np.where(c <= np.minimum(a, b), np.maximum(a, b), a + b - c))
+
+
+def residuals(tile, predictor, bits=8):
+    # residuals are taken modulo 2 ** bits, so they keep the sample's own width; none hands the tile
+    # back as is, left and up subtract in the sample type (it wraps around like the modulo)
+    mask = (1 << bits) - 1
+    if predictor == NONE:
+        return tile
+    if predictor in (LEFT, UP):
+        out = tile.copy()
+        if predictor == LEFT:
+            out[:, 1:] -= tile[:, :-1]
+        else:
+            out[1:] -= tile[:-1]
+        if mask != np.iinfo(tile.dtype).max:
+            out &= mask
+        return out
+    out = np.empty_like(tile)
+    rows = max(1, PREDICT_BLOCK // max(1, tile[0].size))
+    for top in range(0, tile.shape[0], rows):
+        block = tile[top:top + rows]
+        a, b, c = neighbours(block, tile[top - 1] if top else None)
+        out[top:top + rows] = (block - prediction(predictor, a, b, c)) & mask
+    return out
+
+
+def entropy(symbols):
+    counts = np.bincount(symbols.reshape(-1))
+    p = counts[counts > 0] / symbols.size
+    return -(p * np.log2(p)).sum()
+
+
+def choose_predictor(sample, bits=8):
+    # the predictor whose residuals have the lowest order-0 entropy
+    return int(np.argmin([entropy(residuals(sample, predictor, bits)) for predictor in range(len(PREDICTORS))]))
+
+
+def predict_tile(tile, predictor, bits=8):
+    # returns the residual tile and the predictor of every row
+    # PER_ROW lets each row pick the predictor that is cheapest under the tile's residual statistics
+    if predictor != PER_ROW:
+        return residuals(tile, predictor, bits), np.full(tile.shape[0], predictor, dtype=np.uint8)
+    candidates = np.stack([residuals(tile, predictor, bits) for predictor in range(len(PREDICTORS))])
+    costs = []
+    for candidate in candidates:
+        counts = np.bincount(candidate.reshape(-1))
+        bits = -np.log2(np.maximum(counts, 1) / candidate.size)
+        costs.append(bits[candidate].reshape(tile.shape[0], -1).sum(axis=1))
+    rows = np.argmin(costs, axis=0).astype(np.uint8)
+    return candidates[rows, np.arange(tile.shape[0])], rows
+
+
+def unpredict_tiles(tiles, row_predictors, bits=8):
+    # tiles is a (count, rows, cols, channels) uint8 or uint16 batch of residuals, row_predictors is (count, rows)
+    mask = (1 << bits) - 1
+    used = np.unique(row_predictors)
+    if len(used) == 1 and used[0] in (NONE, LEFT, UP):
+        if used[0] == NONE:
+            return tiles
+        # the cumsum wraps around at the dtype's width, masking undoes the modulo 2 ** bits subtraction
+        out = np.cumsum(tiles, axis=2 if used[0] == LEFT else 1, dtype=tiles.dtype)
+        return out if mask == np.iinfo(tiles.dtype).max else out & mask
+
+    # every pixel depends on its left and upper neighbours, so all pixels on one anti-diagonal
+    # (of every tile in the batch) are reconstructed together
+    count, rows, cols = tiles.shape[:3]
+    out = np.zeros((count, rows + 1, cols + 1) + tiles.shape[3:], dtype=np.int32)
+    extra_axes = (1,) * (tiles.ndim - 3)
+    for diagonal in range(rows + cols - 1):
+        ys = np.arange(max(0, diagonal - cols + 1), min(rows, diagonal + 1))
+        xs = diagonal - ys
+        a = out[:, ys + 1, xs]
+        b = out[:, ys, xs + 1]
+        c = out[:, ys, xs]
+        ids = row_predictors[:, ys].reshape(row_predictors.shape[0], len(ys), *extra_axes)
+        pred = np.zeros_like(a)
+        for predictor in used:
+            pred = np.where(ids == predictor, prediction(predictor, a, b, c), pred)
+        out[:, ys + 1, xs + 1] = (tiles[:, ys, xs] + pred) & mask
+    return out[:, 1:, 1:].astype(tiles.dtype)
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from compressor.src.bands import CFA_MODE, WIDE_MODES
+
+# longest side of every preview, the largest is box filtered from the pixels as they go by and the
+# rest are scaled down from it; none is larger than the image
+PREVIEW_SIZES = (256, 1024, 2048)
+PREVIEW_FORMAT = ('JPEG', '.jpg', 'image/jpeg')
+PREVIEW_QUALITY = 85
+
+
+class PreviewBuilder:
+    # previews of an image fed a band of rows at a time, top to bottom, as the compressor reads it;
+    # only the largest preview (as 16 bit samples) and one row of sums are held
+    def __init__(self, shape, mode, sizes=PREVIEW_SIZES):
+        self.mode = mode
+        self.sizes = sorted(sizes)
+        rows, cols = shape[:2]
+        scale = min(1, self.sizes[-1] / max(rows, cols))
+        out_rows, out_cols = max(1, round(rows * scale)), max(1, round(cols * scale))
+        # every preview pixel averages the source rows and columns that map to it
+        self.dest_rows = np.arange(rows) * out_rows // rows
+        self.col_starts = -(-np.arange(out_cols) * cols // out_cols)
+        self.col_counts = np.diff(np.append(self.col_starts, cols))
+        self.pixels = np.zeros((out_rows, out_cols) + tuple(shape[2:]), dtype=np.uint16)
+        self.sums = np.zeros((out_cols,) + tuple(shape[2:]), dtype=np.float64)
+        self.count = 0
+        self.peak = 0
+
+    def add(self, band, top):
+        # rows top..top + len(band) of the image
+        self.peak = max(self.peak, int(band.max(initial=0)))
+        band_cols = np.add.reduceat(band, self.col_starts, axis=1, dtype=np.uint64)
+        dest = self.dest_rows[top:top + len(band)]
+        starts = np.flatnonzero(np.concatenate([[True], dest[1:] != dest[:-1]]))
+        band_rows = np.add.reduceat(band_cols, starts, axis=0)
+        counts = np.diff(np.append(starts, len(band)))
+        for row, sums, count, start in zip(dest[starts], band_rows, counts, starts):
+            self.sums += sums
+            self.count += count
+            if top + start + count == len(self.dest_rows) or self.dest_rows[top + start + count] != row:
+                # every source row of this preview row has gone by
+                counts_shape = (-1,) + (1,) * (self.sums.ndim - 1)
+                self.pixels[row] = np.rint(self.sums / (self.count * self.col_counts.reshape(counts_shape)))
+                self.sums[:] = 0
+                self.count = 0
+
+    def images(self):
+        # {size: PIL image} of every preview, 8 bit like HuffmanCompressor.to_image shows the image:
+        # a mosaic's colour planes are averaged to grey and wide samples scaled down by their peak
+        pixels = self.pixels.astype(np.float64)
+        if self.mode == CFA_MODE:
+            pixels = pixels.mean(axis=2)
+        if self.mode == CFA_MODE or self.mode in WIDE_MODES:
+            pixels = pixels / (1 << max(0, self.peak.bit_length() - 8))
+        pixels = np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+        largest = Image.fromarray(pixels[..., 0] if pixels.ndim == 3 and pixels.shape[2] == 1 else pixels)
+        if largest.mode not in ('L', 'RGB'):
+            largest = largest.convert('RGB')
+        previews = {}
+        for size in self.sizes:
+            scale = min(1, size / max(largest.size))
+            dims = (max(1, round(largest.width * scale)), max(1, round(largest.height * scale)))
+            previews[size] = largest if dims == largest.size else largest.resize(dims, Image.BOX)
+        return previews
+
+
+def preview_path(blob_path, size):
+    # previews are stored next to their compressed file, <blob>.<size><suffix>
+    return f'{blob_path}.{size}{PREVIEW_FORMAT[1]}'
+
+
+def save_previews(previews, blob_path):
+    # writes every preview next to blob_path, returns their paths; readers never see half a file
+    paths = {}
+    for size, image in previews.items():
+        paths[size] = preview_path(blob_path, size)
+        temp = f'{paths[size]}.{os.getpid()}.tmp'
+        image.save(temp, PREVIEW_FORMAT[0], quality=PREVIEW_QUALITY)
+        os.replace(temp, paths[size])
+    return paths
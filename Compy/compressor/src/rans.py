@@ -0,0 +1,278 @@
+import numpy as np
+
+from compressor.src.entropy import EntropyCoder, GROUP_SIZE, SEGMENT_SIZE, symbol_dtype, symbol_tables
+
+# byte-wise rANS with a 32 bit state, every SEGMENT_SIZE symbol segment is its own stream (lane) and
+# all lanes of a batch are stepped together, one numpy operation per symbol position
+# frequencies are quantized to sum to 2 ** SCALE_BITS, so a symbol costs close to -log2(p) bits
+# instead of Huffman's whole bits, which matters for the very skewed residuals of flat areas
+# a lane is its final state (u32, little endian) followed by the bytes renormalization pushed out,
+# in the order the decoder pulls them back in
+SCALE_BITS = 15
+# the state stays in [RANS_L, RANS_L << 8) between symbols
+RANS_L = 1 << 23
+
+
+def normalize_freqs(freq, scale_bits=SCALE_BITS):
+    # a histogram quantized to sum to 2 ** scale_bits, every symbol that occurs keeps at least 1
+    target = 1 << scale_bits
+    total = int(freq.sum())
+    used = freq > 0
+    if int(used.sum()) > target:
+        raise ValueError(f"more than {target} distinct symbols, too many for rANS tables")
+    quantized = np.zeros(len(freq), dtype=np.int64)
+    if total == 0:
+        return quantized.astype(np.uint16)
+    quantized[used] = np.maximum(1, (freq[used].astype(np.int64) * target + total // 2) // total)
+    excess = int(quantized.sum()) - target
+    if excess < 0:
+        quantized[np.argmax(freq)] -= excess
+    # rounding up too often is taken back from the most frequent symbols, where it costs the least
+    for symbol in np.argsort(-quantized, kind='stable'):
+        if excess <= 0:
+            break
+        take = min(excess, int(quantized[symbol]) - 1)
+        quantized[symbol] -= take
+        excess -= take
+    return quantized.astype(np.uint16)
+
+
+def stacked_tables(table_sets):
+    # every freqs array of table_sets stacked into flat frequency and cumulative start lookups,
+    # plus the first table number of every set
+    bases = np.cumsum([0] + [len(freqs) for freqs in table_sets])
+    all_freqs = np.concatenate(table_sets).astype(np.int64)
+    start = np.cumsum(all_freqs, axis=1) - all_freqs
+    return all_freqs, start, bases
+
+
+def rans_encode(tiles, tile_freqs, chunk_size, selectors=None, period=None):
+    # (bit length of every lane, total bits, payload) of every flat symbol array in tiles, symbol i of a
+    # tile coded with its freqs[i % len(freqs)], or the one its selectors pick; lanes of several tiles are
+    # coded together, in batches of about chunk_size symbols to bound the per-lane byte buffers
+    table_sets = {}
+    for freqs in tile_freqs:
+        table_sets.setdefault(id(freqs), freqs)
+    all_freqs, start, bases = stacked_tables(list(table_sets.values()))
+    set_bases = dict(zip(table_sets, bases))
+    alphabet = all_freqs.shape[1]
+    freq = all_freqs.reshape(-1).astype(np.uint64)
+    start = start.reshape(-1).astype(np.uint64)
+
+    selectors = selectors or [None] * len(tiles)
+    # lanes are independent, so a tile longer than a batch is coded a run of whole segments at a time
+    piece = max(SEGMENT_SIZE, chunk_size // SEGMENT_SIZE * SEGMENT_SIZE)
+    pieces, owners = [], []
+    batch, batch_symbols = [], 0
+    for number, (symbols, freqs, tile_selectors) in enumerate(zip(tiles, tile_freqs, selectors)):
+        for begin in range(0, len(symbols) or 1, piece):
+            stop = min(begin + piece, len(symbols))
+            table = set_bases[id(freqs)] + symbol_tables(begin, stop, len(freqs), tile_selectors, period)
+            batch.append(symbols[begin:stop].astype(np.int64) + table * alphabet)
+            owners.append(number)
+            batch_symbols += stop - begin
+            if batch_symbols >= chunk_size:
+                pieces.extend(encode_lanes(batch, freq, start))
+                batch, batch_symbols = [], 0
+    if batch:
+        pieces.extend(encode_lanes(batch, freq, start))
+
+    # the pieces of every tile put back together, each starts on a lane boundary
+    results = [[] for _ in tiles]
+    for number, result in zip(owners, pieces):
+        results[number].append(result)
+    return [parts[0] if len(parts) == 1 else
+            (np.concatenate([part[0] for part in parts]), sum(part[1] for part in parts),
+             np.concatenate([part[2] for part in parts]))
+            for parts in results]
+
+
+def encode_lanes(batch, freq, start):
+    # every SEGMENT_SIZE run of every array in batch is a lane, all lanes are coded in one pass over the
+    # segment positions; batch arrays hold table number * alphabet + symbol
+    lanes_per_tile = [-(-len(index) // SEGMENT_SIZE) for index in batch]
+    lanes = sum(lanes_per_tile)
+    padded = np.zeros((lanes, SEGMENT_SIZE), dtype=np.int64)
+    counts = np.zeros(lanes, dtype=np.int64)
+    first = 0
+    for index, tile_lanes in zip(batch, lanes_per_tile):
+        padded[first:first + tile_lanes].reshape(-1)[:len(index)] = index
+        counts[first:first + tile_lanes] = SEGMENT_SIZE
+        counts[first + tile_lanes - 1] = len(index) - (tile_lanes - 1) * SEGMENT_SIZE
+        first += tile_lanes
+    # longest lanes first, the short last lane of every tile only joins in for its own positions
+    order = np.argsort(-counts, kind='stable')
+    padded = padded[order]
+    active = np.searchsorted(-counts[order], -np.arange(SEGMENT_SIZE), side='left')
+
+    state = np.full(lanes, RANS_L, dtype=np.uint64)
+    # a symbol pushes out at most two bytes
+    pushed = np.empty((lanes, 2 * SEGMENT_SIZE), dtype=np.uint8)
+    pushed_counts = np.zeros(lanes, dtype=np.int64)
+    rows = np.arange(lanes)
+    # symbols go in back to front so the decoder gets them front to back
+    for i in range(SEGMENT_SIZE - 1, -1, -1):
+        x = state[:active[i]]
+        symbol = padded[:active[i], i]
+        f = freq[symbol]
+        x_max = f << np.uint64(31 - SCALE_BITS)
+        for _ in range(2):
+            full = x >= x_max
+            if not full.any():
+                break
+            lane = rows[:active[i]][full]
+            pushed[lane, pushed_counts[lane]] = (x[full] & np.uint64(0xFF)).astype(np.uint8)
+            pushed_counts[lane] += 1
+            x[full] >>= np.uint64(8)
+        x[:] = ((x // f) << np.uint64(SCALE_BITS)) + x % f + start[symbol]
+
+    # every lane is its final state then its pushed bytes, last pushed first, lanes back in tile order
+    unsorted = np.empty_like(order)
+    unsorted[order] = rows
+    state = state[unsorted]
+    pushed_counts = pushed_counts[unsorted]
+    sizes = 4 + pushed_counts
+    offsets = np.cumsum(sizes) - sizes
+    payload = np.empty(int(sizes.sum()), dtype=np.uint8)
+    payload[offsets[:, None] + np.arange(4)] = state.astype('<u4').view(np.uint8).reshape(lanes, 4)
+    lane = np.repeat(rows, pushed_counts)
+    within = np.arange(len(lane)) - np.repeat(np.cumsum(pushed_counts) - pushed_counts, pushed_counts)
+    payload[np.repeat(offsets + 4, pushed_counts) + within] = pushed[unsorted[lane], pushed_counts[lane] - 1 - within]
+
+    results = []
+    first = 0
+    for tile_lanes in lanes_per_tile:
+        tile_sizes = sizes[first:first + tile_lanes]
+        start_byte = offsets[first]
+        end_byte = start_byte + int(tile_sizes.sum())
+        results.append(((tile_sizes * 8).astype(np.uint32), int(tile_sizes.sum()) * 8,
+                        payload[start_byte:end_byte]))
+        first += tile_lanes
+    return results
+
+
+def rans_decode(streams):
+    # streams are (payload, lane bits, symbol count, freqs, selectors, period) tuples; every lane of every
+    # stream steps through its segment together, like the Huffman decoder
+    table_sets = {}
+    for stream in streams:
+        table_sets.setdefault(id(stream[3]), stream[3])
+    all_freqs, start, bases = stacked_tables(list(table_sets.values()))
+    set_ids = dict(zip(table_sets, bases))
+    alphabet = all_freqs.shape[1]
+    freq = all_freqs.reshape(-1).astype(np.uint64)
+    start = start.reshape(-1).astype(np.uint64)
+    # slot -> symbol of every table, 2 ** SCALE_BITS slots each
+    slots = np.zeros((len(all_freqs), 1 << SCALE_BITS), dtype=symbol_dtype(alphabet))
+    for table, freqs in zip(slots, all_freqs):
+        used = np.repeat(np.arange(alphabet), freqs)
+        table[:len(used)] = used
+    slots = slots.reshape(-1)
+
+    starts, counts, tables, phases, periods, lanes_per_stream = [], [], [], [], [], []
+    # selectors of every stream laid end to end, every lane starts at its first group's selector
+    group_parts, first_groups = [], []
+    groups = 0
+    offset = 0
+    for payload, lane_bits, symbols, freqs, selectors, period in streams:
+        lanes = len(lane_bits)
+        if selectors is None:
+            selectors, period = np.zeros(-(-symbols // GROUP_SIZE), dtype=np.uint8), len(freqs)
+        group_parts.append(selectors)
+        first_groups.append(groups + np.arange(lanes) * (SEGMENT_SIZE // GROUP_SIZE))
+        groups += len(selectors)
+        lane_starts = np.zeros(lanes, dtype=np.int64)
+        lane_starts[1:] = np.cumsum(np.asarray(lane_bits[:-1], dtype=np.int64) // 8)
+        starts.append(lane_starts + offset)
+        lane_counts = np.full(lanes, SEGMENT_SIZE)
+        lane_counts[-1] = symbols - (lanes - 1) * SEGMENT_SIZE
+        counts.append(lane_counts)
+        tables.append(np.full(lanes, set_ids[id(freqs)]))
+        phases.append(np.arange(lanes) * SEGMENT_SIZE % period)
+        periods.append(np.full(lanes, period))
+        lanes_per_stream.append(lanes)
+        offset += len(payload)
+
+    counts = np.concatenate(counts)
+    order = np.argsort(-counts, kind='stable')
+    pos = np.concatenate(starts)[order]
+    set_base = np.concatenate(tables)[order]
+    phases = np.concatenate(phases)[order]
+    periods = np.concatenate(periods)[order]
+    cycling = bool((periods > 1).any())
+    selectors = np.concatenate(group_parts)
+    selecting = bool(selectors.any())
+    first_groups = np.concatenate(first_groups)[order]
+    table = set_base
+    active = np.searchsorted(-counts[order], -np.arange(SEGMENT_SIZE), side='left')
+
+    buf = np.concatenate([stream[0] for stream in streams] + [np.zeros(4, dtype=np.uint8)]).astype(np.uint64)
+    state = buf[pos] | buf[pos + 1] << np.uint64(8) | buf[pos + 2] << np.uint64(16) | buf[pos + 3] << np.uint64(24)
+    pos = pos + 4
+    mask = np.uint64((1 << SCALE_BITS) - 1)
+    scale = np.uint64(SCALE_BITS)
+
+    decoded = np.empty((len(pos), SEGMENT_SIZE), dtype=slots.dtype)
+    for i in range(SEGMENT_SIZE):
+        if active[i] < len(pos):
+            pos = pos[:active[i]]
+            state = state[:active[i]]
+            set_base = set_base[:active[i]]
+            table = table[:active[i]]
+            first_groups = first_groups[:active[i]]
+            phases = phases[:active[i]]
+            periods = periods[:active[i]]
+        if selecting and i % GROUP_SIZE == 0:
+            # every lane moves on to its next group's set
+            table = set_base + selectors[first_groups + i // GROUP_SIZE].astype(np.int64) * periods
+        current = table + (phases + i) % periods if cycling else table
+        slot = state & mask
+        symbol = slots[(current << SCALE_BITS) + slot.astype(np.int64)]
+        decoded[:len(pos), i] = symbol
+        index = current * alphabet + symbol
+        state = freq[index] * (state >> scale) + slot - start[index]
+        for _ in range(2):
+            low = state < RANS_L
+            if not low.any():
+                break
+            state[low] = (state[low] << np.uint64(8)) | buf[pos[low]]
+            pos[low] += 1
+
+    lanes = np.empty_like(decoded)
+    lanes[order] = decoded
+    bounds = np.cumsum([0] + lanes_per_stream)
+    return [lanes[bounds[i]:bounds[i + 1]].ravel()[:stream[2]] for i, stream in enumerate(streams)]
+
+
+class RansCoder(EntropyCoder):
+    name = 'rans'
+    table_dtype = np.uint16
+    # symbol indices, padded lanes, pushed bytes and the payload
+    encode_bytes = 32
+
+    def usable(self, freqs):
+        return int((freqs > 0).sum(axis=1).max(initial=0)) <= 1 << SCALE_BITS
+
+    def make_tables(self, freqs, bits):
+        return np.stack([normalize_freqs(freq) for freq in freqs])
+
+    def symbol_bits(self, tables):
+        bits = np.full(tables.shape, np.inf)
+        used = tables > 0
+        bits[used] = SCALE_BITS - np.log2(tables[used])
+        return bits
+
+    def cost(self, freqs, tables):
+        used = freqs > 0
+        bits = (freqs[used] * (SCALE_BITS - np.log2(tables[used]))).sum()
+        # every lane also flushes its 32 bit state
+        return int(bits) + 32 * -(-int(freqs.sum()) // SEGMENT_SIZE)
+
+    def encode(self, symbols, tables, bits, chunk_size, selectors=None, period=None):
+        return rans_encode([symbols], [tables], chunk_size, [selectors], period)[0]
+
+    def encode_many(self, tiles, tables, bits, chunk_size, selectors=None, period=None):
+        return rans_encode(tiles, tables, chunk_size, selectors, period)
+
+    def decode(self, streams):
+        return rans_decode(streams)
@@ -0,0 +1,63 @@
+import numpy as np
+
+# run-length layer between prediction and entropy coding: a run of at least MIN_RUN equal symbols
+# becomes the symbol itself followed by run tokens for its repeats, token k (coded as alphabet + k)
+# standing for 2 ** k more copies of the symbol before it, one token per set bit of the repeat count
+# tokens share the coder's alphabet, so flat areas cost a few tokens instead of a bit per pixel
+RUN_TOKENS = 32
+MIN_RUN = 4
+# symbols turned into tokens at once, bounds the index arrays; a run crossing a block boundary starts over
+# with a literal
+RUN_BLOCK = 1 << 16
+
+
+def token_dtype(alphabet):
+    return np.uint16 if alphabet + RUN_TOKENS <= 1 << 16 else np.uint32
+
+
+def to_runs(symbols, alphabet, min_run=MIN_RUN):
+    # flat symbols -> flat tokens
+    if len(symbols) <= RUN_BLOCK:
+        return block_runs(symbols, alphabet, min_run)
+    return np.concatenate([block_runs(symbols[start:start + RUN_BLOCK], alphabet, min_run)
+                           for start in range(0, len(symbols), RUN_BLOCK)])
+
+
+def block_runs(symbols, alphabet, min_run=MIN_RUN):
+    count = len(symbols)
+    dtype = token_dtype(alphabet)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    starts = np.flatnonzero(np.concatenate([[True], symbols[1:] != symbols[:-1]]))
+    lengths = np.diff(np.append(starts, count))
+    long = np.flatnonzero(lengths >= min_run)
+    if len(long) == 0:
+        return symbols.astype(dtype)
+    bits = ((lengths[long, None] - 1) >> np.arange(RUN_TOKENS)) & 1
+    # the repeats of a long run are dropped, its tokens go right after its first symbol
+    dropped = np.zeros(count + 1, dtype=np.int8)
+    dropped[starts[long] + 1] = 1
+    dropped[starts[long] + lengths[long]] -= 1
+    kept = np.flatnonzero(np.cumsum(dropped[:-1], dtype=np.int8) == 0)
+    extra = np.zeros(count, dtype=np.int64)
+    extra[starts[long]] = bits.sum(axis=1)
+    # output position of every kept symbol: symbols kept before it plus run tokens before it
+    position = np.arange(len(kept)) + (np.cumsum(extra) - extra)[kept]
+    tokens = np.empty(len(kept) + int(extra.sum()), dtype=dtype)
+    tokens[position] = symbols[kept]
+    # lowest bit first
+    run, bit = np.nonzero(bits)
+    rank = np.cumsum(bits, axis=1)[run, bit] - 1
+    first = np.searchsorted(kept, starts[long])
+    tokens[position[first[run]] + 1 + rank] = alphabet + bit
+    return tokens
+
+
+def from_runs(tokens, alphabet, dtype):
+    # flat tokens -> flat symbols of dtype
+    is_run = tokens >= alphabet
+    positions = np.arange(len(tokens))
+    # every token repeats the closest literal at or before it, a run token never starts a tile
+    literal = np.maximum.accumulate(np.where(is_run, 0, positions))
+    lengths = np.where(is_run, np.int64(1) << (tokens.astype(np.int64) - alphabet), 1)
+    return np.repeat(tokens[literal].astype(dtype), lengths)
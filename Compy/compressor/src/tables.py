@@ -0,0 +1,121 @@
+import struct
+import zlib
+
+import numpy as np
+
+from compressor.src.entropy import GROUP_SIZE
+
+# several code tables per image, bzip2 style: every GROUP_SIZE symbol group picks the set of tables
+# that codes it cheapest, and the sets are refined from the groups that picked them
+# a set holds one table per channel with per_channel_tables, else one
+MAX_TABLE_SETS = 6
+# refinement rounds, each rebuilds every set from its groups and lets every group pick again
+ITERATIONS = 4
+# groups the sets are trained on, larger inputs are trained on evenly strided groups
+TRAIN_GROUPS = 1 << 15
+# at least this many groups for 2, 3, ... sets, like bzip2's limits on its 50 symbol groups
+SET_THRESHOLDS = (2, 12, 24, 48, 96)
+
+
+def set_count(groups, max_sets=MAX_TABLE_SETS):
+    return min(max_sets, 1 + sum(groups >= threshold for threshold in SET_THRESHOLDS))
+
+
+class TrainingSample:
+    # (period position * alphabet + symbol) keys of about one in stride groups of the tiles added to it,
+    # picked by a hash of the group number so the sample does not line up with the image's rows
+    def __init__(self, alphabet, period, stride=1):
+        self.alphabet = alphabet
+        self.period = period
+        self.stride = stride
+        self.keys, self.groups = [], []
+        self.group_count = 0
+        self.symbol_count = 0
+        self.tile_count = 0
+
+    def add(self, symbols):
+        # the kept groups are picked first, only their symbols are ever turned into keys
+        count = -(-len(symbols) // GROUP_SIZE)
+        group = np.arange(count) + self.group_count
+        if self.stride > 1:
+            group = group[(group * 0x9E3779B1 & 0xFFFFFFFF) % self.stride == 0]
+        positions = ((group - self.group_count)[:, None] * GROUP_SIZE + np.arange(GROUP_SIZE)).reshape(-1)
+        positions = positions[positions < len(symbols)]
+        self.keys.append((positions % self.period) * self.alphabet + symbols[positions])
+        self.groups.append(positions // GROUP_SIZE + self.group_count)
+        self.group_count += count
+        self.symbol_count += len(symbols)
+        self.tile_count += 1
+
+    def arrays(self):
+        # keys and group numbers of every sampled symbol, and the fraction of the symbols sampled
+        keys = np.concatenate(self.keys) if self.keys else np.zeros(0, dtype=np.int64)
+        groups = np.concatenate(self.groups) if self.groups else np.zeros(0, dtype=np.int64)
+        return keys, groups, len(keys) / max(1, self.symbol_count)
+
+
+def sample_stride(groups, limit=TRAIN_GROUPS):
+    return max(1, -(-groups // limit))
+
+
+def sample_tiles(tiles, alphabet, period):
+    # TrainingSample of about TRAIN_GROUPS groups of tiles
+    sample = TrainingSample(alphabet, period, sample_stride(sum(-(-len(symbols) // GROUP_SIZE) for symbols in tiles)))
+    for symbols in tiles:
+        sample.add(symbols)
+    return sample
+
+
+def group_costs(keys, starts, set_bits):
+    # (set count, group count) bits of every group in every set, set_bits is (sets, period * alphabet)
+    return np.stack([np.add.reduceat(bits[keys], starts) for bits in set_bits])
+
+
+def cluster_tables(keys, groups, coder, bits, alphabet, period, sets, present, iterations=ITERATIONS):
+    # (tables of every set stacked, (sets * period, alphabet), the payload bits of the groups coded with
+    # their cheapest set, and that set of every group) for the keys of a TrainingSample
+    # every set codes every symbol present marks, (period, alphabet), keys may be a sample of the symbols
+    starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+    sizes = np.diff(np.append(starts, len(keys)))
+    group_of = np.repeat(np.arange(len(starts)), sizes)
+    width = period * alphabet
+
+    # first split: groups ranked by their bits per symbol under a single table, busy and flat areas
+    # end up in different sets
+    freq = np.bincount(keys, minlength=width).reshape(period, alphabet)
+    single = coder.symbol_bits(coder.make_tables(freq, bits)).reshape(1, width)
+    rate = group_costs(keys, starts, single)[0] / sizes
+    choice = np.empty(len(starts), dtype=np.int64)
+    choice[np.argsort(rate, kind='stable')] = np.arange(len(starts)) * sets // len(starts)
+
+    for _ in range(iterations):
+        # sets no group picked are dropped
+        used, choice = np.unique(choice, return_inverse=True)
+        freqs = np.bincount(choice[group_of] * width + keys, minlength=len(used) * width).reshape(len(used), width)
+        freqs += present.reshape(1, width)
+        tables = coder.make_tables(freqs.reshape(len(used) * period, alphabet), bits)
+        costs = group_costs(keys, starts, coder.symbol_bits(tables).reshape(len(used), width))
+        choice = np.argmin(costs, axis=0)
+    return tables, float(costs.min(axis=0).sum()), choice
+
+
+def select_tables(symbols, tables, coder, alphabet, period):
+    # the cheapest set for every group of a tile, as uint8 selectors
+    key = (np.arange(len(symbols)) % period) * alphabet + symbols
+    sets = len(tables) // period
+    costs = group_costs(key, np.arange(0, len(symbols), GROUP_SIZE),
+                        coder.symbol_bits(tables).reshape(sets, period * alphabet))
+    return np.argmin(costs, axis=0).astype(np.uint8)
+
+
+def pack_selectors(selectors):
+    # neighbouring groups mostly pick the same set, selector bytes deflate to little
+    data = zlib.compress(selectors.astype(np.uint8).tobytes())
+    return struct.pack('<I', len(data)) + data
+
+
+def unpack_selectors(data, offset):
+    # selectors stored at offset, and the offset right after them
+    size, = struct.unpack_from('<I', data, offset)
+    selectors = np.frombuffer(zlib.decompress(data[offset + 4:offset + 4 + size]), dtype=np.uint8)
+    return selectors, offset + 4 + size
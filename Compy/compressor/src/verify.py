@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from compressor.src.codec import Decoder
+
+# checks compressed files against the CRCs they carry on a pool of processes, one file per process at a time
+# only the bytes are checked by default, which reads every file once and decodes nothing; with decode every
+# tile is also decoded and compared with the CRC of the pixels it was coded from
+SUFFIX = '.huf'
+
+
+def find_containers(paths, suffix=SUFFIX):
+    # the files among paths plus every file ending in suffix under the directories among them, in a stable order
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for folder, folders, files in os.walk(path):
+            folders.sort()
+            found.extend(os.path.join(folder, name) for name in sorted(files) if name.endswith(suffix))
+    return found
+
+
+def verify_file(path, decode=False, dictionary_dir=None):
+    # pool worker, returns the record of one file: its size and every corrupt block, or the error that
+    # kept it from being checked at all
+    record = {'path': path, 'size': 0, 'blocks': [], 'error': None}
+    start = time.perf_counter()
+    try:
+        record['size'] = os.path.getsize(path)
+        errors = Decoder(dictionary_dir=dictionary_dir).verify(path, decode)
+        record['blocks'] = [error._asdict() for error in errors]
+    except Exception as error:
+        record['error'] = f'{type(error).__name__}: {error}'
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def verify_files(paths, workers=None, decode=False, dictionary_dir=None, on_record=None):
+    # verifies every file of find_containers(paths), on_record(record, summary) is called as each finishes;
+    # returns the final summary
+    files = find_containers(paths)
+    summary = {'total': len(files), 'done': 0, 'corrupt': 0, 'bytes': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(verify_file, path, decode, dictionary_dir) for path in files]
+        for future in as_completed(futures):
+            record = future.result()
+            summary['done'] += 1
+            summary['corrupt'] += bool(record['error'] or record['blocks'])
+            summary['bytes'] += record['size']
+            seconds = time.perf_counter() - start
+            summary.update(seconds=seconds, mb_per_s=summary['bytes'] / 1e6 / seconds if seconds else 0.0)
+            if on_record is not None:
+                on_record(record, dict(summary))
+    summary['seconds'] = time.perf_counter() - start
+    summary['mb_per_s'] = summary['bytes'] / 1e6 / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
@@ -0,0 +1,85 @@
+import io
+import os
+
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase
+
+from compressor.models import CompressedImage, RawImage
+from compressor.src.batch import MANIFEST_NAME, compress_dir, read_manifest
+from compressor.src.codec import Decoder
+
+from .utils import CompressorTestCase, photo, quiet_logs, temp_media
+
+
+class CompressDirTests(CompressorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = os.path.join(self.folder, 'images')
+        self.out = os.path.join(self.folder, 'out')
+        os.makedirs(os.path.join(self.root, 'day'))
+        self.pixels = {'a.png': photo(40, 50), os.path.join('day', 'b.npy'): photo(30, 20, seed=1)}
+        for name, pixels in self.pixels.items():
+            self.save(pixels, os.path.join('images', name))
+
+    def test_outputs_mirror_the_tree(self):
+        summary = compress_dir(self.root, self.out, workers=1)
+        self.assertEqual((summary['done'], summary['skipped'], summary['failed']), (2, 0, 0))
+        for name, pixels in self.pixels.items():
+            decoded = Decoder().decompress(os.path.join(self.out, name + '.huf'))
+            np.testing.assert_array_equal(decoded, pixels)
+        records = read_manifest(os.path.join(self.out, MANIFEST_NAME))
+        self.assertEqual(set(records), {os.path.join(self.root, name) for name in self.pixels})
+
+    def test_reruns_resume_from_the_manifest(self):
+        with open(os.path.join(self.root, 'broken.png'), 'wb') as file:
+            file.write(b'not an image')
+        summary = compress_dir(self.root, self.out, workers=1)
+        self.assertEqual((summary['done'], summary['failed']), (3, 1))
+        # an interrupted run can leave half a line behind
+        with open(os.path.join(self.out, MANIFEST_NAME), 'a') as file:
+            file.write('{"source": ')
+        summary = compress_dir(self.root, self.out, workers=1)
+        self.assertEqual((summary['done'], summary['skipped'], summary['failed']), (1, 2, 1))
+        # a changed source is compressed again
+        self.save(photo(40, 50, seed=2), os.path.join('images', 'a.png'))
+        os.utime(os.path.join(self.root, 'a.png'), ns=(1, 1))
+        summary = compress_dir(self.root, self.out, workers=1)
+        self.assertEqual((summary['done'], summary['skipped']), (2, 1))
+
+
+class CompressDirCommandTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        media = temp_media(self)
+        self.root = os.path.join(media, 'images')
+        self.out = os.path.join(media, 'out')
+        os.makedirs(self.root)
+        for seed in range(3):
+            np.save(os.path.join(self.root, f'{seed}.npy'), photo(30, 40, seed=seed))
+
+    def compress_dir(self, *args, out=None):
+        output = io.StringIO()
+        call_command('compress_dir', self.root, '--out', out or self.out, '--workers', '1', *args, stdout=output)
+        return output.getvalue()
+
+    def test_db_rows(self):
+        self.assertIn('3 compressed, 0 already done', self.compress_dir('--db', '--batch-size', '2'))
+        self.assertEqual((RawImage.objects.count(), CompressedImage.objects.count()), (3, 3))
+        compressed = CompressedImage.objects.first()
+        self.assertTrue(os.path.exists(compressed.original.image.path))
+        self.assertEqual(Decoder().decompress(compressed.file_loc).shape, (30, 40, 3))
+        self.assertIn('0 compressed, 3 already done', self.compress_dir('--db'))
+        self.assertEqual(CompressedImage.objects.count(), 3)
+
+    def test_db_rows_are_backfilled_from_the_manifest(self):
+        # a run without --db, or one interrupted before its last batch was inserted
+        self.compress_dir()
+        self.assertFalse(CompressedImage.objects.exists())
+        self.assertIn('0 compressed, 3 already done', self.compress_dir('--db'))
+        self.assertEqual(CompressedImage.objects.count(), 3)
+
+    def test_different_settings_are_separate_results(self):
+        self.compress_dir('--db')
+        self.compress_dir('--db', '--entropy-coder', 'rans', out=os.path.join(self.out, 'rans'))
+        self.assertEqual((RawImage.objects.count(), CompressedImage.objects.count()), (3, 6))
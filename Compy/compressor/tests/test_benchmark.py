@@ -0,0 +1,57 @@
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+
+from compressor.src.benchmark import STAGES, main, regressions, synthetic_image
+
+from .utils import CompressorTestCase
+
+
+class BenchmarkTests(CompressorTestCase):
+    def run_main(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = main(['--kinds', 'photo', 'flat', '--sizes', '32', '--repeats', '1'] + list(argv))
+        return status, output.getvalue()
+
+    def test_synthetic_images_are_deterministic(self):
+        np.testing.assert_array_equal(synthetic_image('photo', 64), synthetic_image('photo', 64))
+        self.assertEqual(synthetic_image('noise', 16, channels=1).shape, (16, 16, 1))
+
+    def test_report(self):
+        path = os.path.join(self.folder, 'bench.json')
+        status, output = self.run_main('--out', path)
+        self.assertEqual(status, 0)
+        with open(path) as file:
+            report = json.load(file)
+        self.assertEqual(set(report['results']), {'photo-32x32x3', 'flat-32x32x3'})
+        self.assertEqual(set(report['results']['photo-32x32x3']['stages']), set(STAGES))
+        self.assertIn('ratio', output)
+
+    def test_regression_gate(self):
+        path = os.path.join(self.folder, 'bench.json')
+        self.run_main('--out', path)
+        with open(path) as file:
+            baseline = json.load(file)
+        self.assertEqual(self.run_main('--baseline', path, '--threshold', '100', '--min-seconds', '0')[0], 0)
+        # a baseline that compressed better and ran faster than anything can
+        for result in baseline['results'].values():
+            result['compressed_bytes'] //= 2
+            for timing in result['stages'].values():
+                timing['seconds'] = 1e-9
+        with open(path, 'w') as file:
+            json.dump(baseline, file)
+        status, output = self.run_main('--baseline', path, '--min-seconds', '0')
+        self.assertEqual(status, 1)
+        self.assertIn('REGRESSION photo-32x32x3:', output)
+        self.assertIn('REGRESSION flat-32x32x3 decode_image:', output)
+
+    def test_fast_stages_are_not_compared(self):
+        result = {'compressed_bytes': 100, 'stages': {'save': {'seconds': 0.002}}}
+        baseline = {'results': {'a': {'compressed_bytes': 100, 'stages': {'save': {'seconds': 0.001}}}}}
+        self.assertEqual(regressions({'a': result}, baseline, 0.1, 0.005), [])
+        self.assertEqual(len(regressions({'a': result}, baseline, 0.1, 0.001)), 1)
+        self.assertEqual(regressions({'b': result}, baseline, 0.1, 0), [])
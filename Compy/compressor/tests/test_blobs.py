@@ -0,0 +1,81 @@
+import hashlib
+import os
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from compressor.blobs import BlobStore, byte_range
+from compressor.models import CompressedImage
+
+from .utils import compressed_image, photo, quiet_logs, temp_media
+
+
+class BlobStoreTests(SimpleTestCase):
+    def test_identical_payloads_share_a_file(self):
+        store = BlobStore(temp_media(self))
+        paths = []
+        for _ in range(2):
+            temp_path = store.temp_path()
+            with open(temp_path, 'wb') as file:
+                file.write(b'payload')
+            paths.append(store.put_file(temp_path))
+            self.assertFalse(os.path.exists(temp_path))
+        checksum = hashlib.sha256(b'payload').hexdigest()
+        self.assertEqual(paths[0], paths[1])
+        self.assertEqual(paths[0], (store.path_for(checksum), 7, checksum))
+        self.assertTrue(paths[0][0].endswith(os.path.join(checksum[:2], checksum[2:4], checksum + '.huf')))
+
+    def test_byte_range(self):
+        for header, expected in (('bytes=0-9', (0, 10)), ('bytes=90-', (90, 100)), ('bytes=-5', (95, 100)),
+                                 ('bytes=50-500', (50, 100)), ('bytes=100-', False), ('bytes=-0', False),
+                                 ('bytes=0-1,5-6', None), ('items=0-1', None), ('bytes=a-b', None), (None, None)):
+            self.assertEqual(byte_range(header, 100), expected, header)
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        self.compressed = compressed_image(photo(80, 90))
+        self.url = reverse('download_compressed', args=[self.compressed.pk])
+        with open(self.compressed.file_loc, 'rb') as file:
+            self.data = file.read()
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual((response['Accept-Ranges'], response['ETag']), ('bytes', f'"{self.compressed.checksum}"'))
+        self.assertIn(f'{self.compressed.original.content_hash}.huf', response['Content-Disposition'])
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=4-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[4:20])
+        self.assertEqual(response['Content-Range'], f'bytes 4-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '16')
+
+    def test_range_past_the_end(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_if_range(self):
+        etag = f'"{self.compressed.checksum}"'
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_identical_results_share_a_blob(self):
+        again = compressed_image(photo(80, 90), 'again.png')
+        self.assertEqual(again.file_loc, self.compressed.file_loc)
+        self.compressed.delete()
+        self.assertTrue(os.path.exists(again.file_loc))
+        again.delete()
+        self.assertFalse(os.path.exists(again.file_loc))
+        self.assertEqual(CompressedImage.objects.count(), 0)
+
+    def test_missing_files_are_not_found(self):
+        os.remove(self.compressed.file_loc)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
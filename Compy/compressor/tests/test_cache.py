@@ -0,0 +1,86 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from PIL import Image
+
+from compressor import views
+from compressor.cache import LRUCache
+
+from .utils import compressed_image, fresh_cache, photo, quiet_logs, temp_media
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_go_first(self):
+        cache = LRUCache(300)
+        for key in 'abc':
+            cache.put(key, bytes(100))
+        cache.get('a')
+        cache.put('d', np.zeros(100, dtype=np.uint8))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([key for key in 'acd' if cache.get(key) is not None], ['a', 'c', 'd'])
+        counters = cache.counters()
+        self.assertEqual((counters['bytes'], counters['evictions'], counters['misses']), (300, 1, 1))
+
+    def test_entries_larger_than_the_cache_are_not_kept(self):
+        cache = LRUCache(100)
+        cache.put('a', bytes(101))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.counters()['bytes'], 0)
+
+    def test_disk_tier_outlives_the_memory_tier(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        cache = LRUCache(100, folder, 250)
+        for key in 'abc':
+            cache.put(key, bytes([ord(key)]) * 100)
+        self.assertEqual(cache.get('b'), b'b' * 100)
+        self.assertIsNone(cache.get('a'))
+        # a new process picks up the files left behind
+        cache = LRUCache(100, folder, 250)
+        self.assertEqual(cache.get('c'), b'c' * 100)
+        self.assertEqual(cache.counters()['disk_hits'], 1)
+
+
+class DisplayTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        fresh_cache(self)
+        self.pixels = photo(100, 120)
+        self.compressed = compressed_image(self.pixels)
+        self.url = reverse('decompress_display_image', args=[self.compressed.pk])
+
+    def test_display(self):
+        response = self.client.get(self.url, {'format': 'png'})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(response.content))), self.pixels)
+        self.assertEqual(self.client.get(self.url)['Content-Type'], 'image/jpeg')
+
+    def test_revalidation_with_the_etag(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(self.url, {'format': 'png'})['ETag'], etag)
+        # rewriting the file makes a new version
+        os.utime(self.compressed.file_loc, ns=(0, 0))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_views_are_decoded_once(self):
+        with mock.patch.object(views, 'view_decoder', wraps=views.view_decoder) as view_decoder:
+            first = self.client.get(self.url).content
+            self.assertEqual(self.client.get(self.url).content, first)
+            # other formats and crops reuse the decoded pixels
+            self.client.get(self.url, {'format': 'png'})
+            self.client.get(reverse('decompress_crop', args=[self.compressed.pk]), {'width': 10, 'height': 10})
+        self.assertEqual(view_decoder.call_count, 1)
+        counters = self.client.get(reverse('cache_stats')).json()
+        self.assertEqual((counters['hits'], counters['entries']), (3, 4))
+
+    def test_missing_images_are_not_found(self):
+        self.assertEqual(self.client.get(reverse('decompress_display_image', args=[0])).status_code, 404)
@@ -0,0 +1,64 @@
+import io
+
+import numpy as np
+
+from compressor.src.codec import Decoder, Encoder
+
+from .utils import CompressorTestCase, photo
+
+
+class Sink(io.RawIOBase):
+    # a pipe or socket, written to but never seeked
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+class CodecTests(CompressorTestCase):
+    def test_incremental_compress(self):
+        pixels = photo(100, 90)
+        source = self.save(pixels, 'photo.npy')
+        for options in ({}, {'memory_limit': 1 << 15, 'tile_size': 32}):
+            chunks = list(Encoder(**options).compress(source))
+            self.assertGreater(len(chunks), 1)
+            np.testing.assert_array_equal(Decoder().decompress(io.BytesIO(b''.join(chunks))), pixels)
+
+    def test_streaming_to_unseekable_sink(self):
+        pixels = photo(100, 90)
+        sink = Sink()
+        Encoder(memory_limit=1 << 15, tile_size=32).compress_to(self.save(pixels, 'photo.npy'), sink)
+        np.testing.assert_array_equal(Decoder().decompress(io.BytesIO(bytes(sink.data))), pixels)
+
+    def test_file_objects(self):
+        pixels = photo(60, 70)
+        source = self.save(pixels, 'photo.ppm')
+        with open(source, 'rb') as file:
+            self.assertRoundtrip(pixels, file, memory_limit=1 << 14)
+        with open(source, 'rb') as file:
+            self.assertRoundtrip(pixels, io.BytesIO(file.read()))
+
+    def test_encoder_is_reused(self):
+        encoder = Encoder(tile_size=32)
+        for seed in range(2):
+            pixels = photo(40, 50, seed=seed)
+            output = io.BytesIO()
+            size = encoder.compress_to(self.save(pixels, f'{seed}.png'), output)
+            self.assertEqual((size, encoder.coder.shape), (len(output.getvalue()), pixels.shape))
+            np.testing.assert_array_equal(Decoder().decompress(io.BytesIO(output.getvalue())), pixels)
+
+    def test_iter_rows_and_regions(self):
+        pixels = photo(100, 90)
+        data, _ = self.compress(self.save(pixels, 'photo.png'), tile_size=(24, 32))
+        bands = list(Decoder().iter_rows(io.BytesIO(data)))
+        self.assertEqual([len(band) for band in bands], [24, 24, 24, 24, 4])
+        np.testing.assert_array_equal(np.concatenate(bands), pixels)
+        region = Decoder().decompress_region(io.BytesIO(data), 30, 61, 5, 77)
+        np.testing.assert_array_equal(region, pixels[30:61, 5:77])
+        with self.assertRaisesMessage(ValueError, "outside the image"):
+            Decoder().decompress_region(io.BytesIO(data), 100, 120, 0, 10)
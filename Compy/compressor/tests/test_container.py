@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from compressor.src.codec import Decoder
+from compressor.src.compressor import VERSION
+
+from .utils import CompressorTestCase, photo
+
+
+class ContainerTests(CompressorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pixels = photo(96, 96)
+        self.data, _ = self.compress(self.save(self.pixels, 'photo.png'))
+
+    def test_roundtrip(self):
+        for channels in (0, 3, 4):
+            pixels = photo(70, 90, channels=channels)
+            self.assertRoundtrip(pixels, self.save(pixels, f'photo{channels}.png'))
+
+    def test_old_versions_are_rejected(self):
+        for version in range(VERSION):
+            data = bytearray(self.data)
+            data[4] = version
+            with self.assertRaisesMessage(ValueError, f"unsupported compressed image version {version}"):
+                Decoder().decompress(io.BytesIO(bytes(data)))
+
+    def test_other_files_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, "is not a compressed image"):
+            Decoder().decompress(io.BytesIO(b'\x89PNG' + self.data[4:]))
+
+
+class ModeTests(CompressorTestCase):
+    def decoded(self, image, name):
+        path = f'{self.folder}/{name}'
+        image.save(path)
+        data, _ = self.compress(path)
+        decoder = Decoder()
+        return decoder.to_image(decoder.decompress(io.BytesIO(data)))
+
+    def test_palette_images_keep_their_colours(self):
+        image = Image.fromarray(photo(40, 50)).quantize(16)
+        decoded = self.decoded(image, 'palette.png')
+        self.assertEqual(decoded.mode, 'RGB')
+        np.testing.assert_array_equal(np.asarray(decoded), np.asarray(image.convert('RGB')))
+
+    def test_transparent_palette_images_keep_their_alpha(self):
+        image = Image.fromarray(photo(40, 50)).quantize(16)
+        image.info['transparency'] = 3
+        decoded = self.decoded(image, 'palette.png')
+        self.assertEqual(decoded.mode, 'RGBA')
+        np.testing.assert_array_equal(np.asarray(decoded), np.asarray(Image.open(f'{self.folder}/palette.png').convert('RGBA')))
+
+    def test_bilevel_images_are_stored_as_greyscale(self):
+        image = Image.fromarray(photo(40, 50, channels=0)).convert('1')
+        decoded = self.decoded(image, 'bilevel.png')
+        self.assertEqual(decoded.mode, 'L')
+        np.testing.assert_array_equal(np.asarray(decoded), np.asarray(image.convert('L')))
@@ -0,0 +1,71 @@
+import hashlib
+import os
+
+from django.contrib import admin
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from compressor import jobs
+from compressor.models import CompressedImage, CompressionJob, RawImage
+
+from .utils import photo, quiet_logs, temp_media, upload
+
+
+class StoreTests(TestCase):
+    def setUp(self):
+        temp_media(self)
+        self.original = RawImage.store(SimpleUploadedFile('a.png', b'original'))
+
+    def test_uploads_share_a_row(self):
+        again = RawImage.store(SimpleUploadedFile('b.png', b'original'))
+        self.assertEqual(again.pk, self.original.pk)
+        self.assertEqual(again.ref_count, 2)
+        self.assertEqual(self.original.content_hash, hashlib.sha256(b'original').hexdigest())
+
+    def test_release_deletes_with_the_last_reference(self):
+        RawImage.store(SimpleUploadedFile('b.png', b'original'))
+        path = self.original.image.path
+        self.original.release()
+        self.assertEqual(RawImage.objects.get(pk=self.original.pk).ref_count, 1)
+        self.original.release()
+        self.assertFalse(RawImage.objects.filter(pk=self.original.pk).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_admin_delete_releases_a_reference(self):
+        RawImage.store(SimpleUploadedFile('b.png', b'original'))
+        model_admin = admin.site._registry[RawImage]
+        model_admin.delete_model(None, self.original)
+        self.assertEqual(RawImage.objects.get(pk=self.original.pk).ref_count, 1)
+        model_admin.delete_queryset(None, RawImage.objects.all())
+        self.assertFalse(RawImage.objects.exists())
+
+
+@override_settings(COMPRESSOR_JOB_WORKERS=0)
+class DedupViewTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        self.pixels = photo(60, 80)
+
+    def test_identical_uploads_reuse_the_result(self):
+        self.client.post(reverse('upload_raw'), {'image': upload(self.pixels)})
+        compressed = CompressedImage.objects.get()
+        response = self.client.post(reverse('upload_raw'), {'image': upload(self.pixels, 'copy.png')})
+        self.assertRedirects(response, reverse('compressed_image_detail', args=[compressed.pk]))
+        self.assertEqual(CompressedImage.objects.count(), 1)
+        self.assertEqual(CompressionJob.objects.count(), 1)
+        self.assertEqual(RawImage.objects.get().ref_count, 2)
+
+    def test_uploads_follow_a_pending_job(self):
+        original = RawImage.store(upload(self.pixels))
+        job = CompressionJob.objects.create(original=original)
+        jobs._owned.add(job.pk)
+        self.addCleanup(jobs._owned.discard, job.pk)
+        response = self.client.post(reverse('upload_raw'), {'image': upload(self.pixels)})
+        self.assertRedirects(response, reverse('compression_job', args=[job.pk]))
+        # a job left queued by another process never finishes, so it is not followed
+        jobs._owned.discard(job.pk)
+        self.client.post(reverse('upload_raw'), {'image': upload(self.pixels)})
+        self.assertEqual(CompressionJob.objects.count(), 2)
+        self.assertEqual(RawImage.objects.get().ref_count, 3)
@@ -0,0 +1,73 @@
+import io
+import os
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from compressor.jobs import compression_params, find_compressed
+from compressor.models import CompressedImage, RawImage
+from compressor.src.codec import Decoder
+from compressor.src.dictionaries import (DictionaryStore, dictionary_id, format_id, pack_dictionary,
+                                         train_dictionary, unpack_dictionary)
+
+from .utils import CompressorTestCase, photo, temp_media
+
+
+class DictionaryTests(CompressorTestCase):
+    options = {'predictor': 'auto', 'entropy_coder': 'auto', 'code_tables': 6, 'tile_size': 512}
+
+    def corpus(self):
+        return [self.save(photo(300, 400, seed=seed), f'c{seed}.png') for seed in range(4)]
+
+    def test_multi_set_dictionary_is_used(self):
+        store = DictionaryStore(os.path.join(self.folder, 'dictionaries'))
+        registered = store.register(train_dictionary(self.corpus(), source='cam', **self.options))
+        pixels = photo(300, 400, seed=4)
+        data, coder = self.compress(self.save(pixels, 'c4.png'), dictionary='auto', dictionary_dir=store.root,
+                                    source='cam', **self.options)
+        self.assertEqual(coder.dictionary_id, registered)
+        self.assertGreater(coder.table_sets, 1)
+        np.testing.assert_array_equal(Decoder(dictionary_dir=store.root).decompress(io.BytesIO(data)), pixels)
+        with self.assertRaisesMessage(ValueError, f"coded with code dictionary {format_id(registered)}"):
+            Decoder().decompress(io.BytesIO(data))
+
+    def test_other_sources_code_their_own_tables(self):
+        store = DictionaryStore(os.path.join(self.folder, 'dictionaries'))
+        store.register(train_dictionary(self.corpus(), source='cam', **self.options))
+        _, coder = self.compress(self.save(photo(100, 100), 'other.png'), dictionary='auto',
+                                 dictionary_dir=store.root, source='scanner', **self.options)
+        self.assertIsNone(coder.dictionary_id)
+
+    def test_packing(self):
+        dictionary = train_dictionary(self.corpus()[:1], source='cam', **self.options)
+        unpacked = unpack_dictionary(pack_dictionary(dictionary))
+        self.assertEqual(unpacked._replace(tables=None), dictionary._replace(tables=None))
+        np.testing.assert_array_equal(unpacked.tables, dictionary.tables)
+        self.assertEqual(dictionary_id(unpacked), dictionary_id(dictionary))
+        with self.assertRaisesMessage(ValueError, "not a code dictionary"):
+            unpack_dictionary(b'HUFC' + pack_dictionary(dictionary)[4:])
+
+    def test_train_dictionary_command(self):
+        self.corpus()
+        folder = os.path.join(self.folder, 'dictionaries')
+        output = io.StringIO()
+        with override_settings(COMPRESSOR_DICTIONARY_DIR=folder):
+            call_command('train_dictionary', self.folder, '--source', 'cam', '--tile-size', '512', stdout=output)
+        self.assertIn('trained on 4 images, registered for cam', output.getvalue())
+        self.assertIsNotNone(DictionaryStore(folder).for_source('cam'))
+
+
+class ParamsDigestTests(TestCase):
+    def setUp(self):
+        temp_media(self)
+        self.original = RawImage.store(SimpleUploadedFile('a.png', b'original'))
+
+    def test_results_are_found_by_params_digest(self):
+        params = compression_params()
+        self.assertGreater(len(params), 200)
+        result = CompressedImage.objects.create(original=self.original, params=params,
+                                                params_digest=CompressedImage.digest(params))
+        self.assertEqual(find_compressed(self.original), result)
+        self.assertIsNone(find_compressed(self.original, compression_params(code_tables=1)))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from compressor.src.compressor import CODER_NAMES, MAX_CODE_LEN, canonical_codes, huffman_lengths
+from compressor.src.rans import SCALE_BITS, normalize_freqs
+
+from .utils import CompressorTestCase, photo
+
+
+class EntropyCoderTests(CompressorTestCase):
+    def test_entropy_coders(self):
+        pixels = photo(120, 100)
+        source = self.save(pixels, 'photo.png')
+        for entropy_coder in CODER_NAMES + ['auto']:
+            for per_tile_tables in (False, True):
+                self.assertRoundtrip(pixels, source, entropy_coder=entropy_coder, per_tile_tables=per_tile_tables,
+                                     tile_size=48, predictor='paeth')
+
+    def test_per_channel_tables(self):
+        pixels = photo(80, 80, channels=4)
+        source = self.save(pixels, 'photo.png')
+        for entropy_coder in CODER_NAMES:
+            self.assertRoundtrip(pixels, source, per_channel_tables=True, entropy_coder=entropy_coder)
+
+    def test_long_tiles_span_several_batches(self):
+        # under this limit a rANS batch holds 4096 symbols and a tile 14 rows of 771
+        pixels = photo(200, 257)
+        self.assertRoundtrip(pixels, self.save(pixels, 'photo.npy'), entropy_coder='rans', memory_limit=1 << 18)
+
+    def test_rans_falls_back_on_wide_alphabets(self):
+        # more distinct symbols than rANS tables hold
+        pixels = np.random.default_rng(0).integers(0, 1 << 16, (300, 300), dtype=np.uint16)
+        with self.assertLogs('compressor', 'WARNING'):
+            _, coder = self.assertRoundtrip(pixels, self.save(pixels, 'noise.npy'), entropy_coder='rans')
+        self.assertEqual(CODER_NAMES[coder.entropy_coder], 'huffman')
+
+    def test_code_lengths_are_limited(self):
+        # Fibonacci counts make the deepest possible tree
+        freq = np.zeros(256, dtype=np.int64)
+        freq[:30] = [1, 1] + [0] * 28
+        for i in range(2, 30):
+            freq[i] = freq[i - 1] + freq[i - 2]
+        lengths = huffman_lengths(freq)
+        self.assertEqual(int(lengths.max()), MAX_CODE_LEN)
+        self.assertLessEqual(sum(2.0 ** -int(length) for length in lengths[lengths > 0]), 1)
+        codes = canonical_codes(lengths)
+        words = {format(int(codes[symbol]), f'0{lengths[symbol]}b') for symbol in np.flatnonzero(lengths)}
+        self.assertFalse(any(a != b and b.startswith(a) for a in words for b in words))
+
+    def test_rans_frequencies_are_normalized(self):
+        freq = np.bincount(photo(64, 64).reshape(-1), minlength=256)
+        freq[7] = 1
+        quantized = normalize_freqs(freq)
+        self.assertEqual(int(quantized.sum()), 1 << SCALE_BITS)
+        np.testing.assert_array_equal(quantized > 0, freq > 0)
+        with self.assertRaises(ValueError):
+            normalize_freqs(np.ones(1 << (SCALE_BITS + 1), dtype=np.int64))
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from compressor.models import CompressedImage, RawImage
+
+from .utils import temp_media
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        temp_media(self)
+        original = RawImage.store(SimpleUploadedFile('a.png', b'original'))
+        start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        # pairs of rows compressed in the same microsecond, ordered by id within it
+        for i in range(7):
+            row = CompressedImage.objects.create(original=original, file_size=1000, compressed_size=100 * (i + 1),
+                                                 size_reduction=CompressedImage.reduction(1000, 100 * (i + 1)),
+                                                 entropy_coder='huffman')
+            CompressedImage.objects.filter(pk=row.pk).update(compressed_at=start + timedelta(seconds=i // 2))
+        self.newest_first = list(CompressedImage.objects.order_by('-compressed_at', '-id').values_list('pk', flat=True))
+
+    def history(self, **params):
+        response = self.client.get(reverse('compression_history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_follow_the_cursor(self):
+        seen, cursor = [], None
+        while True:
+            page = self.history(limit=3, **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(page['results']), 3)
+            seen.extend(row['id'] for row in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.newest_first)
+
+    def test_rows(self):
+        row = self.history(limit=1)['results'][0]
+        self.assertEqual((row['id'], row['compressed_size'], row['size_reduction'], row['entropy_coder']),
+                         (self.newest_first[0], 700, 30.0, 'huffman'))
+        self.assertEqual(row['detail_url'], reverse('compressed_image_detail', args=[row['id']]))
+        self.assertEqual(len(self.history()['results']), 7)
+
+    def test_invalid_cursors(self):
+        for params in ({'cursor': 'abc'}, {'cursor': '1.2.3'}, {'cursor': '9' * 30 + '.1'}, {'limit': 0},
+                       {'limit': 'x'}):
+            self.assertEqual(self.client.get(reverse('compression_history'), params).status_code, 400, params)
+
+    def test_stats(self):
+        stats = self.client.get(reverse('compression_stats')).json()
+        self.assertEqual((stats['count'], stats['raw_bytes'], stats['compressed_bytes'], stats['bytes_saved']),
+                         (7, 7000, 2800, 4200))
+        self.assertAlmostEqual(stats['mean_reduction'], 60.0)
+
+    def test_empty_stats(self):
+        CompressedImage.objects.all().delete()
+        stats = self.client.get(reverse('compression_stats')).json()
+        self.assertEqual((stats['count'], stats['bytes_saved'], stats['mean_reduction']), (0, 0, None))
+
+
+class NumericSizeReductionMigrationTests(TransactionTestCase):
+    before = [('compressor', '0009_compressedimage_entropy_coder')]
+    after = [('compressor', '0010_numeric_size_reduction')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_percent_strings_become_numbers(self):
+        apps = self.migrate(self.before)
+        RawImage = apps.get_model('compressor', 'RawImage')
+        CompressedImage = apps.get_model('compressor', 'CompressedImage')
+        original = RawImage.objects.create(image='a.png', content_hash='a' * 64)
+        values = {'41.82%': 41.82, ' -3.50% ': -3.5, 'n/a': None, None: None}
+        rows = {text: CompressedImage.objects.create(original=original, size_reduction=text).pk for text in values}
+
+        apps = self.migrate(self.after)
+        CompressedImage = apps.get_model('compressor', 'CompressedImage')
+        for text, value in values.items():
+            self.assertEqual(CompressedImage.objects.get(pk=rows[text]).size_reduction, value)
+
+        apps = self.migrate(self.before)
+        CompressedImage = apps.get_model('compressor', 'CompressedImage')
+        self.assertEqual(CompressedImage.objects.get(pk=rows['41.82%']).size_reduction, '41.82%')
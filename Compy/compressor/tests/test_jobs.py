@@ -0,0 +1,67 @@
+import time
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from compressor import jobs
+from compressor.models import CompressionJob
+
+from .utils import photo, quiet_logs, temp_media, upload
+
+
+class JobTests(TransactionTestCase):
+    # jobs run on other threads, which only see committed rows
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+
+    def status(self, job):
+        response = self.client.get(reverse('compression_job_status', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_upload_is_compressed_on_the_pool(self):
+        response = self.client.post(reverse('upload_raw'), {'image': upload(photo(100, 120))})
+        job = CompressionJob.objects.get()
+        self.assertRedirects(response, reverse('compression_job', args=[job.pk]))
+        self.assertContains(self.client.get(response.url), 'status')
+        deadline = time.monotonic() + 30
+        while self.status(job)['status'] in (CompressionJob.QUEUED, CompressionJob.RUNNING):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        status = self.status(job)
+        self.assertEqual((status['status'], status['progress'], status['error']), (CompressionJob.DONE, 1, ''))
+        self.assertEqual(status['detail_url'], reverse('compressed_image_detail', args=[status['compressed_image']]))
+
+    @override_settings(COMPRESSOR_JOB_WORKERS=0)
+    def test_upload_is_compressed_inline_without_a_pool(self):
+        self.client.post(reverse('upload_raw'), {'image': upload(photo(50, 60))})
+        self.assertEqual(self.status(CompressionJob.objects.get())['status'], CompressionJob.DONE)
+
+    @override_settings(COMPRESSOR_JOB_WORKERS=0)
+    def test_failed_jobs_report_their_error(self):
+        with mock.patch.object(jobs, 'compress', side_effect=ValueError("broken image")), \
+                self.assertLogs('compressor', 'ERROR'):
+            self.client.post(reverse('upload_raw'), {'image': upload(photo(50, 60))})
+        status = self.status(CompressionJob.objects.get())
+        self.assertEqual((status['status'], status['error'], status['detail_url']),
+                         (CompressionJob.FAILED, "broken image", None))
+
+    def test_full_queue_turns_uploads_away(self):
+        with mock.patch.object(jobs, 'submit', side_effect=jobs.QueueFull):
+            response = self.client.post(reverse('upload_raw'), {'image': upload(photo(50, 60))})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(CompressionJob.objects.get().status, CompressionJob.FAILED)
+
+    def test_unknown_jobs_are_not_found(self):
+        self.assertEqual(self.client.get(reverse('compression_job_status', args=[1])).status_code, 404)
+
+    @override_settings(COMPRESSOR_WORKERS=4, COMPRESSOR_EXECUTOR='spawn')
+    def test_views_decode_on_threads(self):
+        with override_settings(COMPRESSOR_JOB_WORKERS=0):
+            self.client.post(reverse('upload_raw'), {'image': upload(photo(200, 200))})
+        compressed = CompressionJob.objects.get().compressed
+        with mock.patch('compressor.src.compressor.ProcessPoolExecutor', side_effect=AssertionError("processes started")):
+            response = self.client.get(reverse('decompress_display_image', args=[compressed.pk]))
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,58 @@
+import logging
+
+from django.apps import apps
+from django.test import TestCase
+from django.urls import reverse
+
+from compressor.src import metrics
+
+from .utils import CompressorTestCase, compressed_image, photo, quiet_logs, temp_media
+
+
+class MetricsTests(CompressorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sink = metrics.add_sink(metrics.MemorySink(window=10))
+        self.addCleanup(metrics.remove_sink, self.sink)
+
+    def test_stages_are_timed(self):
+        self.compress(self.save(photo(64, 64), 'photo.png'), tile_size=32)
+        snapshot = self.sink.snapshot()
+        self.assertIn('encode', snapshot['stages'])
+        self.assertGreater(snapshot['stages']['encode']['count'], 0)
+        self.assertLessEqual(snapshot['stages']['encode']['p50'], snapshot['stages']['encode']['p95'])
+
+    def test_window_keeps_the_last_spans(self):
+        for seconds in range(20):
+            self.sink.span('stage', seconds, 1)
+        self.sink.count('bytes', 5)
+        self.sink.count('bytes', 7)
+        snapshot = self.sink.snapshot()
+        self.assertEqual(snapshot['stages']['stage']['count'], 10)
+        self.assertEqual(snapshot['stages']['stage']['p50'], 14.5)
+        self.assertEqual(snapshot['counters'], {'bytes': 12})
+
+    def test_compression_is_logged(self):
+        logging.disable(logging.NOTSET)
+        with self.assertLogs('compressor', 'INFO') as logs:
+            self.compress(self.save(photo(32, 32), 'photo.png'))
+        self.assertTrue(any('compressed' in line for line in logs.output))
+
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+
+    def test_metrics_view(self):
+        compressed_image(photo(64, 64))
+        snapshot = self.client.get(reverse('metrics')).json()
+        self.assertIn('encode', snapshot['stages'])
+        self.assertIn('hits', snapshot['cache'])
+
+    def test_metrics_can_be_off(self):
+        # what ready() leaves with COMPRESSOR_METRICS off
+        config = apps.get_app_config('compressor')
+        self.addCleanup(setattr, config, 'metrics_sink', config.metrics_sink)
+        config.metrics_sink = None
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
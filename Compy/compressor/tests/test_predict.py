@@ -0,0 +1,22 @@
+import numpy as np
+
+from compressor.src.predict import PER_ROW, PREDICTORS, choose_predictor, predict_tile, unpredict_tiles
+
+from .utils import CompressorTestCase, photo
+
+
+class PredictorTests(CompressorTestCase):
+    def test_predictors(self):
+        pixels = photo(90, 121)
+        source = self.save(pixels, 'photo.png')
+        for predictor in PREDICTORS + ['auto', 'rows']:
+            self.assertRoundtrip(pixels, source, predictor=predictor, tile_size=32)
+
+    def test_residuals_are_undone(self):
+        tile = photo(33, 47, channels=0, bits=12)
+        for predictor in list(range(len(PREDICTORS))) + [PER_ROW]:
+            residuals, rows = predict_tile(tile, predictor, bits=12)
+            np.testing.assert_array_equal(unpredict_tiles(residuals[None], rows[None], bits=12)[0], tile)
+
+    def test_smooth_images_are_predicted(self):
+        self.assertNotEqual(PREDICTORS[choose_predictor(photo(64, 64))], 'none')
@@ -0,0 +1,84 @@
+import io
+import os
+
+import numpy as np
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from compressor.src.bands import split_cfa
+from compressor.src.codec import Encoder
+from compressor.src.previews import PREVIEW_FORMAT, PreviewBuilder, preview_path
+
+from .utils import CompressorTestCase, compressed_image, photo, quiet_logs, temp_media
+
+
+class PreviewBuilderTests(CompressorTestCase):
+    def test_bands_make_the_same_previews_as_the_whole_image(self):
+        pixels = photo(301, 203)
+        whole = PreviewBuilder(pixels.shape, 'RGB', (16, 64))
+        whole.add(pixels, 0)
+        banded = PreviewBuilder(pixels.shape, 'RGB', (16, 64))
+        for top in range(0, 301, 7):
+            banded.add(pixels[top:top + 7], top)
+        for size, image in whole.images().items():
+            self.assertEqual(max(image.size), size)
+            np.testing.assert_array_equal(np.asarray(image), np.asarray(banded.images()[size]))
+
+    def test_previews_are_box_filtered(self):
+        pixels = np.kron(np.arange(16, dtype=np.uint8).reshape(4, 4) * 16, np.ones((8, 8), dtype=np.uint8))
+        builder = PreviewBuilder(pixels.shape, 'L', (4, 64))
+        builder.add(pixels, 0)
+        images = builder.images()
+        np.testing.assert_array_equal(np.asarray(images[4]), pixels[::8, ::8])
+        # never larger than the image
+        self.assertEqual(images[64].size, (32, 32))
+
+    def test_streamed_previews(self):
+        pixels = photo(300, 257)
+        for options in ({}, {'memory_limit': 1 << 16}):
+            encoder = Encoder(previews=(32, 128), **options)
+            encoder.compress_file(self.save(pixels, 'photo.npy'), os.path.join(self.folder, 'photo.huf'))
+            self.assertEqual({size: image.size for size, image in encoder.coder.preview_images.items()},
+                             {32: (28, 32), 128: (110, 128)})
+
+    def test_mosaic_previews_are_grey(self):
+        mosaic = photo(200, 300, channels=0, bits=12)
+        encoder = Encoder(previews=(64,))
+        encoder.compress_file(self.save(split_cfa(mosaic), 'planes.npy'), os.path.join(self.folder, 'm.huf'))
+        self.assertEqual((encoder.coder.preview_images[64].mode, encoder.coder.preview_images[64].size),
+                         ('L', (64, 43)))
+
+
+class PreviewViewTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        self.compressed = compressed_image(photo(150, 200))
+
+    def get(self, size):
+        return self.client.get(reverse('compressed_preview', args=[self.compressed.pk, size]))
+
+    def test_previews_are_saved_while_compressing(self):
+        for size in (32, 64):
+            self.assertTrue(os.path.exists(preview_path(self.compressed.file_loc, size)))
+            response = self.get(size)
+            self.assertEqual(response['Content-Type'], PREVIEW_FORMAT[2])
+            self.assertEqual(max(Image.open(io.BytesIO(b''.join(response.streaming_content))).size), size)
+        self.assertContains(self.client.get(reverse('compressed_image_detail', args=[self.compressed.pk])),
+                            reverse('compressed_preview', args=[self.compressed.pk, 32]))
+
+    def test_missing_previews_are_made_once(self):
+        with override_settings(COMPRESSOR_PREVIEW_SIZES=(32, 64, 100)):
+            self.assertEqual(max(Image.open(io.BytesIO(b''.join(self.get(100).streaming_content))).size), 100)
+            self.assertTrue(os.path.exists(preview_path(self.compressed.file_loc, 100)))
+
+    def test_unknown_sizes_are_not_found(self):
+        self.assertEqual(self.get(48).status_code, 404)
+        os.remove(self.compressed.file_loc)
+        self.assertEqual(self.get(32).status_code, 404)
+
+    def test_previews_go_with_their_file(self):
+        path = preview_path(self.compressed.file_loc, 32)
+        self.compressed.delete()
+        self.assertFalse(os.path.exists(path))
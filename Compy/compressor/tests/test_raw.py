@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from compressor.forms import RawImageUploadForm
+from compressor.src.bands import CFA_MODE, merge_cfa, split_cfa
+from compressor.src.codec import Decoder
+from compressor.src.compressor import CODER_NAMES
+
+from .utils import CompressorTestCase, photo, write_dng
+
+
+class RawTests(CompressorTestCase):
+    def test_wide_samples(self):
+        pixels = photo(100, 120, channels=0, bits=12)
+        for name in ('wide.png', 'wide.npy'):
+            source = self.save(pixels, name)
+            for entropy_coder in CODER_NAMES:
+                self.assertRoundtrip(pixels, source, entropy_coder=entropy_coder, predictor='med', tile_size=50)
+        self.assertRoundtrip(pixels, source, memory_limit=1 << 15, code_tables=6)
+
+    def test_colour_filter_planes(self):
+        mosaic = photo(80, 100, channels=0, bits=14)
+        np.testing.assert_array_equal(merge_cfa(split_cfa(mosaic)), mosaic)
+        planes = split_cfa(mosaic)
+        data, coder = self.assertRoundtrip(planes, self.save(planes, 'planes.npy'), memory_limit=1 << 16)
+        self.assertEqual(coder.mode, CFA_MODE)
+
+    def test_camera_raw(self):
+        mosaic = photo(80, 100, channels=0, bits=12)
+        data, coder = self.assertRoundtrip(split_cfa(mosaic), write_dng(f'{self.folder}/shot.dng', mosaic))
+        self.assertEqual((coder.mode, coder.bits), (CFA_MODE, int(mosaic.max()).bit_length()))
+        decoder = Decoder()
+        image = decoder.to_image(decoder.decompress(io.BytesIO(data)))
+        self.assertEqual((image.mode, image.size), ('L', (100, 80)))
+
+
+class UploadFormTests(CompressorTestCase):
+    def form(self, name, content):
+        return RawImageUploadForm(files={'image': SimpleUploadedFile(name, content)})
+
+    def test_camera_raw_files_skip_pillow(self):
+        path = write_dng(f'{self.folder}/shot.dng', photo(40, 60, channels=0, bits=12))
+        with open(path, 'rb') as file:
+            content = file.read()
+        for name in ('shot.dng', 'SHOT.RAF'):
+            form = self.form(name, content)
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertEqual(form.cleaned_data['image'].read(), content)
+
+    def test_invalid_files_are_rejected(self):
+        self.assertEqual(self.form('shot.orf', b'IIRO' + bytes(64)).errors['image'][0],
+                         "Upload a valid camera RAW file.")
+        self.assertFalse(self.form('photo.png', b'not a png').is_valid())
+        with open(self.save(photo(20, 20), 'photo.png'), 'rb') as file:
+            self.assertTrue(self.form('photo.png', file.read()).is_valid())
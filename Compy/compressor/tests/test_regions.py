@@ -0,0 +1,116 @@
+import io
+import os
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+from django.urls import reverse
+from PIL import Image
+
+from compressor.src.bands import split_cfa
+from compressor.src.codec import Decoder, Encoder
+from compressor.src.compressor import HuffmanCompressor
+from compressor.src.previews import save_previews
+
+from .utils import CompressorTestCase, compressed_image, fresh_cache, photo, quiet_logs, temp_media
+
+
+class RegionTests(CompressorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pixels = photo(300, 260)
+        self.path = os.path.join(self.folder, 'photo.huf')
+        self.encoder = Encoder(tile_size=64, previews=(32, 128))
+        self.encoder.compress_file(self.save(self.pixels, 'photo.png'), self.path)
+
+    def test_crop(self):
+        image = Decoder().crop(self.path, 70, 10, 200, 150)
+        np.testing.assert_array_equal(np.asarray(image), self.pixels[10:150, 70:200])
+        # clipped to the image
+        self.assertEqual(Decoder().crop(self.path, 250, 290, 400, 400).size, (10, 10))
+        with self.assertRaisesMessage(ValueError, "outside the image"):
+            Decoder().crop(self.path, 260, 0, 300, 10)
+
+    def test_crop_decodes_only_the_tiles_under_it(self):
+        with mock.patch.object(HuffmanCompressor, 'decode_blocks', autospec=True,
+                               side_effect=HuffmanCompressor.decode_blocks) as decode_blocks:
+            Decoder().crop(self.path, 50, 10, 100, 60)
+        self.assertEqual(len(decode_blocks.call_args.args[1]), 2)
+
+    def test_mosaic_crop(self):
+        mosaic = photo(120, 100, channels=0, bits=12)
+        path = os.path.join(self.folder, 'mosaic.huf')
+        Encoder(tile_size=16).compress_file(self.save(split_cfa(mosaic), 'planes.npy'), path)
+        image = Decoder().crop(path, 5, 7, 31, 40)
+        self.assertEqual(image.size, (26, 33))
+        # scaled to 8 bits by the peak of the whole planes under the box
+        shift = int(mosaic[6:40, 4:32].max()).bit_length() - 8
+        np.testing.assert_array_equal(np.asarray(image), (mosaic[7:40, 5:31] >> shift).astype(np.uint8))
+
+    def test_thumbnail(self):
+        image = Decoder().thumbnail(self.path, 100)
+        self.assertEqual(image.size, (87, 100))
+        expected = Image.fromarray(self.pixels)
+        expected.thumbnail((100, 100))
+        self.assertLess(np.abs(np.asarray(image, dtype=float) - np.asarray(expected, dtype=float)).mean(), 2)
+        self.assertEqual(Decoder().thumbnail(self.path, 50, (0, 0, 40, 80)).size, (25, 50))
+
+    def test_thumbnail_from_a_preview(self):
+        save_previews(self.encoder.coder.preview_images, self.path)
+        with mock.patch.object(HuffmanCompressor, 'decode_blocks', side_effect=AssertionError("decoded")):
+            self.assertEqual(Decoder().thumbnail(self.path, 100, previews=(32, 128)).size, (87, 100))
+            width, height = Decoder().thumbnail(self.path, 32, (0, 0, 130, 150), previews=(32, 128)).size
+            self.assertEqual(height, 32)
+            self.assertAlmostEqual(width, 28, delta=1)
+        # too small for the box, decoded instead
+        with mock.patch.object(HuffmanCompressor, 'decode_blocks', autospec=True,
+                               side_effect=HuffmanCompressor.decode_blocks) as decode_blocks:
+            self.assertEqual(Decoder().thumbnail(self.path, 64, (0, 0, 100, 100), previews=(32, 128)).size,
+                             (64, 64))
+        self.assertTrue(decode_blocks.called)
+
+    def test_large_thumbnails_are_decoded_a_tile_row_at_a_time(self):
+        with mock.patch.object(HuffmanCompressor, 'decode_region', autospec=True,
+                               side_effect=HuffmanCompressor.decode_region) as decode_region:
+            image = Decoder().thumbnail(self.path, 40)
+        self.assertEqual(image.size, (35, 40))
+        self.assertEqual([call.args[1][:2] for call in decode_region.call_args_list],
+                         [(0, 64), (64, 128), (128, 192), (192, 256), (256, 300)])
+
+
+class RegionViewTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        fresh_cache(self)
+        self.pixels = photo(150, 200)
+        self.compressed = compressed_image(self.pixels)
+
+    def image(self, response):
+        return Image.open(io.BytesIO(response.content))
+
+    def get(self, view, **params):
+        return self.client.get(reverse(view, args=[self.compressed.pk]), params)
+
+    def test_crop(self):
+        response = self.get('decompress_crop', x=20, y=30, width=50, height=40, format='png')
+        np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(response.content))), self.pixels[30:70, 20:70])
+        etag = response['ETag']
+        response = self.client.get(reverse('decompress_crop', args=[self.compressed.pk]),
+                                   {'x': 20, 'y': 30, 'width': 50, 'height': 40, 'format': 'png'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_thumbnail(self):
+        # never larger than the image
+        self.assertEqual(self.image(self.get('decompress_thumbnail')).size, (200, 150))
+        self.assertEqual(self.image(self.get('decompress_thumbnail', size=100)).size, (100, 75))
+        self.assertEqual(self.image(self.get('decompress_thumbnail', size=20, x=0, y=0, width=50,
+                                             height=100)).size, (10, 20))
+
+    def test_invalid_regions(self):
+        for view, params in (('decompress_crop', {}), ('decompress_crop', {'width': 10, 'height': -1}),
+                             ('decompress_crop', {'x': 500, 'width': 10, 'height': 10}),
+                             ('decompress_crop', {'width': 'a', 'height': 10}),
+                             ('decompress_thumbnail', {'size': 0})):
+            self.assertEqual(self.get(view, **params).status_code, 400, params)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from compressor.src.compressor import CODER_NAMES
+from compressor.src.runs import RUN_BLOCK, from_runs, to_runs
+
+from .utils import CompressorTestCase, photo
+
+
+class RunLengthTests(CompressorTestCase):
+    def test_run_length(self):
+        pixels = photo(160, 120)
+        pixels[40:120, 10:110] = 77
+        source = self.save(pixels, 'flat.png')
+        plain, _ = self.compress(source, predictor='left')
+        for entropy_coder in CODER_NAMES:
+            self.assertRoundtrip(pixels, source, predictor='left', run_length=True, entropy_coder=entropy_coder,
+                                 tile_size=64)
+        data, _ = self.assertRoundtrip(pixels, source, predictor='left', run_length='auto')
+        self.assertLess(len(data), len(plain))
+
+    def test_tokens(self):
+        symbols = np.array([5, 5, 5, 1, 1, 1, 1, 2] + [9] * 300 + [3], dtype=np.uint8)
+        tokens = to_runs(symbols, 256)
+        # 4 ones are a 1 and a 3 = 2 ** 0 + 2 ** 1 token, 300 nines a 9 and tokens for 299 = 256 + 32 + 8 + 2 + 1
+        np.testing.assert_array_equal(tokens, [5, 5, 5, 1, 256, 257, 2, 9, 256, 257, 259, 261, 264, 3])
+        np.testing.assert_array_equal(from_runs(tokens, 256, np.uint8), symbols)
+
+    def test_runs_across_blocks(self):
+        symbols = np.zeros(RUN_BLOCK * 2 + 10, dtype=np.uint16)
+        symbols[-5:] = 4095
+        tokens = to_runs(symbols, 4096)
+        self.assertLess(len(tokens), 60)
+        np.testing.assert_array_equal(from_runs(tokens, 4096, np.uint16), symbols)
@@ -0,0 +1,39 @@
+from PIL import Image
+
+from .utils import CompressorTestCase, photo
+
+
+class StreamingTests(CompressorTestCase):
+    def test_streaming(self):
+        pixels = photo(300, 257)
+        source = self.save(pixels, 'photo.npy')
+        for options in ({}, {'tile_size': 64}, {'predictor': 'rows', 'tile_size': (32, 100)},
+                        {'entropy_coder': 'rans', 'code_tables': 6}, {'run_length': 'auto', 'per_tile_tables': True}):
+            self.assertRoundtrip(pixels, source, memory_limit=1 << 16, **options)
+
+    def test_streaming_matches_whole_image(self):
+        # bands holding whole tile rows code every tile as the in-memory path does
+        pixels = photo(300, 257)
+        whole, _ = self.compress(self.save(pixels, 'photo.png'), predictor='rows', tile_size=64)
+        streamed, _ = self.compress(self.save(pixels, 'photo.npy'), predictor='rows', tile_size=64,
+                                    memory_limit=4 << 20)
+        self.assertEqual(whole, streamed)
+
+    def test_uncompressed_strips_are_streamed(self):
+        pixels = photo(200, 150)
+        for name in ('photo.ppm', 'photo.tif'):
+            self.assertRoundtrip(pixels, self.save(pixels, name), memory_limit=1 << 14)
+
+    def test_images_decoded_in_full_must_fit(self):
+        pixels = photo(200, 150)
+        source = self.save(pixels, 'photo.png')
+        with self.assertRaisesMessage(ValueError, "over the memory limit"):
+            self.compress(source, memory_limit=1 << 14)
+        self.assertRoundtrip(pixels, source, memory_limit=1 << 20)
+
+    def test_multi_frame_images_are_refused(self):
+        frames = [Image.fromarray(photo(40, 50, seed=seed)) for seed in range(3)]
+        source = f'{self.folder}/frames.tif'
+        frames[0].save(source, save_all=True, append_images=frames[1:])
+        with self.assertRaisesMessage(ValueError, "has 3 frames"):
+            self.compress(source)
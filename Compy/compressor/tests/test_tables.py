@@ -0,0 +1,54 @@
+import numpy as np
+
+from compressor.src.compressor import CODER_NAMES
+from compressor.src.entropy import GROUP_SIZE
+from compressor.src.tables import TrainingSample, pack_selectors, set_count, unpack_selectors
+
+from .utils import CompressorTestCase, photo
+
+
+class TableSetTests(CompressorTestCase):
+    def test_table_sets(self):
+        pixels = photo(256, 256)
+        source = self.save(pixels, 'photo.png')
+        for entropy_coder in CODER_NAMES:
+            self.assertRoundtrip(pixels, source, code_tables=6, entropy_coder=entropy_coder, predictor='auto')
+            self.assertRoundtrip(pixels, source, code_tables=6, entropy_coder=entropy_coder, predictor='auto',
+                                 per_tile_tables=True, tile_size=128)
+            self.assertRoundtrip(pixels, source, code_tables=3, run_length=True, entropy_coder=entropy_coder)
+
+    def test_sets_pay_for_themselves(self):
+        # a flat sky over noise wants more than one set of codes
+        pixels = photo(256, 256)
+        pixels[128:] = np.random.default_rng(0).integers(0, 256, (128, 256, 3))
+        source = self.save(pixels, 'mixed.png')
+        single, _ = self.compress(source, predictor='left')
+        data, coder = self.assertRoundtrip(pixels, source, predictor='left', code_tables=6)
+        self.assertGreater(coder.table_sets, 1)
+        self.assertLess(len(data), len(single))
+
+    def test_set_count_follows_the_group_count(self):
+        self.assertEqual([set_count(groups) for groups in (1, 2, 12, 1000)], [1, 2, 3, 6])
+        self.assertEqual(set_count(1000, max_sets=3), 3)
+
+    def test_selectors(self):
+        selectors = np.random.default_rng(0).integers(0, 6, 1000).astype(np.uint8)
+        data = b'head' + pack_selectors(selectors) + b'tail'
+        unpacked, offset = unpack_selectors(data, 4)
+        np.testing.assert_array_equal(unpacked, selectors)
+        self.assertEqual(data[offset:], b'tail')
+
+    def test_training_sample_strides_over_groups(self):
+        symbols = np.arange(GROUP_SIZE * 100) % 200
+        full, strided = TrainingSample(256, 3), TrainingSample(256, 3, stride=4)
+        for sample in (full, strided):
+            sample.add(symbols)
+            sample.add(symbols[:GROUP_SIZE + 1])
+        keys, groups, fraction = full.arrays()
+        self.assertEqual((len(keys), fraction, int(groups.max())), (len(symbols) + GROUP_SIZE + 1, 1, 101))
+        np.testing.assert_array_equal(keys[:6], [0, 257, 514, 3, 260, 517])
+        keys, groups, fraction = strided.arrays()
+        self.assertLess(fraction, 0.5)
+        # whole groups are kept or dropped, the last one is a single symbol long
+        counts = np.bincount(groups)
+        self.assertLessEqual(set(counts[counts > 0].tolist()), {GROUP_SIZE, 1})
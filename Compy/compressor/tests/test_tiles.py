@@ -0,0 +1,36 @@
+import io
+from unittest import mock
+
+import numpy as np
+
+from compressor.src.codec import Decoder
+from compressor.src.compressor import HuffmanCompressor
+
+from .utils import CompressorTestCase, photo
+
+
+class TileTests(CompressorTestCase):
+    def test_tiling(self):
+        pixels = photo(150, 203)
+        source = self.save(pixels, 'photo.png')
+        for tile_size in (None, 64, (50, 300), (7, 9)):
+            self.assertRoundtrip(pixels, source, tile_size=tile_size, predictor='auto')
+
+    def test_workers(self):
+        pixels = photo(128, 128)
+        source = self.save(pixels, 'photo.png')
+        single, _ = self.compress(source, tile_size=32, predictor='auto')
+        for executor in ('thread', 'spawn'):
+            data, _ = self.compress(source, tile_size=32, predictor='auto', workers=3, executor=executor)
+            self.assertEqual(data, single)
+            decoded = Decoder(workers=3, executor=executor).decompress(io.BytesIO(data))
+            np.testing.assert_array_equal(decoded, pixels)
+
+    def test_single_tile_runs_inline(self):
+        pixels = photo(64, 64)
+        data, _ = self.compress(self.save(pixels, 'photo.png'), tile_size=128)
+        with mock.patch.object(HuffmanCompressor, 'make_pool', side_effect=AssertionError("pool started")):
+            decoded = Decoder(workers=4, executor='spawn').decompress(io.BytesIO(data))
+            crop = Decoder(workers=4, executor='spawn').crop(io.BytesIO(data), 5, 5, 20, 20)
+        np.testing.assert_array_equal(decoded, pixels)
+        np.testing.assert_array_equal(np.asarray(crop), pixels[5:20, 5:20])
@@ -0,0 +1,76 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from compressor.src.codec import Decoder
+
+from .utils import CompressorTestCase, compressed_image, photo, quiet_logs, temp_media
+
+
+def corrupt(path, offset):
+    with open(path, 'r+b') as file:
+        file.seek(offset)
+        byte = file.read(1)[0]
+        file.seek(offset)
+        file.write(bytes([byte ^ 0x10]))
+
+
+class CorruptionTests(CompressorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pixels = photo(96, 96)
+        self.data, _ = self.compress(self.save(self.pixels, 'photo.png'), tile_size=32, predictor='auto')
+
+    def test_intact_file_verifies(self):
+        self.assertEqual(Decoder().verify(io.BytesIO(self.data), decode=True), [])
+
+    def test_corrupt_block_is_detected(self):
+        data = bytearray(self.data)
+        data[len(data) // 2] ^= 0x10
+        errors = Decoder().verify(io.BytesIO(bytes(data)))
+        self.assertEqual(len(errors), 1)
+        self.assertIn('CRC', errors[0].error)
+        with self.assertRaises(ValueError):
+            Decoder().decompress(io.BytesIO(bytes(data)))
+
+    def test_corrupt_header_is_detected(self):
+        data = bytearray(self.data)
+        data[12] ^= 0x01
+        with self.assertRaises(ValueError):
+            Decoder().decompress(io.BytesIO(bytes(data)))
+        with self.assertRaises(ValueError):
+            Decoder().verify(io.BytesIO(bytes(data)))
+
+
+class VerifyCommandTests(TestCase):
+    def setUp(self):
+        quiet_logs(self)
+        temp_media(self)
+        self.files = [compressed_image(photo(100, 100, seed=seed), f'{seed}.png').file_loc for seed in range(3)]
+
+    def verify(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('verify', '--workers', '1', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_files_the_database_knows(self):
+        stdout, _ = self.verify('--decode')
+        self.assertIn('3 intact, 0 corrupt', stdout)
+
+    def test_corrupt_blocks_are_named(self):
+        corrupt(self.files[1], os.path.getsize(self.files[1]) - 100)
+        stderr = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '2 intact, 1 corrupt'):
+            call_command('verify', '--workers', '1', stdout=io.StringIO(), stderr=stderr)
+        self.assertIn(f'{self.files[1]} block', stderr.getvalue())
+        self.assertIn('CRC', stderr.getvalue())
+
+    def test_paths(self):
+        stdout, _ = self.verify(self.files[0], '-v', '2')
+        self.assertIn(f'{self.files[0]} ok', stdout)
+        self.assertIn('1 intact, 0 corrupt', stdout)
+        # directories are searched for .huf files, previews are skipped
+        self.assertIn('3 intact', self.verify(settings.COMPRESSOR_BLOB_ROOT)[0])
@@ -0,0 +1,127 @@
+import io
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from compressor.src.codec import Decoder, Encoder
+
+
+def photo(rows, cols, channels=3, bits=8, seed=0):
+    # smooth gradients plus a little noise and a flat band, like a photo with sky in it
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:rows, 0:cols]
+    base = (np.sin(x / (20 + seed)) + np.cos(y / 15) + 2) * (1 << (bits - 3)) + x * 0.2
+    planes = [base + rng.normal(0, 3, base.shape) + 10 * channel for channel in range(max(channels, 1))]
+    pixels = np.stack(planes, -1) if channels else planes[0]
+    pixels[:rows // 4] = 3 << (bits - 3)
+    return pixels.clip(0, (1 << bits) - 1).astype(np.uint8 if bits <= 8 else np.uint16)
+
+
+def write_dng(path, mosaic, make='Test', model='Cam'):
+    # smallest DNG libraw reads: one uncompressed strip of an RGGB mosaic, Pillow cannot open it
+    rows, cols = mosaic.shape
+    pixels = mosaic.astype('<u2').tobytes()
+    text = lambda value: value.encode() + b'\0'
+    # (tag, TIFF type, struct format, values) in tag order
+    tags = [(254, 4, 'I', [0]), (256, 4, 'I', [cols]), (257, 4, 'I', [rows]), (258, 3, 'H', [16]),
+            (259, 3, 'H', [1]), (262, 3, 'H', [32803]), (271, 2, 's', text(make)), (272, 2, 's', text(model)),
+            (273, 4, 'I', [0]), (277, 3, 'H', [1]), (278, 4, 'I', [rows]), (279, 4, 'I', [len(pixels)]),
+            (284, 3, 'H', [1]), (33421, 3, 'H', [2, 2]), (33422, 1, 'B', [0, 1, 1, 2]),
+            (50706, 1, 'B', [1, 4, 0, 0]), (50721, 10, 'i', [1, 1, 0, 1, 0, 1, 0, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 1])]
+    payloads = [bytes(values) if kind == 2 else struct.pack(f'<{len(values)}{fmt}', *values)
+                for code, kind, fmt, values in tags]
+    extra_offset = 8 + 2 + 12 * len(tags) + 4
+    data_offset = extra_offset + sum(len(payload) for payload in payloads if len(payload) > 4)
+    ifd, extra = struct.pack('<H', len(tags)), b''
+    for (code, kind, fmt, values), payload in zip(tags, payloads):
+        count = len(values) // 2 if kind == 10 else len(values)
+        if code == 273:
+            payload = struct.pack('<I', data_offset)
+        if len(payload) <= 4:
+            ifd += struct.pack('<HHI', code, kind, count) + payload.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('<HHII', code, kind, count, extra_offset + len(extra))
+            extra += payload
+    with open(path, 'wb') as file:
+        file.write(b'II*\0' + struct.pack('<I', 8) + ifd + struct.pack('<I', 0) + extra + pixels)
+    return path
+
+
+def quiet_logs(test):
+    # the compressor logger prints every stage to the console, warnings are still caught by assertLogs
+    logging.disable(logging.INFO)
+    test.addCleanup(logging.disable, logging.NOTSET)
+
+
+def temp_media(test, **overrides):
+    # uploads, blobs, dictionaries and previews go to a folder removed after the test, tiles are
+    # coded inline and small tiles keep test images multi-tile
+    media = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media)
+    settings = override_settings(**dict({
+        'MEDIA_ROOT': media,
+        'COMPRESSOR_BLOB_ROOT': os.path.join(media, 'blobs'),
+        'COMPRESSOR_DICTIONARY_DIR': os.path.join(media, 'dictionaries'),
+        'COMPRESSOR_WORKERS': 1,
+        'COMPRESSOR_TILE_SIZE': (64, 64),
+        'COMPRESSOR_PREVIEW_SIZES': (32, 64),
+    }, **overrides))
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return media
+
+
+def upload(pixels, name='photo.png'):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, os.path.splitext(name)[1][1:].replace('jpg', 'jpeg'))
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def compressed_image(pixels, name='photo.png'):
+    # a CompressedImage made the way an upload's job makes it, call inside temp_media
+    from compressor import jobs
+    from compressor.models import CompressionJob, RawImage
+    return jobs.compress(CompressionJob.objects.create(original=RawImage.store(upload(pixels, name))))
+
+
+def fresh_cache(test):
+    # the render cache lives as long as the process, each test starts with an empty one
+    from compressor import cache
+    patch = mock.patch.object(cache, '_cache', None)
+    patch.start()
+    test.addCleanup(patch.stop)
+
+
+class CompressorTestCase(SimpleTestCase):
+    def setUp(self):
+        quiet_logs(self)
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def save(self, pixels, name):
+        # .npy sources are read a band at a time, PNGs are decoded whole
+        path = os.path.join(self.folder, name)
+        if name.endswith('.npy'):
+            np.save(path, pixels)
+        else:
+            Image.fromarray(pixels).save(path)
+        return path
+
+    def compress(self, img_file, **options):
+        output = io.BytesIO()
+        encoder = Encoder(**options)
+        encoder.compress_to(img_file, output)
+        return output.getvalue(), encoder.coder
+
+    def assertRoundtrip(self, pixels, img_file, **options):
+        data, coder = self.compress(img_file, **options)
+        np.testing.assert_array_equal(Decoder().decompress(io.BytesIO(data)), pixels, err_msg=str(options))
+        return data, coder
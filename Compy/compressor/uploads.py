@@ -0,0 +1,29 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+from compressor.src.hashing import HASH_CHUNK, sha256_chunks
+
+
+def file_hash(file):
+    # sha256 of a django File, read in chunks
+    return sha256_chunks(file.chunks(HASH_CHUNK))
+
+
+class HashingUploadHandler(FileUploadHandler):
+    # sits in front of the default handlers and hashes every uploaded file as its chunks arrive,
+    # the digests end up in request.upload_hashes keyed by form field
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_hashes'):
+            self.request.upload_hashes = {}
+        self.request.upload_hashes[self.field_name] = self.digest.hexdigest()
+        # the next handler builds the file itself
+        return None
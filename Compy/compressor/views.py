@@ -2,35 +2,53 @@ from django.shortcuts import render, get_object_or_404, redirect
 
 
 # Create your views here.
-from django.http import HttpResponse, FileResponse
-from .models import RawImage, CompressedImage
+from django.http import HttpResponse, HttpResponseBadRequest, FileResponse, JsonResponse, Http404
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.urls import reverse
+from .models import RawImage, CompressedImage, CompressionJob
 from .forms import RawImageUploadForm
-from compressor.src.compressor import HuffmanCompressor
+from . import jobs
+from django.views.decorators.http import condition
+from .blobs import RangeReader, byte_range
+from .cache import render_cache
+from compressor.src.codec import Decoder
+from datetime import datetime, timedelta, timezone
+import io
 import os 
-from PIL import Image
 
 # Create your views here.
+def view_decoder():
+    # decoder for requests, see COMPRESSOR_VIEW_EXECUTOR
+    return Decoder(workers=settings.COMPRESSOR_WORKERS, executor=settings.COMPRESSOR_VIEW_EXECUTOR,
+                   dictionary_dir=settings.COMPRESSOR_DICTIONARY_DIR)
+
+
 def upload_image(request):
     if request.method == 'POST':
         form = RawImageUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            new_image = form.save()  # save form 
-            # perform compression 
-
-            hc = HuffmanCompressor(img_file=new_image.image.path)     
-
-            # saving img data
-            compressed_img = CompressedImage.objects.create(
-                original=new_image,
-                file_size=hc.raw_size,
-                compressed_image=hc.compressed_img,
-                compressed_size=hc.compressed_size,
-                size_reduction=str(hc.reduction),
-                file_loc='assets/original/testing',
-            )
-            compressed_img.save()
-
-            return redirect('compressed_image_detail', pk=compressed_img.pk) 
+            # identical content is stored once and compressed once
+            new_image = RawImage.store(form.cleaned_data['image'], getattr(request, 'upload_hashes', {}).get('image'))
+            compressed_img = jobs.find_compressed(new_image)
+            if compressed_img is not None:
+                return redirect('compressed_image_detail', pk=compressed_img.pk)
+            pending = jobs.pending_job(new_image)
+            if pending is not None:
+                return redirect('compression_job', pk=pending.pk)
+
+            # queue compression, the job page follows it until the CompressedImage exists
+            job = CompressionJob.objects.create(original=new_image)
+            try:
+                jobs.submit(job)
+            except jobs.QueueFull:
+                job.status = CompressionJob.FAILED
+                job.error = "compression queue is full"
+                job.save(update_fields=['status', 'error'])
+                return HttpResponse("[Compression queue is full, try again later]", status=503)
+
+            return redirect('compression_job', pk=job.pk)
         else:
             return HttpResponse("[Invalid Image]")
     else:
@@ -38,24 +56,322 @@ def upload_image(request):
     return render(request, 'compressor/upload_raw_image.html', {'form': form})
 
 
+def compression_job(request, pk):
+    job = get_object_or_404(CompressionJob, pk=pk)
+    return render(request, 'compressor/job.html', {'job': job})
+
+
+def compression_job_status(request, pk):
+    job = get_object_or_404(CompressionJob, pk=pk)
+    return JsonResponse({
+        'job': job.pk,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'compressed_image': job.compressed_id,
+        'detail_url': reverse('compressed_image_detail', args=[job.compressed_id]) if job.compressed_id else None,
+    })
+
+
+# rows per page of the compression history, ?limit= up to HISTORY_MAX
+HISTORY_LIMIT = 50
+HISTORY_MAX = 500
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def history_cursor(compressed_image):
+    # <microseconds since the epoch>.<id> of a row, the next page starts right after it
+    moment = compressed_image.compressed_at - EPOCH
+    return f'{(moment.days * 86400 + moment.seconds) * 1000000 + moment.microseconds}.{compressed_image.pk}'
+
+
+def parse_history_cursor(cursor):
+    # (compressed_at, id) of a history_cursor, ValueError when it is not one
+    micros, pk = cursor.split('.')
+    return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def compression_history(request):
+    # past compressions newest first, ?cursor= the next_cursor of the previous page; pages are found with the
+    # (compressed_at, id) index instead of an OFFSET, so the last page costs what the first one does
+    try:
+        limit = min(int(request.GET.get('limit', HISTORY_LIMIT)), HISTORY_MAX)
+        cursor = request.GET.get('cursor')
+        after = parse_history_cursor(cursor) if cursor else None
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest("[Invalid cursor or limit]")
+    if limit <= 0:
+        return HttpResponseBadRequest("[Invalid cursor or limit]")
+    rows = (CompressedImage.objects.select_related('original')
+            .only('compressed_at', 'file_size', 'compressed_size', 'size_reduction', 'entropy_coder',
+                  'original__image', 'original__uploaded_at')
+            .order_by('-compressed_at', '-id'))
+    if after is not None:
+        rows = rows.filter(Q(compressed_at__lt=after[0]) | Q(compressed_at=after[0], id__lt=after[1]))
+    # one row past the page tells whether there is another one
+    rows = list(rows[:limit + 1])
+    page = rows[:limit]
+    return JsonResponse({
+        'results': [{
+            'id': row.pk,
+            'original': row.original_id,
+            'name': os.path.basename(row.original.image.name),
+            'uploaded_at': row.original.uploaded_at,
+            'compressed_at': row.compressed_at,
+            'file_size': row.file_size,
+            'compressed_size': row.compressed_size,
+            'size_reduction': row.size_reduction,
+            'entropy_coder': row.entropy_coder,
+            'detail_url': reverse('compressed_image_detail', args=[row.pk]),
+        } for row in page],
+        'next_cursor': history_cursor(page[-1]) if len(rows) > limit else None,
+    })
+
+
+def compression_stats(request):
+    # totals over every compression, computed by the database in one query
+    totals = CompressedImage.objects.aggregate(
+        count=Count('id'),
+        raw_bytes=Sum('file_size'),
+        compressed_bytes=Sum('compressed_size'),
+        bytes_saved=Sum(F('file_size') - F('compressed_size')),
+        mean_reduction=Avg('size_reduction'),
+        first_compressed_at=Min('compressed_at'),
+        last_compressed_at=Max('compressed_at'),
+    )
+    for key in ('raw_bytes', 'compressed_bytes', 'bytes_saved'):
+        totals[key] = totals[key] or 0
+    return JsonResponse(totals)
+
+
 def compressed_image_detail(request, pk):
     compressed_image = get_object_or_404(CompressedImage, pk=pk)
-    return render(request, 'compressor/compressed.html', {'compressed_image': compressed_image})
+    sizes = sorted(settings.COMPRESSOR_PREVIEW_SIZES)
+    return render(request, 'compressor/compressed.html', {'compressed_image': compressed_image,
+                                                          'preview_size': sizes[0] if sizes else None,
+                                                          'full_preview_size': sizes[-1] if sizes else None})
+
+
+# formats decompress_and_display renders, picked with ?format=
+RENDER_FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png')}
+
+
+def render_format(request):
+    fmt = request.GET.get('format', 'jpeg').lower()
+    return fmt if fmt in RENDER_FORMATS else 'jpeg'
 
 
+def file_version(compressed_image):
+    # changes whenever the compressed file is rewritten, None if it is missing
+    try:
+        stat = os.stat(compressed_image.file_loc)
+    except (OSError, TypeError):
+        return None
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def display_etag(request, pk):
+    compressed_image = CompressedImage.objects.filter(pk=pk).first()
+    version = compressed_image and file_version(compressed_image)
+    return f'{pk}-{version}-{render_format(request)}' if version else None
+
+
+def display_last_modified(request, pk):
+    compressed_image = CompressedImage.objects.filter(pk=pk).first()
+    if compressed_image is None or file_version(compressed_image) is None:
+        return None
+    return datetime.fromtimestamp(os.path.getmtime(compressed_image.file_loc), tz=timezone.utc)
+
+
+@condition(etag_func=display_etag, last_modified_func=display_last_modified)
 def decompress_and_display(request, pk):
+    # rendered bytes and decoded pixels are cached per file version, browsers revalidate with the ETag
     compressed_image = get_object_or_404(CompressedImage, pk=pk)
+    fmt = render_format(request)
+    version = file_version(compressed_image)
+    cache = render_cache()
+    body = cache.get((pk, version, fmt))
+    if body is None:
+        # numpy and PIL are only loaded once something has to be decoded
+        import numpy as np
+        from PIL import Image
+
+        pixels = cache.get((pk, version, 'pixels'))
+        if pixels is None:
+            decoder = view_decoder()
+            image = decoder.to_image(decoder.decompress(compressed_image.file_loc))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')  # jpeg has no alpha or palette
+            pixels = np.asarray(image)
+            cache.put((pk, version, 'pixels'), pixels)
+        output = io.BytesIO()
+        Image.fromarray(pixels).save(output, RENDER_FORMATS[fmt][0])
+        body = output.getvalue()
+        cache.put((pk, version, fmt), body)
+    return HttpResponse(body, content_type=RENDER_FORMATS[fmt][1])
+
+
+# thumbnails fit in ?size= pixels, THUMBNAIL_SIZE without one and at most THUMBNAIL_MAX
+THUMBNAIL_SIZE = 256
+THUMBNAIL_MAX = 2048
+
+
+def region_box(request):
+    # (left, top, right, bottom) of ?x=&y=&width=&height= in displayed pixels, None without a width and
+    # height; ValueError when they are not positive whole numbers
+    if 'width' not in request.GET and 'height' not in request.GET:
+        return None
+    x, y = int(request.GET.get('x', 0)), int(request.GET.get('y', 0))
+    width, height = int(request.GET.get('width', 0)), int(request.GET.get('height', 0))
+    if x < 0 or y < 0 or width <= 0 or height <= 0:
+        raise ValueError("x and y must not be negative, width and height must be positive")
+    return x, y, x + width, y + height
+
+
+def region_etag(request, pk):
+    etag = display_etag(request, pk)
+    return etag and f"{etag}-{'-'.join(request.GET.get(key, '') for key in ('x', 'y', 'width', 'height', 'size'))}"
+
+
+def render_region(request, pk, thumbnail):
+    # a box of the image, or a thumbnail of the image or a box of it; only the tiles under the box are
+    # decoded, unless decompress_and_display already left the whole image's pixels in the cache or a
+    # stored preview is sharp enough for the thumbnail
+    compressed_image = get_object_or_404(CompressedImage, pk=pk)
+    fmt = render_format(request)
+    version = file_version(compressed_image)
+    if version is None:
+        raise Http404("compressed file is missing")
+    try:
+        box = region_box(request)
+        size = min(int(request.GET.get('size', THUMBNAIL_SIZE)), THUMBNAIL_MAX) if thumbnail else None
+    except ValueError as error:
+        return HttpResponseBadRequest(f"[Invalid region: {error}]")
+    if box is None and not thumbnail:
+        return HttpResponseBadRequest("[Invalid region: width and height are required]")
+    if size is not None and size <= 0:
+        return HttpResponseBadRequest("[Invalid region: size must be positive]")
+    cache = render_cache()
+    key = (pk, version, fmt, box, size)
+    body = cache.get(key)
+    if body is None:
+        from PIL import Image
+
+        pixels = cache.get((pk, version, 'pixels'))
+        if pixels is not None:
+            image = Image.fromarray(pixels)
+            if box is not None and (box[0] >= image.width or box[1] >= image.height):
+                return HttpResponseBadRequest("[Invalid region: the region lies outside the image]")
+            if box is not None:
+                image = image.crop((box[0], box[1], min(box[2], image.width), min(box[3], image.height)))
+            if size is not None:
+                image.thumbnail((size, size))
+        else:
+            decoder = view_decoder()
+            try:
+                if thumbnail:
+                    image = decoder.thumbnail(compressed_image.file_loc, size, box, settings.COMPRESSOR_PREVIEW_SIZES)
+                else:
+                    image = decoder.crop(compressed_image.file_loc, *box)
+            except ValueError as error:
+                return HttpResponseBadRequest(f"[Invalid region: {error}]")
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, RENDER_FORMATS[fmt][0])
+        body = output.getvalue()
+        cache.put(key, body)
+    return HttpResponse(body, content_type=RENDER_FORMATS[fmt][1])
+
+
+@condition(etag_func=region_etag, last_modified_func=display_last_modified)
+def decompress_crop(request, pk):
+    # ?x=&y=&width=&height= of the displayed image, latency follows the box rather than the image
+    return render_region(request, pk, thumbnail=False)
+
+
+@condition(etag_func=region_etag, last_modified_func=display_last_modified)
+def decompress_thumbnail(request, pk):
+    # the image, or the box ?x=&y=&width=&height= of it, scaled to fit ?size= pixels
+    return render_region(request, pk, thumbnail=True)
+
+
+def preview_etag(request, pk, size):
+    compressed_image = CompressedImage.objects.filter(pk=pk).first()
+    version = compressed_image and file_version(compressed_image)
+    return f'{pk}-{version}-preview-{size}' if version else None
+
+
+@condition(etag_func=preview_etag)
+def compressed_preview(request, pk, size):
+    # a preview made while the image was compressed, served straight from its file without decoding;
+    # results compressed before previews existed get theirs made from a thumbnail once
+    from compressor.src.previews import PREVIEW_FORMAT, preview_path, save_previews
+
+    compressed_image = get_object_or_404(CompressedImage, pk=pk)
+    if size not in settings.COMPRESSOR_PREVIEW_SIZES:
+        raise Http404("no preview of that size")
+    if file_version(compressed_image) is None:
+        raise Http404("compressed file is missing")
+    path = preview_path(compressed_image.file_loc, size)
+    if not os.path.exists(path):
+        decoder = view_decoder()
+        image = decoder.thumbnail(compressed_image.file_loc, size)
+        save_previews({size: image if image.mode in ('RGB', 'L') else image.convert('RGB')},
+                      compressed_image.file_loc)
+    return FileResponse(open(path, 'rb'), content_type=PREVIEW_FORMAT[2])
+
+
+def download_etag(request, pk):
+    compressed_image = CompressedImage.objects.filter(pk=pk).first()
+    return compressed_image.checksum or None if compressed_image else None
+
+
+@condition(etag_func=download_etag)
+def download_compressed(request, pk):
+    # streams the compressed file from the blob store, a single Range is answered with 206
+    compressed_image = get_object_or_404(CompressedImage, pk=pk)
+    try:
+        file = open(compressed_image.file_loc, 'rb')
+    except (OSError, TypeError):
+        raise Http404("compressed file is missing")
+    size = os.fstat(file.fileno()).st_size
+    filename = os.path.splitext(os.path.basename(compressed_image.original.image.name))[0] + '.huf'
+    # a range only applies to the version the client already has part of
+    if_range = request.headers.get('If-Range')
+    requested = None
+    if not if_range or if_range.strip('"') == compressed_image.checksum:
+        requested = byte_range(request.headers.get('Range'), size)
+    if requested is False:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if requested is None:
+        response = FileResponse(file, as_attachment=True, filename=filename,
+                                content_type='application/octet-stream')
+    else:
+        start, stop = requested
+        file.seek(start)
+        response = FileResponse(RangeReader(file, stop - start), as_attachment=True, filename=filename,
+                                content_type='application/octet-stream', status=206)
+        response['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response['Content-Length'] = stop - start
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
 
-    compressor = HuffmanCompressor(img_file=None)  
-    encoded_img = compressor.load_compressed_img(compressed_image.img_file)
+def metrics_view(request):
+    # p50/p95 seconds and throughput per compressor stage in this process, with the counters
+    sink = apps.get_app_config('compressor').metrics_sink
+    if sink is None:
+        raise Http404("metrics are off")
+    return JsonResponse(dict(sink.snapshot(), cache=render_cache().counters()))
 
-    decompressed_data = compressor.decode_image(encoded_img)
 
-    image = Image.fromarray(decompressed_data)
-    response = HttpResponse(content_type="image/jpeg")
-    image.save(response, "JPEG")
-    image_url = 'assets/Compy/originals/microsoft_office_outlook_logo_icon_145721_tkrJbz5.png'
-    return render(request, 'decompress.html', {'image_url': image_url})
+def cache_stats(request):
+    # hit, miss and eviction counters of the decoded image cache
+    return JsonResponse(render_cache().counters())
 
 
 def save_compressed_data_to_file(data, filename):